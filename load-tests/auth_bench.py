@@ -0,0 +1,64 @@
+
+"""
+Microbenchmark of per-request auth overhead (src/auth/token_utils.py).
+
+Compares a full HMAC verification and JSON decode on every call (the
+behaviour before the verified-token cache) with the cached fast path, both
+for decode_token alone and for the verify_token dependency.
+
+Run from the repository root:
+    python load-tests/auth_bench.py --iterations 100000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from src.auth import token_utils  # noqa: E402
+
+
+def per_call_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    token = token_utils.create_token("bench-user")
+    header = f"Bearer {token}"
+    secret, algorithm = token_utils.JWT_SECRET, token_utils.JWT_ALGORITHM
+    loop = asyncio.new_event_loop()
+
+    def uncached():
+        return jwt.decode(token, secret, algorithms=[algorithm])
+
+    def verify_uncached():
+        token_utils._verified_tokens.clear()
+        return loop.run_until_complete(token_utils.verify_token(header))
+
+    def verify_cached():
+        return loop.run_until_complete(token_utils.verify_token(header))
+
+    results = {
+        "decode (full verification)": per_call_us(uncached, args.iterations),
+        "decode_token (cached)": per_call_us(lambda: token_utils.decode_token(token), args.iterations),
+        "verify_token (cache cleared every call)": per_call_us(verify_uncached, args.iterations),
+        "verify_token (cached)": per_call_us(verify_cached, args.iterations),
+    }
+    loop.close()
+
+    for name, us in results.items():
+        print(f"{name:<42} {us:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
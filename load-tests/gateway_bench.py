@@ -0,0 +1,412 @@
+"""
+End-to-end benchmark of the gateway against local stub upstreams.
+
+Starts the stub OpenAI, Hugging Face and ElevenLabs servers
+(stub_upstreams.py) and the gateway (src/serve.py, --workers processes) as
+subprocesses, then drives each endpoint with a closed-loop async load
+generator. Proxy scenarios are also run directly against the stubs with the
+same load, so the report shows the latency the gateway adds on top of the
+upstream: added pXX = gateway pXX - direct pXX. The AG-UI scenario has no
+upstream; it reports time to first event and the tool-result round trip
+(posting /agui/tool-result until the stream's next event).
+
+Prompts are unique per request, so the response caches are always missed.
+Results are saved as JSON to compare runs between commits.
+
+Run from the repository root:
+    python load-tests/gateway_bench.py --output bench-$(git rev-parse --short HEAD).json
+    python load-tests/gateway_bench.py --compare bench-old.json bench-new.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+JWT_SECRET = "gateway-bench-secret-not-for-production-use"
+os.environ["JWT_SECRET"] = JWT_SECRET
+
+sys.path.insert(0, ROOT)
+from src.auth.token_utils import create_token  # noqa: E402
+from stub_upstreams import PORTS, add_arguments as add_stub_arguments  # noqa: E402
+
+VOICE_ID = "EXAVITQu4vr4xnSDxMaL"
+HF_MODEL = "mistralai/Mistral-7B-Instruct-v0.2"
+
+Timings = Dict[str, Optional[float]]
+Call = Callable[[httpx.AsyncClient, int], Awaitable[Timings]]
+
+
+class BenchError(Exception):
+    pass
+
+
+async def timed_request(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> Timings:
+    """Total time and time to first body byte of one request, reading the whole body"""
+    start = time.perf_counter()
+    first = None
+    async with client.stream(method, url, **kwargs) as response:
+        if response.status_code >= 400:
+            await response.aread()
+            raise BenchError(f"{method} {url}: {response.status_code} {response.text[:200]}")
+        async for _ in response.aiter_raw():
+            if first is None:
+                first = time.perf_counter()
+    end = time.perf_counter()
+    return {"latency": end - start, "ttfb": (first or end) - start}
+
+
+class Scenario:
+    def __init__(self, name: str, gateway: Call, direct: Optional[Call] = None, agui: bool = False):
+        self.name = name
+        self.gateway = gateway
+        self.direct = direct
+        self.agui = agui
+
+
+def build_scenarios(gateway_url: str, stubs: Dict[str, str], run_id: str) -> List[Scenario]:
+    headers = {"Authorization": f"Bearer {create_token('bench-user')}"}
+
+    def prompt(i: int) -> str:
+        return f"Benchmark prompt {run_id}-{i}"
+
+    def openai_payload(i: int, stream: bool) -> Dict[str, Any]:
+        return {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": prompt(i)}],
+                "temperature": 0.7, "stream": stream}
+
+    async def agui_session(client: httpx.AsyncClient, i: int) -> Timings:
+        session_id = f"bench-{run_id}-{i}"
+        start = time.perf_counter()
+        first = tool_posted = tool_round_trip = None
+        async with client.stream("GET", f"{gateway_url}/agui/stream-token",
+                                 params={"session_id": session_id, "prompt": prompt(i)}) as response:
+            if response.status_code >= 400:
+                raise BenchError(f"stream-token: {response.status_code}")
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                now = time.perf_counter()
+                if first is None:
+                    first = now
+                if tool_posted is not None and tool_round_trip is None:
+                    tool_round_trip = now - tool_posted
+                event = json.loads(line[5:])
+                if event["type"] == "tool":
+                    tool_posted = time.perf_counter()
+                    r = await client.post(f"{gateway_url}/agui/tool-result", json={
+                        "session_id": session_id, "tool_name": event["toolName"], "result": {"documents": []},
+                    })
+                    if r.status_code >= 400:
+                        raise BenchError(f"tool-result: {r.status_code}")
+                elif event["type"] == "done":
+                    break
+        return {"latency": time.perf_counter() - start, "ttfe": first - start, "tool_round_trip": tool_round_trip}
+
+    return [
+        Scenario(
+            "health",
+            lambda c, i: timed_request(c, "GET", f"{gateway_url}/health"),
+        ),
+        Scenario(
+            "openai_chat",
+            lambda c, i: timed_request(c, "POST", f"{gateway_url}/proxy/openai/chat",
+                                       json={"prompt": prompt(i)}, headers=headers),
+            lambda c, i: timed_request(c, "POST", f"{stubs['openai']}/v1/chat/completions",
+                                       json=openai_payload(i, False)),
+        ),
+        Scenario(
+            "openai_chat_raw",
+            lambda c, i: timed_request(c, "POST", f"{gateway_url}/proxy/openai/chat",
+                                       json={"prompt": prompt(i), "raw": True}, headers=headers),
+            lambda c, i: timed_request(c, "POST", f"{stubs['openai']}/v1/chat/completions",
+                                       json=openai_payload(i, False)),
+        ),
+        Scenario(
+            "openai_chat_stream",
+            lambda c, i: timed_request(c, "POST", f"{gateway_url}/proxy/openai/chat",
+                                       json={"prompt": prompt(i), "stream": True}, headers=headers),
+            lambda c, i: timed_request(c, "POST", f"{stubs['openai']}/v1/chat/completions",
+                                       json=openai_payload(i, True)),
+        ),
+        Scenario(
+            "huggingface_generate",
+            lambda c, i: timed_request(c, "POST", f"{gateway_url}/proxy/huggingface/generate",
+                                       json={"prompt": prompt(i)}, headers=headers),
+            lambda c, i: timed_request(c, "POST", f"{stubs['huggingface']}/models/{HF_MODEL}",
+                                       json={"inputs": prompt(i), "parameters": {"temperature": 0.7}}),
+        ),
+        Scenario(
+            "elevenlabs_tts_stream",
+            lambda c, i: timed_request(c, "POST", f"{gateway_url}/proxy/elevenlabs/tts",
+                                       json={"text": prompt(i), "stream": True}, headers=headers),
+            lambda c, i: timed_request(c, "POST", f"{stubs['elevenlabs']}/v1/text-to-speech/{VOICE_ID}/stream",
+                                       json={"text": prompt(i), "model_id": "eleven_multilingual_v2"}),
+        ),
+        Scenario("agui_stream_token", agui_session, agui=True),
+    ]
+
+
+async def run_load(client: httpx.AsyncClient, call: Call, requests: int, concurrency: int, offset: int = 0):
+    """Run `requests` calls with `concurrency` workers; returns samples by metric, errors and elapsed time"""
+    counter = itertools.count(offset)
+    end = offset + requests
+    samples: Dict[str, List[float]] = {}
+    errors: List[str] = []
+
+    async def worker():
+        while True:
+            i = next(counter)
+            if i >= end:
+                return
+            try:
+                timings = await call(client, i)
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            for metric, value in timings.items():
+                if value is not None:
+                    samples.setdefault(metric, []).append(value)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, errors, time.perf_counter() - start
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+    }
+
+
+async def measure(client: httpx.AsyncClient, call: Call, requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    if warmup:
+        await run_load(client, call, warmup, concurrency, offset=10 ** 9)
+    samples, errors, elapsed = await run_load(client, call, requests, concurrency)
+    completed = len(samples.get("latency", []))
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "first_errors": errors[:3],
+        "throughput_rps": completed / elapsed if elapsed else 0.0,
+        "metrics": {metric: summarize(values) for metric, values in samples.items()},
+    }
+
+
+def added_latency(gateway: Dict[str, Any], direct: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    added = {}
+    for metric in ("latency", "ttfb"):
+        g, d = gateway["metrics"].get(metric), direct["metrics"].get(metric)
+        if g and d:
+            added[metric] = {key: g[key] - d[key] for key in ("mean_ms", "p50_ms", "p95_ms", "p99_ms")}
+    return added
+
+
+async def wait_until_listening(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise BenchError(f"{url} exited with code {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise BenchError(f"{url} did not start within {timeout:.0f}s")
+
+
+def stub_command(args) -> List[str]:
+    command = [sys.executable, os.path.join(ROOT, "load-tests", "stub_upstreams.py"), "--host", args.host]
+    for name in PORTS:
+        command += [f"--{name}-port", str(getattr(args, f"{name}_port"))]
+    command += [
+        "--latency", str(args.latency),
+        "--chunk-interval", str(args.chunk_interval),
+        "--stream-chunks", str(args.stream_chunks),
+        "--audio-chunks", str(args.audio_chunks),
+        "--audio-chunk-bytes", str(args.audio_chunk_bytes),
+        "--embedding-dim", str(args.embedding_dim),
+    ]
+    return command
+
+
+def gateway_env(args, stubs: Dict[str, str], data_dir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": stubs["openai"],
+        "HUGGINGFACE_BASE_URL": stubs["huggingface"],
+        "ELEVENLABS_BASE_URL": stubs["elevenlabs"],
+        "OPENAI_API_KEY": "bench",
+        "HUGGINGFACE_API_KEY": "bench",
+        "ELEVENLABS_API_KEY": "bench",
+        "JWT_SECRET": JWT_SECRET,
+        "KEYS_FILE": os.path.join(data_dir, "keys.json"),
+        "AUDIO_CACHE_DIR": os.path.join(data_dir, "audio"),
+        "VECTOR_DATA_DIR": os.path.join(data_dir, "vectors"),
+        "LOG_DIR": os.path.join(data_dir, "logs"),
+        "USAGE_LEDGER_DIR": os.path.join(data_dir, "usage"),
+        "TOKENIZER_DIR": os.path.join(data_dir, "tokenizers"),
+        # Measure the gateway, not the per-user rate limits
+        "RATE_LIMIT_USER_RATE": "0",
+        "RATE_LIMIT_KEY_RATE": "0",
+    })
+    for item in args.gateway_env:
+        name, _, value = item.partition("=")
+        env[name] = value
+    return env
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    print(f"{'scenario':<24}{'rps':>9}{'errors':>8}  {'gateway p50/p95/p99 ms':>26}  {'added p50/p95/p99 ms':>24}")
+    for name, result in results["scenarios"].items():
+        gateway = result["gateway"]
+        latency = gateway["metrics"].get("latency")
+        total = f"{latency['p50_ms']:7.2f} {latency['p95_ms']:8.2f} {latency['p99_ms']:8.2f}" if latency else "-"
+        added = result.get("added", {}).get("latency")
+        if added:
+            extra = f"{added['p50_ms']:7.2f} {added['p95_ms']:8.2f} {added['p99_ms']:8.2f}"
+        else:
+            extra = "-"
+        print(f"{name:<24}{gateway['throughput_rps']:9.1f}{gateway['errors']:8d}  {total:>26}  {extra:>24}")
+        for metric in ("ttfe", "tool_round_trip"):
+            stats = gateway["metrics"].get(metric)
+            if stats:
+                print(f"{'  ' + metric:<41}  {stats['p50_ms']:7.2f} {stats['p95_ms']:8.2f} {stats['p99_ms']:8.2f}")
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Print the change in throughput and gateway-added latency between two result files"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('meta', {}).get('commit')} -> {new.get('meta', {}).get('commit')}")
+    for name, result in new["scenarios"].items():
+        before = old["scenarios"].get(name)
+        if before is None:
+            continue
+        print(name)
+        old_rps, new_rps = before["gateway"]["throughput_rps"], result["gateway"]["throughput_rps"]
+        change = (new_rps - old_rps) / old_rps * 100 if old_rps else 0.0
+        print(f"  {'throughput_rps':<22}{old_rps:10.1f} -> {new_rps:10.1f}  ({change:+.1f}%)")
+        # Added latency where there is a direct baseline, otherwise the gateway's own metrics
+        old_metrics = before.get("added") or before["gateway"]["metrics"]
+        new_metrics = result.get("added") or result["gateway"]["metrics"]
+        for metric, stats in new_metrics.items():
+            if metric not in old_metrics:
+                continue
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                print(f"  {metric + ' ' + key:<22}{old_metrics[metric][key]:10.2f} -> {stats[key]:10.2f}")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def bench(args) -> Dict[str, Any]:
+    stubs = {name: f"http://{args.host}:{getattr(args, f'{name}_port')}" for name in PORTS}
+    gateway_url = f"http://{args.host}:{args.gateway_port}"
+    processes = []
+    with tempfile.TemporaryDirectory(prefix="gateway-bench-") as data_dir:
+        try:
+            processes.append(subprocess.Popen(stub_command(args)))
+            processes.append(subprocess.Popen(
+                [sys.executable, "serve.py", "--host", args.host, "--port", str(args.gateway_port),
+                 "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+                cwd=os.path.join(ROOT, "src"), env=gateway_env(args, stubs, data_dir),
+            ))
+            for url, process in zip([stubs["openai"], gateway_url + "/health"], processes):
+                await wait_until_listening(url, process)
+            for url in stubs.values():
+                await wait_until_listening(url, processes[0])
+
+            run_id = str(int(time.time()))
+            scenarios = [s for s in build_scenarios(gateway_url, stubs, run_id)
+                         if not args.scenarios or s.name in args.scenarios]
+            limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+            results: Dict[str, Any] = {}
+            async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+                for scenario in scenarios:
+                    requests = args.agui_requests if scenario.agui else args.requests
+                    warmup = 0 if scenario.agui else args.warmup
+                    result: Dict[str, Any] = {
+                        "gateway": await measure(client, scenario.gateway, requests, args.concurrency, warmup)
+                    }
+                    if scenario.direct is not None:
+                        result["direct"] = await measure(client, scenario.direct, requests, args.concurrency, warmup)
+                        result["added"] = added_latency(result["gateway"], result["direct"])
+                    results[scenario.name] = result
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "scenarios": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_stub_arguments(parser)
+    parser.add_argument("--gateway-port", type=int, default=9100)
+    parser.add_argument("--workers", type=int, default=1, help="gateway worker processes (serve.py)")
+    parser.add_argument("--gateway-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra environment for the gateway (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per proxy scenario")
+    parser.add_argument("--agui-requests", type=int, default=64, help="AG-UI sessions (each takes ~4.5 s)")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--scenarios", nargs="*", help="run only these scenarios")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = asyncio.run(bench(args))
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
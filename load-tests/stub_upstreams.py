@@ -0,0 +1,123 @@
+"""
+Local stand-ins for the OpenAI, Hugging Face and ElevenLabs APIs.
+
+Each provider is served on its own port with the request and response
+shapes the gateway uses, including streamed completions and audio. Every
+response waits --latency seconds before its headers; streamed bodies then
+send one chunk every --chunk-interval seconds. Used by gateway_bench.py,
+and can be run on its own to point a local gateway at:
+    python load-tests/stub_upstreams.py --latency 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:9101 HUGGINGFACE_BASE_URL=http://127.0.0.1:9102 \\
+        ELEVENLABS_BASE_URL=http://127.0.0.1:9103 ...
+"""
+import argparse
+import asyncio
+import json
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+PORTS = {"openai": 9101, "huggingface": 9102, "elevenlabs": 9103}
+
+
+def openai_app(args) -> Starlette:
+    async def chat(request):
+        body = await request.json()
+        await asyncio.sleep(args.latency)
+        prompt = body["messages"][-1]["content"]
+        if body.get("stream"):
+            async def chunks():
+                for i in range(args.stream_chunks):
+                    delta = {"choices": [{"index": 0, "delta": {"content": f"token{i} "}}]}
+                    yield f"data: {json.dumps(delta)}\n\n"
+                    await asyncio.sleep(args.chunk_interval)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+        return JSONResponse({
+            "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": f"Reply to: {prompt}"}}],
+            "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": 4, "total_tokens": len(prompt.split()) + 4},
+        })
+
+    async def embeddings(request):
+        await request.json()
+        await asyncio.sleep(args.latency)
+        return JSONResponse({"data": [{"index": 0, "embedding": [0.01] * args.embedding_dim}]})
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat, methods=["POST"]),
+        Route("/v1/embeddings", embeddings, methods=["POST"]),
+    ])
+
+
+def huggingface_app(args) -> Starlette:
+    async def generate(request):
+        body = await request.json()
+        await asyncio.sleep(args.latency)
+        inputs = body["inputs"]
+        if isinstance(inputs, list):
+            return JSONResponse([[{"generated_text": f"Reply to: {text}"}] for text in inputs])
+        if body.get("stream"):
+            async def chunks():
+                for i in range(args.stream_chunks):
+                    yield f"data:{json.dumps({'token': {'text': f'token{i} '}})}\n\n"
+                    await asyncio.sleep(args.chunk_interval)
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+        return JSONResponse([{"generated_text": f"Reply to: {inputs}"}])
+
+    return Starlette(routes=[Route("/models/{model:path}", generate, methods=["POST"])])
+
+
+def elevenlabs_app(args) -> Starlette:
+    chunk = b"\xff\xfb" * (args.audio_chunk_bytes // 2)
+
+    async def speech(request):
+        await request.json()
+        await asyncio.sleep(args.latency)
+        if request.url.path.endswith("/stream"):
+            async def chunks():
+                for _ in range(args.audio_chunks):
+                    yield chunk
+                    await asyncio.sleep(args.chunk_interval)
+            return StreamingResponse(chunks(), media_type="audio/mpeg")
+        return Response(chunk * args.audio_chunks, media_type="audio/mpeg")
+
+    return Starlette(routes=[Route("/v1/text-to-speech/{voice:path}", speech, methods=["POST"])])
+
+
+APPS = {"openai": openai_app, "huggingface": huggingface_app, "elevenlabs": elevenlabs_app}
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--host", default="127.0.0.1")
+    for name, port in PORTS.items():
+        parser.add_argument(f"--{name}-port", type=int, default=port)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before response headers")
+    parser.add_argument("--chunk-interval", type=float, default=0.005, help="seconds between streamed chunks")
+    parser.add_argument("--stream-chunks", type=int, default=20)
+    parser.add_argument("--audio-chunks", type=int, default=8)
+    parser.add_argument("--audio-chunk-bytes", type=int, default=4096)
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+
+
+async def serve(args) -> None:
+    servers = [
+        uvicorn.Server(uvicorn.Config(
+            make_app(args), host=args.host, port=getattr(args, f"{name}_port"),
+            log_level="warning", access_log=False,
+        ))
+        for name, make_app in APPS.items()
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+
+"""
+Benchmark for the embedded vector index (src/services/vector_index.py).
+
+Builds synthetic clustered collections, then reports queries per second for
+exact and IVF search and the recall@k of IVF against brute force.
+
+Run from the repository root:
+    python load-tests/vector_index_bench.py --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from src.services.vector_index import IVF_NPROBE, normalize, open_snapshot, write_collection  # noqa: E402
+
+
+def synthetic_vectors(count: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """Gaussian clusters, closer to real embeddings than uniform noise"""
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 100000):
+        end = min(start + 100000, count)
+        noise = rng.normal(scale=0.35, size=(end - start, dim)).astype(np.float32)
+        vectors[start:end] = centers[labels[start:end]] + noise
+    return vectors
+
+
+def measure_qps(snapshot, queries: np.ndarray, k: int, exact: bool, nprobe: int):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(snapshot.search(query, k, exact=exact, nprobe=nprobe))
+    elapsed = time.perf_counter() - start
+    return len(queries) / elapsed, results
+
+
+def recall(approx, exact) -> float:
+    hits = total = 0
+    for approx_rows, exact_rows in zip(approx, exact):
+        expected = {r["id"] for r in exact_rows}
+        hits += len(expected & {r["id"] for r in approx_rows})
+        total += len(expected)
+    return hits / total if total else 1.0
+
+
+def run(size: int, args, rng: np.random.Generator, data_dir: str):
+    vectors = synthetic_vectors(size, args.dim, max(16, size // 1000), rng)
+    path = os.path.join(data_dir, f"bench_{size}")
+
+    start = time.perf_counter()
+    write_collection(path, vectors, ivf_threshold=0)  # always build the IVF index
+    build_seconds = time.perf_counter() - start
+
+    snapshot = open_snapshot(path)
+    picks = rng.integers(0, size, size=args.queries)
+    queries = normalize(vectors[picks] + rng.normal(scale=0.1, size=(args.queries, args.dim)))
+    del vectors
+
+    exact_qps, exact_results = measure_qps(snapshot, queries, args.k, True, args.nprobe)
+    ivf_qps, ivf_results = measure_qps(snapshot, queries, args.k, False, args.nprobe)
+    snapshot.close()
+
+    return {
+        "vectors": size,
+        "dim": args.dim,
+        "k": args.k,
+        "nlist": snapshot.ivf.nlist,
+        "nprobe": args.nprobe,
+        "build_seconds": round(build_seconds, 2),
+        "exact_qps": round(exact_qps, 1),
+        "ivf_qps": round(ivf_qps, 1),
+        "ivf_recall": round(recall(ivf_results, exact_results), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, default=IVF_NPROBE)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        for size in args.sizes:
+            result = run(size, args, rng, data_dir)
+            results.append(result)
+            print(
+                f"{result['vectors']:>9} vectors  exact {result['exact_qps']:>9.1f} qps  "
+                f"ivf {result['ivf_qps']:>9.1f} qps  recall@{args.k} {result['ivf_recall']:.3f}  "
+                f"(nlist={result['nlist']}, nprobe={result['nprobe']}, build {result['build_seconds']}s)"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
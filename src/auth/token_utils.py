@@ -1,11 +1,16 @@
 
 """
 Authentication token utilities for API access
+
+jwt (which loads cryptography) is imported on first use, keeping it out of
+the gateway's cold start.
 """
-import jwt
 from fastapi import HTTPException, Header, Depends, Request
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import hashlib
+import time
 import os
 
 # JWT configuration
@@ -13,6 +18,13 @@ JWT_SECRET = os.environ.get("JWT_SECRET", "your-secret-key-change-in-production"
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# Verified-token cache: token digest -> (payload, exp)
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+_verified_tokens: "OrderedDict[bytes, Tuple[Dict, float]]" = OrderedDict()
+
+# Revoked tokens: token digest -> exp (kept until the token would expire anyway)
+_revoked_tokens: Dict[bytes, float] = {}
+
 def create_token(user_id: str) -> str:
     """Create a new JWT token for a user"""
     payload = {
@@ -21,32 +33,99 @@ def create_token(user_id: str) -> str:
         "iat": datetime.utcnow()
     }
     
+    import jwt
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+def _token_digest(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
 def decode_token(token: str) -> Dict:
-    """Decode and validate a JWT token"""
+    """
+    Decode and validate a JWT token.
+    
+    Tokens that already passed verification are served from a bounded LRU
+    until their `exp`. JWT_SECRET is read once at import, so rotating it
+    means a restart, which starts with an empty cache. Revoked tokens are
+    rejected before any cache lookup.
+    """
+    digest = _token_digest(token)
+    now = time.time()
+    
+    if _revoked_tokens and digest in _revoked_tokens:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    
+    cached = _verified_tokens.get(digest)
+    if cached is not None:
+        payload, exp = cached
+        if exp > now:
+            _verified_tokens.move_to_end(digest)
+            return payload
+        del _verified_tokens[digest]
+        raise HTTPException(status_code=401, detail="Token expired")
+    
+    import jwt
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    
+    # Only tokens with an expiry are cached, so entries can never outlive them
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)) and TOKEN_CACHE_SIZE > 0:
+        _verified_tokens[digest] = (payload, float(exp))
+        if len(_verified_tokens) > TOKEN_CACHE_SIZE:
+            _verified_tokens.popitem(last=False)
+    return payload
+
+def token_revocation(token: str) -> Tuple[bytes, float]:
+    """The digest a revocation is keyed by and when it can be forgotten"""
+    import jwt
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.InvalidTokenError:
+        exp = None
+    if not isinstance(exp, (int, float)):
+        exp = time.time() + JWT_EXPIRATION_HOURS * 3600
+    return _token_digest(token), float(exp)
+
+def revoke_digest(digest: bytes, exp: float) -> None:
+    """
+    Apply a revocation from token_revocation(), e.g. one made by another
+    worker
+    """
+    _verified_tokens.pop(digest, None)
+    now = time.time()
+    if exp > now:
+        _revoked_tokens[digest] = exp
+    
+    # Forget revocations for tokens that have expired anyway
+    for expired in [d for d, e in _revoked_tokens.items() if e <= now]:
+        del _revoked_tokens[expired]
+
+def revoke_token(token: str) -> None:
+    """Reject a token from now on, even if it is still cached as verified"""
+    revoke_digest(*token_revocation(token))
 
 async def verify_token(authorization: Optional[str] = Header(None)) -> Dict:
     """Verify JWT token from Authorization header"""
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header missing")
     
-    scheme, token = authorization.split()
-    if scheme.lower() != "bearer":
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
         raise HTTPException(status_code=401, detail="Invalid authentication scheme")
     
     payload = decode_token(token)
     return payload
 
-def get_current_user(payload: Dict = Depends(verify_token)) -> str:
-    """Extract user ID from token payload"""
+async def get_current_user(payload: Dict = Depends(verify_token)) -> str:
+    """
+    Extract user ID from token payload.
+    
+    Async so FastAPI resolves it on the event loop instead of the threadpool.
+    """
     user_id = payload.get("sub")
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token payload")
@@ -1,18 +1,167 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Body
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Body
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from pydantic_core import to_json
+from typing import Optional, List, Dict, Any, AsyncGenerator, Awaitable, Callable, Tuple
+from contextlib import asynccontextmanager
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+import asyncio
+import hashlib
 import httpx
+import logging
 import os
 import json
+import time
+from datetime import datetime, timezone
 from secrets.manager import get_api_key, list_available_keys, set_api_key, delete_api_key
-from auth.token_utils import verify_token, get_current_user
+from secrets import manager as secrets_manager
+from auth.token_utils import verify_token, get_current_user, token_revocation, revoke_digest, JWT_EXPIRATION_HOURS
 from fastapi.middleware.cors import CORSMiddleware
 from services.agui_listener import router as agui_router  # Import the AG-UI router
+from services import agui_listener
+from services import upstream_pool
+from services.upstream_pool import get_client, pool_stats, request_timeout
+from services.response_cache import response_cache, cache_key
+from services.single_flight import in_flight
+from services.audio_cache import audio_cache, audio_digest, is_digest, parse_range
+from services.admission import admission
+from services.circuit_breaker import circuit_breakers, failover_chain, is_upstream_failure
+from services import metrics
+from services.shared_state import shared_state
+from services.token_counter import token_counter
+from services.usage_ledger import usage_ledger, LedgerUnavailable
+from services.startup import startup_profile
+from services.micro_batcher import MicroBatcher
+from services.model_router import model_router, is_routed, NoRoute
+from services import deadlines
+from services.deadlines import DeadlineExceeded, DeadlineMiddleware
+from services.retries import upstream_retries
+from services.log_pipeline import log_pipeline, AccessLogMiddleware
+
+logger = logging.getLogger(__name__)
+
+# ===== Shared State =====
+# With several workers (serve.py), key rotations and token revocations made
+# on one worker are published to the others through the shared-state broker.
+WORKER_ID = str(os.getpid())
+KEYS_CHANNEL = "secrets:changed"
+REVOCATIONS_CHANNEL = "auth:revoked"
+REVOKED_TOKENS_KEY = "auth:revoked_tokens"
+
+async def on_keys_changed(message: Dict[str, Any]):
+    await secrets_manager.reload()
+
+async def on_token_revoked(message: Dict[str, Any]):
+    revoke_digest(bytes.fromhex(message["digest"]), message["exp"])
+
+async def join_workers():
+    """Follow the other workers' changes, including revocations made before this worker started"""
+    if not shared_state.enabled:
+        return
+    await shared_state.subscribe(KEYS_CHANNEL, on_keys_changed)
+    await shared_state.subscribe(REVOCATIONS_CHANNEL, on_token_revoked)
+    for digest, exp in (await shared_state.call("hgetall", REVOKED_TOKENS_KEY)).items():
+        revoke_digest(bytes.fromhex(digest), float(exp))
+
+async def share_revocation(digest: bytes, exp: float):
+    if not shared_state.enabled:
+        return
+    await shared_state.call("hset", REVOKED_TOKENS_KEY, {digest.hex(): str(exp)})
+    # Kept as long as any token issued here can live
+    await shared_state.call("expire", REVOKED_TOKENS_KEY, JWT_EXPIRATION_HOURS * 3600)
+    await shared_state.publish(REVOCATIONS_CHANNEL, {"digest": digest.hex(), "exp": exp})
+
+# ===== Startup =====
+# Modules imported on first use rather than with main; prewarming imports them
+PREWARM_IMPORTS = (
+    "jwt",
+    "cryptography.fernet",
+    "numpy",
+    "services.vector_index",
+    "services.vector_ingest",
+    "sse_starlette.sse",
+)
+
+# Upstreams whose clients and connections are prewarmed, when their key is set
+UPSTREAM_KEYS = {
+    "openai": "OPENAI_API_KEY",
+    "huggingface": "HUGGINGFACE_API_KEY",
+    "elevenlabs": "ELEVENLABS_API_KEY",
+}
+UPSTREAM_PREWARM = os.environ.get("UPSTREAM_PREWARM", "true").lower() in ("1", "true", "yes")
+
+async def prewarm_imports():
+    for module in PREWARM_IMPORTS:
+        await asyncio.to_thread(startup_profile.load, module)
+
+async def prewarm_upstreams():
+    names = [name for name, key in UPSTREAM_KEYS.items() if get_api_key(key)]
+    if UPSTREAM_PREWARM:
+        return await upstream_pool.prewarm(names)
+
+# Needed before the first request
+INIT_STEPS: Dict[str, Callable[[], Awaitable[Any]]] = {
+    "logging": log_pipeline.startup,
+    "shared_state": shared_state.startup,
+    "audio_cache": audio_cache.load,
+    "agui": agui_listener.startup,
+    "usage_ledger": usage_ledger.startup,
+    "join_workers": join_workers,
+}
+
+# Done on first use otherwise; in order, since upstreams need the keys
+PREWARM_STEPS: Dict[str, Callable[[], Awaitable[Any]]] = {
+    "imports": prewarm_imports,
+    "secrets": secrets_manager.startup,
+    "tokenizers": token_counter.preload,
+    "upstreams": prewarm_upstreams,
+    "response_cache": response_cache.purge_expired,
+}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create shared resources on startup and release them on shutdown.
+    
+    Prewarm steps run before the app accepts requests, or in the
+    background after that with STARTUP_MODE=lazy.
+    """
+    for name, step in INIT_STEPS.items():
+        await startup_profile.step("init", name, step)
+    if startup_profile.mode == "eager":
+        await startup_profile.run_prewarm(PREWARM_STEPS)
+    metrics_push = asyncio.create_task(metrics.push_snapshots(shared_state, WORKER_ID)) if shared_state.enabled else None
+    startup_profile.mark_ready()
+    if startup_profile.mode == "lazy":
+        startup_profile.prewarm_in_background(PREWARM_STEPS)
+    try:
+        yield
+    finally:
+        await startup_profile.mark_stopping()
+        if metrics_push is not None:
+            metrics_push.cancel()
+        await agui_listener.shutdown()
+        # Let streams that just ended record their usage before the ledger's last flush
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await usage_ledger.shutdown()
+        await admission.shutdown()
+        await upstream_pool.shutdown()
+        await secrets_manager.shutdown()
+        await shared_state.shutdown()
+        await log_pipeline.shutdown()
+
+async def keys_loaded() -> None:
+    """
+    Hold a request until the key store is loaded (STARTUP_MODE=lazy), without
+    blocking the loop. Only routes that read keys depend on it, so the health
+    probes and /metrics answer while prewarming runs.
+    """
+    await secrets_manager.ensure_loaded()
 
 app = FastAPI(
     title="MCP - Model Control Panel",
     description="Unified API gateway for AI models and services",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS configuration
@@ -24,6 +173,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request deadlines from the X-Request-Timeout and X-Request-Deadline headers
+app.add_middleware(DeadlineMiddleware)
+
+# Sampled access log (LOG_DIR/access.jsonl)
+app.add_middleware(AccessLogMiddleware)
+
+# Outermost, so latency includes the other middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Include the AG-UI router
 app.include_router(agui_router)
 
@@ -34,6 +192,12 @@ class ChatRequest(BaseModel):
     user: Optional[str] = None
     temperature: float = 0.7
     max_tokens: Optional[int] = None
+    stream: bool = False  # Relay upstream tokens as Server-Sent Events
+    raw: bool = False  # Return the provider's response body unchanged (no cache or failover)
+    # Constraints for model="auto" or "auto:<class>"
+    max_cost: Optional[float] = None  # USD per million tokens
+    min_context: Optional[int] = None  # Context window in tokens
+    timeout: Optional[float] = None  # Seconds the client will wait, like X-Request-Timeout
 
 class CompletionResult(BaseModel):
     completion: str
@@ -44,6 +208,7 @@ class TextToSpeechRequest(BaseModel):
     text: str
     voice_id: str = "EXAVITQu4vr4xnSDxMaL"  # Default voice ID (Eleven Labs - Sarah)
     model_id: str = "eleven_multilingual_v2"
+    stream: bool = False  # Return the audio itself (chunked audio/mpeg) instead of a URL
 
 class AudioResult(BaseModel):
     audio_url: str
@@ -53,11 +218,23 @@ class VectorSearchRequest(BaseModel):
     query: str
     collection: str
     limit: int = 5
+    vector: Optional[List[float]] = None  # Query embedding; `query` is embedded when omitted
+    filter: Optional[Dict[str, Any]] = None  # Metadata equality filter (list value = any of)
+    exact: bool = False  # Force a brute-force scan on IVF-indexed collections
 
 class VectorSearchResult(BaseModel):
     results: List[Dict[str, Any]]
     query: str
 
+class VectorDeleteRequest(BaseModel):
+    ids: List[str]
+
+class VectorWriteResult(BaseModel):
+    collection: str
+    upserted: int
+    deleted: int
+    count: int
+
 class APIKeyRequest(BaseModel):
     key: str
     service: str
@@ -66,8 +243,36 @@ class StatusResponse(BaseModel):
     status: str
     message: str
 
+class RevokeTokenRequest(BaseModel):
+    token: str
+
+class UsageReport(BaseModel):
+    start: float  # Epoch seconds, widened to whole hours
+    end: float
+    granularity: str
+    rows: List[Dict[str, Any]]
+
+class BatchChatRequest(BaseModel):
+    items: List[ChatRequest]
+    concurrency: Optional[int] = None  # Defaults to BATCH_DEFAULT_CONCURRENCY
+
+# Batch limits
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+BATCH_DEFAULT_CONCURRENCY = int(os.environ.get("BATCH_DEFAULT_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "32"))
+
+# ===== Audit =====
+def audit(request: Request, user: str, action: str, outcome: str, **fields: Any) -> None:
+    """Record an admin action (succeeded, failed or denied) in the audit log"""
+    log_pipeline.audit(action, actor=user, outcome=outcome,
+                       client=request.client.host if request.client else None, **fields)
+
+def fingerprint(secret: str) -> str:
+    """Tells secrets apart in the audit log without revealing them"""
+    return hashlib.sha256(secret.encode()).hexdigest()[:12]
+
 # ===== API Key Management =====
-@app.get("/admin/keys", response_model=List[str])
+@app.get("/admin/keys", response_model=List[str], dependencies=[Depends(keys_loaded)])
 async def list_keys(user: str = Depends(get_current_user)):
     """List all available API keys (names only)"""
     if user != "admin":
@@ -75,54 +280,544 @@ async def list_keys(user: str = Depends(get_current_user)):
     
     return list_available_keys()
 
-@app.put("/admin/keys/{service}", response_model=StatusResponse)
+@app.put("/admin/keys/{service}", response_model=StatusResponse, dependencies=[Depends(keys_loaded)])
 async def update_key(
     service: str, 
     data: APIKeyRequest,
+    request: Request,
     user: str = Depends(get_current_user)
 ):
     """Update or create an API key"""
     if user != "admin":
+        audit(request, user, "key.update", "denied", service=service)
         raise HTTPException(status_code=403, detail="Only admin users can update keys")
     
-    if set_api_key(service, data.key):
+    # Encrypting and rewriting the keys file is blocking I/O
+    if await asyncio.to_thread(set_api_key, service, data.key):
+        audit(request, user, "key.update", "success", service=service, key_fingerprint=fingerprint(data.key))
+        await shared_state.publish(KEYS_CHANNEL, {"service": service})
         return StatusResponse(
             status="success",
             message=f"API key for {service} has been updated"
         )
     else:
+        audit(request, user, "key.update", "failed", service=service)
         raise HTTPException(status_code=500, detail="Failed to update API key")
 
-@app.delete("/admin/keys/{service}", response_model=StatusResponse)
+@app.delete("/admin/keys/{service}", response_model=StatusResponse, dependencies=[Depends(keys_loaded)])
 async def remove_key(
     service: str,
+    request: Request,
     user: str = Depends(get_current_user)
 ):
     """Remove an API key"""
     if user != "admin":
+        audit(request, user, "key.delete", "denied", service=service)
         raise HTTPException(status_code=403, detail="Only admin users can delete keys")
     
-    if delete_api_key(service):
+    if await asyncio.to_thread(delete_api_key, service):
+        audit(request, user, "key.delete", "success", service=service)
+        await shared_state.publish(KEYS_CHANNEL, {"service": service})
         return StatusResponse(
             status="success",
             message=f"API key for {service} has been removed"
         )
     else:
+        audit(request, user, "key.delete", "failed", service=service)
         raise HTTPException(status_code=500, detail="Failed to remove API key")
 
+# ===== Streaming =====
+async def open_upstream_stream(
+    upstream: str,
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    service: str
+) -> httpx.Response:
+    """
+    Send a request upstream without reading the body.
+    
+    Errors are raised before any bytes go to the client, so they still map
+    to regular HTTP error responses (and failures to open are retried). The
+    upstream slot taken for the request is held until the response is
+    closed, and the upstream's circuit breaker sees whether the stream
+    opened.
+    """
+    return await upstream_retries.call(
+        upstream, lambda: open_upstream_stream_once(upstream, url, headers, payload, service)
+    )
+
+async def open_upstream_stream_once(
+    upstream: str,
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    service: str
+) -> httpx.Response:
+    breaker = circuit_breakers.check(upstream)
+    try:
+        limiter = await admission.acquire(upstream, upstream_credential(headers))
+    except BaseException:
+        breaker.release_probe()
+        raise
+    client = get_client(upstream)
+    try:
+        request = client.build_request("POST", url, headers=headers, json=payload,
+                                       timeout=request_timeout(upstream))
+        async with deadlines.bounded(service):
+            r = await client.send(request, stream=True)
+    except BaseException as e:
+        limiter.release()
+        if isinstance(e, httpx.RequestError):
+            e = upstream_unreachable(e, service)
+        if isinstance(e, DeadlineExceeded):
+            breaker.release_probe()
+        else:
+            breaker.record(is_upstream_failure(e))
+        raise e
+    admission.release_on_close(r, limiter)
+    
+    if r.status_code != 200:
+        error = None
+        try:
+            async with deadlines.bounded(service):
+                body = await r.aread()
+            error = upstream_error(r, service, body.decode(errors="replace"))
+        finally:
+            await r.aclose()
+            breaker.record(error is None or is_upstream_failure(error))
+        raise error
+    # Time to first byte is not comparable to full call latency, so no sample
+    breaker.record(False)
+    return r
+
+def upstream_error(r: httpx.Response, service: str, body: Optional[str] = None) -> HTTPException:
+    """An upstream error response as an HTTPException, keeping its Retry-After"""
+    retry_after = r.headers.get("Retry-After")
+    return HTTPException(status_code=r.status_code, 
+                         detail=f"{service} API error: {r.text if body is None else body}",
+                         headers={"Retry-After": retry_after} if retry_after else None)
+
+def upstream_unreachable(e: httpx.RequestError, service: str) -> HTTPException:
+    """A 503 for a failed upstream call, or a 504 when the client's deadline cut it short"""
+    if isinstance(e, httpx.TimeoutException) and deadlines.client_deadline_passed():
+        return DeadlineExceeded(f"Request deadline exceeded waiting for {service}")
+    return HTTPException(status_code=503, 
+                         detail=f"Error communicating with {service}: {str(e)}")
+
+def upstream_credential(headers: Dict[str, str]) -> str:
+    """The API key an upstream request is made with (for per-key rate limits)"""
+    return headers.get("Authorization") or headers.get("xi-api-key") or ""
+
+def sse_response(events: AsyncGenerator[str, None]) -> Response:
+    """Server-Sent Events response (sse_starlette is imported on first use)"""
+    from sse_starlette.sse import EventSourceResponse
+    return EventSourceResponse(events)
+
+# Work a request leaves running after its response, such as recording a
+# stream's usage. Referenced here so it is not garbage-collected midway
+background_tasks: set = set()
+
+def background_task_done(task: asyncio.Task) -> None:
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task failed", exc_info=task.exception())
+
+def run_in_background(coro: Awaitable[Any]) -> asyncio.Task:
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_task_done)
+    return task
+
+async def relay_sse(r: httpx.Response, usage: Optional["StreamUsage"] = None) -> AsyncGenerator[str, None]:
+    """
+    Relay the data lines of an upstream SSE stream as they arrive.
+    
+    The SSE response cancels this generator when the client disconnects;
+    closing the upstream response then aborts the upstream request. The
+    stream's token usage is recorded when it ends, however it ends.
+    """
+    try:
+        async for line in deadlines.bounded_iter(r.aiter_lines(), "the upstream stream"):
+            if line.startswith("data:"):
+                data = line[5:].strip()
+                if usage is not None:
+                    usage.observe(data)
+                yield data
+    finally:
+        await r.aclose()
+        if usage is not None:
+            run_in_background(usage.record())
+
+# ===== Responses =====
+class FastJSONResponse(Response):
+    """
+    JSON serialized in one pass by pydantic-core, from models or plain data.
+    
+    Endpoints return it instead of a model so FastAPI does not validate and
+    re-encode a result that was just built from trusted upstream data.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+def model_response(result: BaseModel, response: Response) -> FastJSONResponse:
+    """`result` as JSON, with the headers set on the endpoint's `response`"""
+    return FastJSONResponse(result, headers=dict(response.headers))
+
+# Upstream headers forwarded in raw mode (exact names, then prefixes)
+PASSTHROUGH_HEADERS = {"content-type", "content-encoding", "content-length", "x-request-id"}
+PASSTHROUGH_HEADER_PREFIXES = ("openai-", "x-ratelimit-", "x-compute-")
+
+def passthrough_headers(r: httpx.Response) -> Dict[str, str]:
+    return {
+        name: value for name, value in r.headers.items()
+        if name in PASSTHROUGH_HEADERS or name.startswith(PASSTHROUGH_HEADER_PREFIXES)
+    }
+
+async def relay_raw(r: httpx.Response) -> AsyncGenerator[bytes, None]:
+    """
+    Forward the upstream body as received, still content-encoded, so the
+    gateway neither decodes nor parses it.
+    """
+    try:
+        async for chunk in deadlines.bounded_iter(r.aiter_raw(), "the upstream stream"):
+            yield chunk
+    finally:
+        await r.aclose()
+
+async def upstream_passthrough(
+    upstream: str,
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    service: str,
+    accept_encoding: Optional[str]
+) -> StreamingResponse:
+    """
+    Proxy a request in raw mode: the upstream's body and selected headers,
+    unchanged. The upstream is asked for the encodings the client accepts
+    (`accept_encoding`), or for an unencoded body.
+    """
+    headers = {**headers, "Accept-Encoding": accept_encoding or "identity"}
+    r = await open_upstream_stream(upstream, url, headers, payload, service)
+    response_headers = passthrough_headers(r)
+    response_headers["X-Upstream"] = upstream
+    return StreamingResponse(relay_raw(r), status_code=r.status_code, headers=response_headers)
+
+# ===== Usage =====
+def record_usage(user: str, result: CompletionResult) -> None:
+    """Add a completion's token counts to the usage ledger"""
+    usage = result.usage or {}
+    usage_ledger.record(user, result.model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+
+async def record_prompt_usage(user: str, model: str, prompt: str) -> None:
+    """Record a request whose completion is not parsed (raw mode): prompt tokens only"""
+    prompt_tokens, _ = await token_counter.count_async(model, prompt)
+    usage_ledger.record(user, model, prompt_tokens, 0)
+
+class StreamUsage:
+    """
+    Token usage of a relayed completion stream.
+    
+    Taken from the stream's own usage chunk when the upstream sends one
+    (OpenAI with `stream_options.include_usage`, or the generated token
+    count in TGI's final event), else counted from the relayed text.
+    """
+
+    def __init__(self, user: str, model: str, prompt: str):
+        self.user = user
+        self.model = model
+        self.prompt = prompt
+        self.parts: List[str] = []
+        self.upstream_usage: Optional[Dict[str, Any]] = None
+        self.generated_tokens: Optional[int] = None
+
+    def observe(self, data: str) -> None:
+        try:
+            chunk = json.loads(data)
+        except ValueError:  # [DONE] and other non-JSON lines
+            return
+        if not isinstance(chunk, dict):
+            return
+        if chunk.get("usage"):
+            self.upstream_usage = chunk["usage"]
+        for choice in chunk.get("choices") or ():
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                self.parts.append(content)
+        token = chunk.get("token")
+        if isinstance(token, dict) and not token.get("special") and token.get("text"):
+            self.parts.append(token["text"])
+        details = chunk.get("details")
+        if isinstance(details, dict) and "generated_tokens" in details:
+            self.generated_tokens = details["generated_tokens"]
+
+    async def record(self) -> None:
+        usage = self.upstream_usage
+        if usage is None:
+            usage = await token_counter.usage(self.model, self.prompt, "".join(self.parts))
+            if self.generated_tokens is not None:
+                usage["completion_tokens"] = self.generated_tokens
+        usage_ledger.record(self.user, self.model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+
+@app.get("/usage", response_model=UsageReport)
+async def usage_report(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: str = "day",
+    user: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Token usage per model between `start` and `end` (default: the last 24
+    hours), per hour, day or in total. Text to speech is counted in
+    characters, apart from the tokens. Users see their own usage; admins
+    see every user's, or one user's with `user`.
+    """
+    if current_user != "admin":
+        if user not in (None, current_user):
+            raise HTTPException(status_code=403, detail="Only admin users can view other users' usage")
+        user = current_user
+    
+    end_ts = utc_timestamp(end) if end else time.time()
+    start_ts = utc_timestamp(start) if start else end_ts - 86400
+    if start_ts >= end_ts:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    try:
+        rows = await usage_ledger.query(start_ts, end_ts, user, granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LedgerUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return FastJSONResponse({
+        "start": start_ts // 3600 * 3600,
+        "end": -(-end_ts // 3600) * 3600,
+        "granularity": granularity,
+        "rows": rows
+    })
+
+def utc_timestamp(value: datetime) -> float:
+    """Epoch seconds of `value`, read as UTC when it has no timezone"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+# ===== Response Cache =====
+def completion_cache_mode(request: Request, data: ChatRequest) -> str:
+    """
+    Decide how a completion request uses the response cache:
+    - "bypass": client sent `X-Cache: bypass` or `Cache-Control: no-cache/no-store`
+    - "cache": deterministic (temperature 0) or client opted in with `X-Cache: allow`
+    - "off": anything else
+    """
+    if cache_bypassed(request):
+        return "bypass"
+    if data.stream:
+        return "off"
+    if data.temperature == 0 or request.headers.get("x-cache", "").lower() == "allow":
+        return "cache"
+    return "off"
+
+def cache_bypassed(request: Request) -> bool:
+    """Whether the client asked to skip caching and request coalescing"""
+    x_cache = request.headers.get("x-cache", "").lower()
+    cache_control = request.headers.get("cache-control", "").lower()
+    return x_cache == "bypass" or "no-cache" in cache_control or "no-store" in cache_control
+
+async def cached_completion(
+    key: Optional[str],
+    response: Optional[Response],
+    fetch: Callable[[], Awaitable[CompletionResult]]
+) -> CompletionResult:
+    """
+    Serve a completion from the cache when `key` is set, else fetch it.
+    
+    Concurrent misses for the same key share a single upstream call.
+    The cache outcome is reported in the X-Cache header of `response`.
+    """
+    if key is None:
+        set_cache_header(response, "BYPASS")
+        return await fetch()
+    
+    cached = await response_cache.get(key)
+    if cached is not None:
+        set_cache_header(response, "HIT")
+        # Stored from a validated result, so no need to validate again
+        return CompletionResult.model_construct(**cached)
+    
+    async def fetch_and_store() -> CompletionResult:
+        result = await fetch()
+        await response_cache.set(key, result.model_dump())
+        return result
+    
+    result = await in_flight.do(key, fetch_and_store)
+    set_cache_header(response, "MISS")
+    return result
+
+def set_cache_header(response: Optional[Response], outcome: str) -> None:
+    if response is not None:
+        response.headers["X-Cache"] = outcome
+
+# ===== Token Management =====
+@app.post("/admin/tokens/revoke", response_model=StatusResponse)
+async def revoke(data: RevokeTokenRequest, request: Request, user: str = Depends(get_current_user)):
+    """Revoke a token before it expires"""
+    if user != "admin":
+        audit(request, user, "token.revoke", "denied", token_fingerprint=fingerprint(data.token))
+        raise HTTPException(status_code=403, detail="Only admin users can revoke tokens")
+    
+    digest, exp = token_revocation(data.token)
+    revoke_digest(digest, exp)
+    audit(request, user, "token.revoke", "success", token_fingerprint=fingerprint(data.token))
+    await share_revocation(digest, exp)
+    return StatusResponse(status="success", message="Token has been revoked")
+
 # ===== Proxy: OpenAI =====
-@app.post("/proxy/openai/chat", response_model=CompletionResult)
-async def proxy_openai_chat(data: ChatRequest, token: Dict = Depends(verify_token)):
-    """Proxy endpoint for OpenAI chat completions"""
+@app.post("/proxy/openai/chat", response_model=CompletionResult, dependencies=[Depends(keys_loaded)])
+async def proxy_openai_chat(
+    data: ChatRequest,
+    request: Request,
+    response: Response,
+    token: Dict = Depends(verify_token)
+):
+    """
+    Proxy endpoint for OpenAI chat completions.
+    
+    Non-streaming requests fail over along FAILOVER_CHAINS when OpenAI is
+    failing or its circuit is open. With `raw`, OpenAI's response body
+    (JSON, or SSE when streaming) is returned unchanged. model="auto" or
+    "auto:<class>" is routed to the best model of any provider.
+    """
+    deadlines.shorten(data.timeout)
+    if is_routed(data.model):
+        return await routed_chat(data, request, response, token)
+    await admission.admit_user(token["sub"], "chat")
+
+    if data.raw:
+        openai_key = get_api_key("OPENAI_API_KEY")
+        if not openai_key:
+            raise HTTPException(status_code=403, detail="OpenAI API key not configured")
+        payload = openai_payload(data)
+        payload["stream"] = data.stream
+        passthrough = await upstream_passthrough("openai", "/v1/chat/completions", openai_headers(openai_key),
+                                                 payload, "OpenAI", request.headers.get("accept-encoding"))
+        await record_prompt_usage(token["sub"], data.model, data.prompt)
+        return passthrough
+
+    if data.stream:
+        openai_key = get_api_key("OPENAI_API_KEY")
+        if not openai_key:
+            raise HTTPException(status_code=403, detail="OpenAI API key not configured")
+        payload = openai_payload(data)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        r = await open_upstream_stream("openai", "/v1/chat/completions", openai_headers(openai_key),
+                                       payload, "OpenAI")
+        return sse_response(relay_sse(r, StreamUsage(token["sub"], data.model, data.prompt)))
+
+    result = await complete_with_failover("openai", data, request, response)
+    record_usage(token["sub"], result)
+    return model_response(result, response)
+
+async def openai_completion(data: ChatRequest, request: Request, response: Response) -> CompletionResult:
+    """A non-streaming OpenAI chat completion, through the response cache"""
     openai_key = get_api_key("OPENAI_API_KEY")
     if not openai_key:
         raise HTTPException(status_code=403, detail="OpenAI API key not configured")
 
-    headers = {
+    headers = openai_headers(openai_key)
+    payload = openai_payload(data)
+
+    key = None
+    if completion_cache_mode(request, data) == "cache":
+        key = cache_key("openai", "/v1/chat/completions", payload)
+    return await cached_completion(
+        key, response, lambda: fetch_openai_completion(headers, payload)
+    )
+
+@app.post("/proxy/openai/chat/batch", dependencies=[Depends(keys_loaded)])
+async def proxy_openai_chat_batch(data: BatchChatRequest, token: Dict = Depends(verify_token)):
+    """
+    Run many chat completions in one call.
+    
+    Items run against OpenAI with bounded concurrency and results are streamed
+    back as NDJSON in completion order. Items for model="auto" or
+    "auto:<class>" are routed among OpenAI's models. Each line carries the input `index`
+    and either a `result` or a per-item `error`. The batch counts as one
+    request against the user's rate limit; its items queue for upstream
+    slots at batch priority.
+    """
+    await admission.admit_user(token["sub"], "batch")
+    openai_key = get_api_key("OPENAI_API_KEY")
+    if not openai_key:
+        raise HTTPException(status_code=403, detail="OpenAI API key not configured")
+    
+    if len(data.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, 
+                          detail=f"Batch exceeds {BATCH_MAX_ITEMS} items")
+    
+    concurrency = data.concurrency or BATCH_DEFAULT_CONCURRENCY
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    
+    return StreamingResponse(
+        run_chat_batch(data.items, openai_headers(openai_key), concurrency, token["sub"]),
+        media_type="application/x-ndjson"
+    )
+
+async def run_chat_batch(
+    items: List[ChatRequest],
+    headers: Dict[str, str],
+    concurrency: int,
+    user: str
+) -> AsyncGenerator[bytes, None]:
+    """Fan batch items out to OpenAI and yield NDJSON lines as they finish"""
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def run_item(index: int, item: ChatRequest) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                if item.stream or item.raw:
+                    raise HTTPException(status_code=400, 
+                                      detail="Streaming and raw mode are not supported in batch requests")
+                if is_routed(item.model):
+                    # Batches run on OpenAI, so only its models are candidates
+                    _, model = await choose_route(item, lambda provider: provider == "openai")
+                    item = item.model_copy(update={"model": model})
+                payload = openai_payload(item)
+                key = None
+                if item.temperature == 0:
+                    key = cache_key("openai", "/v1/chat/completions", payload)
+                result = await cached_completion(
+                    key, None, lambda: fetch_openai_completion(headers, payload)
+                )
+                record_usage(user, result)
+                return {"index": index, "result": result}
+            except HTTPException as e:
+                return {"index": index, "error": {"status_code": e.status_code, "detail": e.detail}}
+            except Exception:
+                # The exception text may carry upstream or internal details
+                logger.exception("Batch item %d failed", index)
+                return {"index": index, "error": {"status_code": 500, "detail": "Internal error"}}
+    
+    tasks = [asyncio.create_task(run_item(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield to_json(await next_done) + b"\n"
+    finally:
+        # Client went away or the batch is done - stop any remaining items
+        for task in tasks:
+            task.cancel()
+
+def openai_headers(openai_key: str) -> Dict[str, str]:
+    return {
         "Authorization": f"Bearer {openai_key}",
         "Content-Type": "application/json"
     }
-    
+
+def openai_payload(data: ChatRequest) -> Dict[str, Any]:
+    """Build the OpenAI chat completions payload for a request"""
     payload = {
         "model": data.model,
         "messages": [{"role": "user", "content": data.prompt}],
@@ -134,32 +829,82 @@ async def proxy_openai_chat(data: ChatRequest, token: Dict = Depends(verify_toke
         
     if data.user:
         payload["user"] = data.user
+    
+    return payload
 
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.post("https://api.openai.com/v1/chat/completions", 
-                               headers=headers, 
-                               json=payload, 
-                               timeout=30.0)
-            
-            if r.status_code != 200:
-                raise HTTPException(status_code=r.status_code, 
-                                  detail=f"OpenAI API error: {r.text}")
-            
-            response = r.json()
-            return CompletionResult(
-                completion=response["choices"][0]["message"]["content"],
-                model=response["model"],
-                usage=response.get("usage")
-            )
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=503, 
-                              detail=f"Error communicating with OpenAI: {str(e)}")
+async def fetch_openai_completion(headers: Dict[str, str], payload: Dict[str, Any]) -> CompletionResult:
+    """Call the OpenAI chat completions API (through its circuit breaker, with retries)"""
+    return await upstream_retries.call(
+        "openai", lambda: circuit_breakers.call("openai", lambda: post_openai_completion(headers, payload))
+    )
+
+async def post_openai_completion(headers: Dict[str, str], payload: Dict[str, Any]) -> CompletionResult:
+    """Call the OpenAI chat completions API and normalize the result"""
+    client = get_client("openai")
+    try:
+        async with admission.upstream("openai", upstream_credential(headers)):
+            async with model_router.track("openai", payload["model"]):
+                async with deadlines.bounded("OpenAI"):
+                    r = await client.post("/v1/chat/completions", 
+                                       headers=headers, 
+                                       json=payload,
+                                       timeout=request_timeout("openai"))
+                
+                if r.status_code != 200:
+                    raise upstream_error(r, "OpenAI")
+        
+        response = r.json()
+        completion = response["choices"][0]["message"]["content"]
+        usage = response.get("usage")
+        if usage is None:
+            usage = await token_counter.usage(response["model"], payload["messages"][-1]["content"], completion)
+        return CompletionResult(completion=completion, model=response["model"], usage=usage)
+    except httpx.RequestError as e:
+        raise upstream_unreachable(e, "OpenAI")
 
 # ===== Proxy: Hugging Face =====
-@app.post("/proxy/huggingface/generate", response_model=CompletionResult)
-async def proxy_huggingface_generate(data: ChatRequest, token: Dict = Depends(verify_token)):
-    """Proxy endpoint for Hugging Face text generation"""
+@app.post("/proxy/huggingface/generate", response_model=CompletionResult, dependencies=[Depends(keys_loaded)])
+async def proxy_huggingface_generate(
+    data: ChatRequest,
+    request: Request,
+    response: Response,
+    token: Dict = Depends(verify_token)
+):
+    """
+    Proxy endpoint for Hugging Face text generation.
+    
+    Non-streaming requests fail over along FAILOVER_CHAINS. With `raw`,
+    the Hugging Face response body is returned unchanged. model="auto" or
+    "auto:<class>" is routed to the best model of any provider.
+    """
+    deadlines.shorten(data.timeout)
+    if is_routed(data.model):
+        return await routed_chat(data, request, response, token)
+    await admission.admit_user(token["sub"], "huggingface")
+
+    if data.raw:
+        model_id, api_url, headers, payload = huggingface_request(data)
+        payload["stream"] = data.stream
+        passthrough = await upstream_passthrough("huggingface", api_url, headers, payload, "Hugging Face",
+                                                 request.headers.get("accept-encoding"))
+        await record_prompt_usage(token["sub"], model_id, data.prompt)
+        return passthrough
+
+    if data.stream:
+        model_id, api_url, headers, payload = huggingface_request(data)
+        payload["stream"] = True
+        r = await open_upstream_stream("huggingface", api_url, headers, payload, "Hugging Face")
+        return sse_response(relay_sse(r, StreamUsage(token["sub"], model_id, data.prompt)))
+
+    result = await complete_with_failover("huggingface", data, request, response)
+    record_usage(token["sub"], result)
+    return model_response(result, response)
+
+# Used when a request keeps ChatRequest's (OpenAI) default model
+HUGGINGFACE_DEFAULT_MODEL = os.environ.get("HUGGINGFACE_DEFAULT_MODEL", "mistralai/Mistral-7B-Instruct-v0.2")
+
+def huggingface_request(data: ChatRequest) -> Tuple[str, str, Dict[str, str], Dict[str, Any]]:
+    """Model id, API path, headers and payload of a Hugging Face generation"""
     hf_key = get_api_key("HUGGINGFACE_API_KEY")
     if not hf_key:
         raise HTTPException(status_code=403, detail="Hugging Face API key not configured")
@@ -170,10 +915,10 @@ async def proxy_huggingface_generate(data: ChatRequest, token: Dict = Depends(ve
     }
     
     # Default to a good open model if none specified
-    model_id = data.model if data.model != "gpt-4o-mini" else "mistralai/Mistral-7B-Instruct-v0.2"
+    model_id = data.model if data.model != "gpt-4o-mini" else HUGGINGFACE_DEFAULT_MODEL
     
     # HF Inference API endpoint
-    api_url = f"https://api-inference.huggingface.co/models/{model_id}"
+    api_url = f"/models/{model_id}"
     
     payload = {
         "inputs": data.prompt,
@@ -183,36 +928,225 @@ async def proxy_huggingface_generate(data: ChatRequest, token: Dict = Depends(ve
             "return_full_text": False
         }
     }
+    return model_id, api_url, headers, payload
 
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.post(api_url, headers=headers, json=payload, timeout=30.0)
-            
-            if r.status_code != 200:
-                raise HTTPException(status_code=r.status_code, 
-                                  detail=f"Hugging Face API error: {r.text}")
-            
-            response = r.json()
-            
-            # Handle different response formats
-            if isinstance(response, list) and len(response) > 0:
-                text = response[0].get("generated_text", "")
-            else:
-                text = response.get("generated_text", "")
+async def huggingface_completion(data: ChatRequest, request: Request, response: Response) -> CompletionResult:
+    """A non-streaming Hugging Face generation, through the response cache"""
+    model_id, api_url, headers, payload = huggingface_request(data)
+
+    key = None
+    if completion_cache_mode(request, data) == "cache":
+        key = cache_key("huggingface", api_url, payload)
+    return await cached_completion(
+        key, response, lambda: fetch_huggingface_completion(api_url, model_id, headers, payload)
+    )
+
+# Micro-batching: with HF_BATCHING on, concurrent generations for the same
+# model, key and parameters are sent as one request with a list of `inputs`
+HF_BATCHING = os.environ.get("HF_BATCHING", "false").lower() in ("1", "true", "yes")
+hf_batcher = MicroBatcher(
+    max_size=int(os.environ.get("HF_BATCH_MAX_SIZE", "8")),
+    max_wait=float(os.environ.get("HF_BATCH_MAX_WAIT_MS", "5")) / 1000
+)
+
+async def fetch_huggingface_completion(
+    api_url: str,
+    model_id: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any]
+) -> CompletionResult:
+    """
+    Call the Hugging Face Inference API (through its circuit breaker, with
+    retries), batched when enabled
+    """
+    if not HF_BATCHING:
+        return await upstream_retries.call("huggingface", lambda: circuit_breakers.call(
+            "huggingface", lambda: post_huggingface_completion(api_url, model_id, headers, payload)
+        ))
+    
+    async def send(inputs: List[str]) -> List[Any]:
+        return await upstream_retries.call("huggingface", lambda: circuit_breakers.call(
+            "huggingface", lambda: post_huggingface_batch(api_url, model_id, headers, payload, inputs)
+        ))
+    
+    key = (api_url, upstream_credential(headers), to_json(payload["parameters"]))
+    return await hf_batcher.submit(key, payload["inputs"], send)
+
+def huggingface_text(output: Any) -> str:
+    """The generated text of one input, from a list or a single result"""
+    if isinstance(output, list):
+        output = output[0] if output else {}
+    return output.get("generated_text", "")
+
+async def post_huggingface_completion(
+    api_url: str,
+    model_id: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any]
+) -> CompletionResult:
+    """Call the Hugging Face Inference API and normalize the result"""
+    client = get_client("huggingface")
+    try:
+        async with admission.upstream("huggingface", upstream_credential(headers)):
+            async with model_router.track("huggingface", model_id):
+                async with deadlines.bounded("Hugging Face"):
+                    r = await client.post(api_url, headers=headers, json=payload,
+                                          timeout=request_timeout("huggingface"))
                 
-            return CompletionResult(
-                completion=text,
-                model=model_id,
-                usage={"prompt_tokens": len(data.prompt), "completion_tokens": len(text)}
-            )
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=503, 
-                              detail=f"Error communicating with Hugging Face: {str(e)}")
+                if r.status_code != 200:
+                    raise upstream_error(r, "Hugging Face")
+        
+        text = huggingface_text(r.json())
+        return CompletionResult(
+            completion=text,
+            model=model_id,
+            usage=await token_counter.usage(model_id, payload["inputs"], text)
+        )
+    except httpx.RequestError as e:
+        raise upstream_unreachable(e, "Hugging Face")
+
+async def post_huggingface_batch(
+    api_url: str,
+    model_id: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    inputs: List[str]
+) -> List[Any]:
+    """
+    Generate for several inputs in one Hugging Face request. Returns a
+    CompletionResult per input, or an HTTPException for inputs that failed.
+    """
+    if len(inputs) == 1:
+        return [await post_huggingface_completion(api_url, model_id, headers, {**payload, "inputs": inputs[0]})]
+    
+    client = get_client("huggingface")
+    try:
+        async with admission.upstream("huggingface", upstream_credential(headers)):
+            async with model_router.track("huggingface", model_id):
+                async with deadlines.bounded("Hugging Face"):
+                    r = await client.post(api_url, headers=headers, json={**payload, "inputs": inputs},
+                                          timeout=request_timeout("huggingface"))
+                
+                if r.status_code != 200:
+                    raise upstream_error(r, "Hugging Face")
+    except httpx.RequestError as e:
+        raise upstream_unreachable(e, "Hugging Face")
+    
+    outputs = r.json()
+    if not isinstance(outputs, list) or len(outputs) != len(inputs):
+        raise HTTPException(status_code=502, 
+                          detail=f"Hugging Face API did not return one result per input ({len(inputs)} inputs)")
+    
+    results: List[Any] = []
+    for prompt, output in zip(inputs, outputs):
+        if isinstance(output, dict) and "error" in output:
+            results.append(HTTPException(status_code=502, detail=f"Hugging Face API error: {output['error']}"))
+            continue
+        text = huggingface_text(output)
+        results.append(CompletionResult(
+            completion=text,
+            model=model_id,
+            usage=await token_counter.usage(model_id, prompt, text)
+        ))
+    return results
+
+# ===== Failover =====
+# Non-streaming completion per provider, for failover chains
+PROVIDER_COMPLETIONS: Dict[str, Callable[[ChatRequest, Request, Response], Awaitable[CompletionResult]]] = {
+    "openai": openai_completion,
+    "huggingface": huggingface_completion,
+}
+
+PROVIDER_KEYS = {
+    "openai": "OPENAI_API_KEY",
+    "huggingface": "HUGGINGFACE_API_KEY",
+}
+
+async def complete_with_failover(
+    provider: str,
+    data: ChatRequest,
+    request: Request,
+    response: Response
+) -> CompletionResult:
+    """
+    Run a completion on `provider`, then on the targets of its failover chain
+    while the previous one fails with an upstream error (5xx, 429) or has
+    its circuit open. Targets without an API key are skipped. The provider
+    that answered is reported in the X-Upstream header.
+    """
+    targets = [(provider, data.model)] + [
+        (target, model) for target, model in failover_chain(provider, data.model)
+        if target in PROVIDER_COMPLETIONS and get_api_key(PROVIDER_KEYS[target])
+    ]
+    for i, (target, model) in enumerate(targets):
+        attempt = data if i == 0 else data.model_copy(update={"model": model})
+        try:
+            result = await PROVIDER_COMPLETIONS[target](attempt, request, response)
+        except HTTPException as e:
+            if i == len(targets) - 1 or isinstance(e, DeadlineExceeded) or not is_upstream_failure(e):
+                raise
+            logger.warning("%s completion failed (%s), failing over to %s", target, e.status_code, targets[i + 1][0])
+            continue
+        response.headers["X-Upstream"] = target
+        return result
+
+# ===== Routing =====
+# Chat endpoint per provider, for routed requests
+PROVIDER_ENDPOINTS: Dict[str, Callable[[ChatRequest, Request, Response, Dict], Awaitable[Any]]] = {
+    "openai": proxy_openai_chat,
+    "huggingface": proxy_huggingface_generate,
+}
+
+def provider_available(provider: str) -> bool:
+    return provider in PROVIDER_ENDPOINTS and bool(get_api_key(PROVIDER_KEYS[provider]))
+
+async def choose_route(data: ChatRequest, available: Callable[[str], bool]) -> Tuple[str, str]:
+    """
+    The (provider, model) the router picks for model="auto" or
+    "auto:<class>", among providers that are `available`. The context window
+    must fit the prompt and `max_tokens`; the prompt is counted with the
+    default (o200k) encoding as no model is known yet.
+    """
+    prompt_tokens, _ = await token_counter.count_async(data.model, data.prompt)
+    min_context = max(data.min_context or 0, prompt_tokens + (data.max_tokens or 0))
+    try:
+        return model_router.choose(data.model, data.max_cost, min_context, available)
+    except NoRoute as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+async def routed_chat(data: ChatRequest, request: Request, response: Response, token: Dict) -> Any:
+    """
+    Run a routed request on the (provider, model) the router picks, as if it
+    had been sent to that provider's endpoint. The choice is reported in the
+    X-Routed-Model header.
+    """
+    provider, model = await choose_route(data, provider_available)
+    routed = f"{provider}:{model}"
+    response.headers["X-Routed-Model"] = routed
+    result = await PROVIDER_ENDPOINTS[provider](data.model_copy(update={"model": model}), request, response, token)
+    if isinstance(result, Response):
+        result.headers["X-Routed-Model"] = routed
+    return result
 
 # ===== Proxy: Eleven Labs =====
-@app.post("/proxy/elevenlabs/tts", response_model=AudioResult)
-async def proxy_elevenlabs_tts(data: TextToSpeechRequest, token: Dict = Depends(verify_token)):
-    """Proxy endpoint for Eleven Labs text-to-speech"""
+# Eleven Labs returns 128 kbps MP3 by default
+TTS_BYTES_PER_SECOND = 128000 / 8
+
+@app.post("/proxy/elevenlabs/tts", response_model=AudioResult, dependencies=[Depends(keys_loaded)])
+async def proxy_elevenlabs_tts(
+    data: TextToSpeechRequest,
+    request: Request,
+    token: Dict = Depends(verify_token)
+):
+    """
+    Proxy endpoint for Eleven Labs text-to-speech.
+    
+    Audio is cached on disk under a digest of the synthesis inputs and served
+    from /audio/generated/{digest}.mp3. With `stream: true` the audio is
+    streamed to the client as it is generated, and written to the cache at
+    the same time.
+    """
+    await admission.admit_user(token["sub"], "tts")
     elevenlabs_key = get_api_key("ELEVENLABS_API_KEY")
     if not elevenlabs_key:
         raise HTTPException(status_code=403, detail="Eleven Labs API key not configured")
@@ -231,61 +1165,381 @@ async def proxy_elevenlabs_tts(data: TextToSpeechRequest, token: Dict = Depends(
         }
     }
 
-    api_url = f"https://api.elevenlabs.io/v1/text-to-speech/{data.voice_id}"
-
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.post(api_url, headers=headers, json=payload, timeout=30.0)
-            
-            if r.status_code != 200:
-                raise HTTPException(status_code=r.status_code, 
-                                  detail=f"Eleven Labs API error: {r.text}")
-            
-            # This endpoint returns audio data directly
-            # For this example, we'll return a mock URL
-            # In a real implementation, you would save the audio file and return a URL
-            
-            # Mock response for demonstration
-            return AudioResult(
-                audio_url=f"/audio/generated/{data.voice_id}_{hash(data.text)}.mp3",
-                duration=len(data.text) / 20  # Rough estimate
+    digest = audio_digest(data.text, data.voice_id, data.model_id, payload["voice_settings"])
+    bypass = cache_bypassed(request)
+    # Eleven Labs bills characters, so TTS usage is recorded in characters
+    def record_tts_usage():
+        usage_ledger.record(token["sub"], data.model_id, 0, 0, characters=len(data.text))
+    size = None if bypass else await audio_cache.get(digest)
+    
+    if data.stream:
+        if size is not None:
+            record_tts_usage()
+            return StreamingResponse(
+                audio_cache.iter_file(digest),
+                media_type="audio/mpeg",
+                headers={"X-Cache": "HIT", "X-Audio-URL": audio_cache.url(digest),
+                         "Content-Length": str(size)}
             )
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=503, 
-                              detail=f"Error communicating with Eleven Labs: {str(e)}")
+        r = await open_upstream_stream("elevenlabs", f"/v1/text-to-speech/{data.voice_id}/stream",
+                                       headers, payload, "Eleven Labs")
+        record_tts_usage()
+        return StreamingResponse(
+            relay_audio(r, digest),
+            media_type="audio/mpeg",
+            headers={"X-Cache": "MISS", "X-Audio-URL": audio_cache.url(digest)}
+        )
+    
+    if size is None:
+        async def fetch() -> int:
+            return await fetch_elevenlabs_tts(f"/v1/text-to-speech/{data.voice_id}", digest, headers, payload)
+        
+        if bypass:
+            size = await fetch()
+        else:
+            # Identical concurrent TTS requests share one upstream call
+            size = await in_flight.do(digest, fetch)
+    
+    record_tts_usage()
+    return AudioResult(
+        audio_url=audio_cache.url(digest),
+        duration=size / TTS_BYTES_PER_SECOND
+    )
+
+async def relay_audio(r: httpx.Response, digest: str) -> AsyncGenerator[bytes, None]:
+    """
+    Stream upstream audio to the client while writing it to the cache.
+    
+    The cache file is only committed if the whole body arrived; on client
+    disconnect the upstream response is closed and the partial file dropped.
+    """
+    writer = await asyncio.to_thread(audio_cache.writer, digest)
+    try:
+        async for chunk in deadlines.bounded_iter(r.aiter_bytes(), "Eleven Labs"):
+            writer.write(chunk)
+            yield chunk
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        await r.aclose()
+    await asyncio.to_thread(writer.commit)
+    await audio_cache.committed(writer)
+
+async def fetch_elevenlabs_tts(
+    api_url: str,
+    digest: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any]
+) -> int:
+    """Download audio from Eleven Labs into the cache and return its size"""
+    r = await open_upstream_stream("elevenlabs", api_url, headers, payload, "Eleven Labs")
+    writer = await asyncio.to_thread(audio_cache.writer, digest)
+    try:
+        async with deadlines.bounded("Eleven Labs"):
+            async for chunk in r.aiter_bytes():
+                writer.write(chunk)
+    except httpx.RequestError as e:
+        writer.abort()
+        raise upstream_unreachable(e, "Eleven Labs")
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        await r.aclose()
+    await asyncio.to_thread(writer.commit)
+    await audio_cache.committed(writer)
+    return writer.size
+
+@app.get("/audio/generated/{filename}")
+async def generated_audio(filename: str, request: Request):
+    """
+    Serve cached audio with HTTP Range support.
+    
+    Not behind auth so <audio> elements can load it; file names are
+    digests of the synthesis inputs.
+    """
+    digest = filename[:-4] if filename.endswith(".mp3") else filename
+    if not is_digest(digest):
+        raise HTTPException(status_code=404, detail="Audio not found")
+    
+    size = await audio_cache.get(digest)
+    if size is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "public, max-age=31536000, immutable"}
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                          headers={"Content-Range": f"bytes */{size}"})
+    
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(audio_cache.iter_file(digest), media_type="audio/mpeg", headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(audio_cache.iter_file(digest, start, end), status_code=206,
+                           media_type="audio/mpeg", headers=headers)
 
 # ===== Proxy: Vector Search =====
-@app.post("/proxy/vector/search", response_model=VectorSearchResult)
+# The vector modules load numpy, so endpoints import them on first use
+
+@app.post("/proxy/vector/search", response_model=VectorSearchResult, dependencies=[Depends(keys_loaded)])
 async def proxy_vector_search(data: VectorSearchRequest, token: Dict = Depends(verify_token)):
-    """Proxy endpoint for vector database search"""
-    # This is a placeholder implementation
-    # In a real system, you would integrate with Pinecone, Weaviate, Qdrant, etc.
-    
-    # Mock response for demonstration
-    results = [
-        {
-            "id": f"doc_{i}",
-            "score": 0.9 - (i * 0.1),
-            "metadata": {
-                "title": f"Sample Document {i}",
-                "source": "mock-database"
-            },
-            "content": f"This is sample content related to '{data.query}'"
-        }
-        for i in range(data.limit)
-    ]
+    """Search a collection of the embedded vector index"""
+    import numpy as np
+    from services.vector_index import vector_store, CollectionNotFound
+    try:
+        collection = vector_store.get(data.collection)
+    except CollectionNotFound:
+        raise HTTPException(status_code=404, detail=f"Collection {data.collection} not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    vector = data.vector
+    if vector is None:
+        vector = await embed_text(data.query, collection.embedding_model)
+    
+    if len(vector) != collection.dim:
+        raise HTTPException(status_code=400, 
+                          detail=f"Query vector has {len(vector)} dimensions, "
+                                 f"collection {data.collection} expects {collection.dim}")
+    
+    # Scoring is CPU-bound, keep it off the event loop
+    results = await asyncio.to_thread(
+        collection.search, np.asarray(vector, dtype=np.float32), data.limit,
+        data.filter, data.exact
+    )
     
     return VectorSearchResult(
         results=results,
         query=data.query
     )
 
+async def embed_text(text: str, model: str) -> List[float]:
+    """Embed a query with the OpenAI embeddings API (cached and coalesced)"""
+    openai_key = get_api_key("OPENAI_API_KEY")
+    if not openai_key:
+        raise HTTPException(status_code=403, detail="OpenAI API key not configured")
+    
+    payload = {"model": model, "input": text}
+    key = cache_key("openai", "/v1/embeddings", payload)
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    async def fetch() -> List[float]:
+        client = get_client("openai")
+        headers = openai_headers(openai_key)
+        try:
+            async with admission.upstream("openai", upstream_credential(headers)):
+                async with deadlines.bounded("OpenAI"):
+                    r = await client.post("/v1/embeddings", 
+                                       headers=headers, 
+                                       json=payload,
+                                       timeout=request_timeout("openai"))
+        except httpx.RequestError as e:
+            raise upstream_unreachable(e, "OpenAI")
+        
+        if r.status_code != 200:
+            raise upstream_error(r, "OpenAI")
+        
+        return r.json()["data"][0]["embedding"]
+    
+    async def fetch_and_store() -> List[float]:
+        embedding = await upstream_retries.call("openai", fetch)
+        await response_cache.set(key, embedding)
+        return embedding
+    
+    return await in_flight.do(key, fetch_and_store)
+
+@app.get("/proxy/vector/collections")
+async def list_vector_collections(token: Dict = Depends(verify_token)):
+    """List collections with their size and index type"""
+    from services.vector_index import vector_store
+    return [vector_store.get(name).info() for name in vector_store.list()]
+
+@app.post("/proxy/vector/collections/{collection}/upsert", response_model=VectorWriteResult)
+async def upsert_vectors(
+    collection: str,
+    request: Request,
+    dim: Optional[int] = None,
+    id_prefix: str = "",
+    user: str = Depends(get_current_user)
+):
+    """
+    Stream vectors into a collection.
+    
+    - `application/x-ndjson`: one {"id", "vector", "metadata", "content"} object per line
+    - `application/octet-stream`: raw float32 rows of `dim` dimensions, with ids
+      `{id_prefix}{row}` assigned in upload order
+    
+    The body is appended in chunks as it arrives. Searches keep using the
+    previous snapshot until the upload is committed, and the index is
+    extended in the background afterwards.
+    """
+    if user != "admin":
+        audit(request, user, "vector.upsert", "denied", collection=collection)
+        raise HTTPException(status_code=403, detail="Only admin users can write vectors")
+    
+    from services.vector_index import vector_store, CollectionNotFound
+    from services.vector_ingest import ingest_ndjson, ingest_raw
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    try:
+        if content_type in ("application/x-ndjson", "application/jsonl", "application/json-lines"):
+            return await ingest_ndjson(vector_store, collection, request.stream())
+        
+        if content_type == "application/octet-stream":
+            if dim is None:
+                try:
+                    dim = vector_store.get(collection).dim
+                except CollectionNotFound:
+                    raise HTTPException(status_code=400, 
+                                      detail="`dim` is required to create a collection from raw vectors")
+            return await ingest_raw(vector_store, collection, request.stream(), dim, id_prefix)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    raise HTTPException(status_code=415, 
+                      detail="Use application/x-ndjson or application/octet-stream")
+
+@app.post("/proxy/vector/collections/{collection}/delete", response_model=VectorWriteResult)
+async def delete_vectors(
+    collection: str,
+    data: VectorDeleteRequest,
+    request: Request,
+    user: str = Depends(get_current_user)
+):
+    """Delete vectors from a collection by id"""
+    if user != "admin":
+        audit(request, user, "vector.delete", "denied", collection=collection)
+        raise HTTPException(status_code=403, detail="Only admin users can delete vectors")
+    
+    from services.vector_index import vector_store, CollectionNotFound
+    from services.vector_ingest import delete_ids
+    try:
+        return await delete_ids(vector_store, collection, data.ids)
+    except CollectionNotFound:
+        raise HTTPException(status_code=404, detail=f"Collection {collection} not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # ===== System Status =====
+@app.get("/admin/pools")
+async def upstream_pools(user: str = Depends(get_current_user)):
+    """Connection pool stats per upstream (idle, in-use, waiting)"""
+    if user != "admin":
+        raise HTTPException(status_code=403, detail="Only admin users can view pool stats")
+    
+    return pool_stats()
+
+@app.get("/admin/limits")
+async def admission_stats(user: str = Depends(get_current_user)):
+    """Rate limiting and upstream queue stats (admitted, delayed, shed)"""
+    if user != "admin":
+        raise HTTPException(status_code=403, detail="Only admin users can view limit stats")
+    
+    return admission.stats()
+
+@app.get("/admin/breakers")
+async def breaker_stats(user: str = Depends(get_current_user)):
+    """Circuit breaker state, failure counts and latency per upstream, and retries"""
+    if user != "admin":
+        raise HTTPException(status_code=403, detail="Only admin users can view breaker stats")
+    
+    stats = circuit_breakers.stats()
+    stats["retries"] = upstream_retries.stats()
+    return stats
+
+@app.get("/admin/router")
+async def router_stats(user: str = Depends(get_current_user)):
+    """Model router catalog, live scores per target and its latest decisions"""
+    if user != "admin":
+        raise HTTPException(status_code=403, detail="Only admin users can view router stats")
+    
+    return {
+        "catalog": model_router.catalog,
+        "targets": model_router.stats(),
+        "unroutable": model_router.unroutable,
+        "decisions": list(model_router.decisions),
+    }
+
+@app.get("/admin/cache")
+async def cache_stats(user: str = Depends(get_current_user)):
+    """Response cache stats (hits, misses, evictions)"""
+    if user != "admin":
+        raise HTTPException(status_code=403, detail="Only admin users can view cache stats")
+    
+    stats = response_cache.stats()
+    stats["single_flight"] = in_flight.stats()
+    stats["audio"] = audio_cache.stats()
+    stats["agui_sessions"] = agui_listener.session_store.stats()
+    stats["agui_streams"] = agui_listener.streams.stats()
+    stats["shared_state"] = shared_state.stats()
+    return stats
+
+# Component stats exported as gauges on every scrape
+metrics.registry.register_stats("gateway_response_cache", response_cache.stats)
+metrics.registry.register_stats("gateway_single_flight", in_flight.stats)
+metrics.registry.register_stats("gateway_audio_cache", audio_cache.stats)
+metrics.registry.register_stats("gateway_pool", pool_stats, label="upstream")
+metrics.registry.register_stats("gateway_admission", admission.stats)
+metrics.registry.register_stats("gateway_upstream_queue", lambda: admission.stats()["upstreams"], label="upstream")
+metrics.registry.register_stats("gateway_breaker", lambda: {
+    name: {**stats, "open": stats["state"] != "closed"}
+    for name, stats in circuit_breakers.stats()["upstreams"].items()
+}, label="upstream")
+metrics.registry.register_stats("gateway_agui_sessions", lambda: agui_listener.session_store.stats())
+metrics.registry.register_stats("gateway_agui_streams", lambda: agui_listener.streams.stats())
+metrics.registry.register_stats("gateway_usage_ledger", usage_ledger.stats)
+metrics.registry.register_stats("gateway_token_counts", token_counter.stats)
+metrics.registry.register_stats("gateway_startup", startup_profile.stats)
+metrics.registry.register_stats("gateway_hf_batcher", hf_batcher.stats)
+metrics.registry.register_stats("gateway_model_router", model_router.stats, label="target")
+metrics.registry.register_stats("gateway_retries", upstream_retries.stats, label="upstream")
+metrics.registry.register_stats("gateway_logs", log_pipeline.stats)
+
+@app.get("/admin/startup")
+async def startup_report(user: str = Depends(get_current_user)):
+    """Startup time by phase: init steps, prewarm steps and first-use imports"""
+    if user != "admin":
+        raise HTTPException(status_code=403, detail="Only admin users can view the startup report")
+    
+    return startup_profile.report()
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Metrics in the Prometheus text format (unauthenticated, like /health)"""
+    text = await metrics.render_workers(shared_state, WORKER_ID) if shared_state.enabled else metrics.registry.render()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
+@app.get("/health/live")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness: the process is up and its event loop is serving"""
     return {"status": "ok", "version": "1.0.0"}
 
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Readiness: startup finished, not shutting down, and connected to the
+    shared-state broker when running with several workers. Prewarming may
+    still be running in lazy mode.
+    """
+    if startup_profile.stopping:
+        status = "stopping"
+    elif not startup_profile.ready:
+        status = "starting"
+    elif shared_state.enabled and not shared_state.stats()["connected"]:
+        status = "shared_state_unavailable"
+    else:
+        status = "ready"
+    return JSONResponse({"status": status, "prewarm": startup_profile.prewarm},
+                        status_code=200 if status == "ready" else 503)
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -297,5 +1551,6 @@ async def root():
     }
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Same as serve.py: GATEWAY_WORKERS selects the number of worker processes
+    import serve
+    serve.main()
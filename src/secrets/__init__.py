@@ -1,2 +1,17 @@
-
 # Make secrets a proper Python package
+
+# When the app runs from src/, this package shadows the standard library's
+# `secrets`, which libraries such as starlette import. Re-export its API.
+import importlib.util as _importlib_util
+import os as _os
+import sysconfig as _sysconfig
+
+_spec = _importlib_util.spec_from_file_location(
+    "_stdlib_secrets", _os.path.join(_sysconfig.get_paths()["stdlib"], "secrets.py")
+)
+_stdlib_secrets = _importlib_util.module_from_spec(_spec)
+_spec.loader.exec_module(_stdlib_secrets)
+
+__all__ = list(_stdlib_secrets.__all__)
+for _name in __all__:
+    globals()[_name] = getattr(_stdlib_secrets, _name)
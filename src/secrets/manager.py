@@ -1,138 +1,282 @@
 
 """
 Secrets Manager for API keys
+
+Keys stored in KEYS_FILE are decrypted once and served from memory. A
+background watcher stats the file every SECRETS_RELOAD_INTERVAL seconds and
+reloads it only when its inode, mtime or size changed, so a rotation made by
+any worker is picked up by all of them within that delay. Writes replace the
+file atomically (temp file + rename) under an exclusive file lock.
+
+The file is never read on the event loop. Until the first load is done (the
+first requests with STARTUP_MODE=lazy), the synchronous getters start it in
+a thread and answer from the environment. Await ensure_loaded() to wait for
+the stored keys.
 """
+import logging
 import os
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+import asyncio
 import json
-from cryptography.fernet import Fernet
-import base64
+import threading
+
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
 
-# In-memory cache of decrypted keys
+logger = logging.getLogger(__name__)
+
+# In-memory cache of decrypted keys from encrypted storage
 _api_keys_cache: Dict[str, str] = {}
 
 # Path to encrypted keys storage
 KEYS_FILE = os.environ.get("KEYS_FILE", "secrets/encrypted_keys.json")
 
+# How often (seconds) to check KEYS_FILE for changes made by other workers
+RELOAD_INTERVAL = float(os.environ.get("SECRETS_RELOAD_INTERVAL", "2.0"))
+
 # Encryption key - in production this would come from environment or secure storage
 # For demo purposes, we're using a fixed key - CHANGE THIS IN PRODUCTION!
 _ENCRYPTION_KEY = os.environ.get("ENCRYPTION_KEY", "RV8z7o1i8Xm9uKL5KzUdN-j6G5DD99wgYDkynlHECZY=")
 
+_cipher: Optional["Fernet"] = None
+_loaded = False
+# (device, inode, mtime_ns, size) of KEYS_FILE when it was last loaded
+_file_signature: Optional[Tuple[int, int, int, int]] = None
+_store_lock = threading.Lock()
+_watcher: Optional[asyncio.Task] = None
+# The first load, shared by everything waiting for it
+_first_load: Optional["asyncio.Future[bool]"] = None
+
 def _get_cipher():
-    """Get the encryption cipher"""
+    """Get the encryption cipher (built once; cryptography is imported here, on first use)"""
+    global _cipher
+    if _cipher is None:
+        try:
+            from cryptography.fernet import Fernet
+            # Fernet takes the url-safe base64 key as-is
+            _cipher = Fernet(_ENCRYPTION_KEY.encode())
+        except Exception as e:
+            logger.error("Error initializing cipher: %s", e)
+            return None
+    return _cipher
+
+def _signature() -> Optional[Tuple[int, int, int, int]]:
     try:
-        key = base64.urlsafe_b64decode(_ENCRYPTION_KEY)
-        return Fernet(key)
-    except Exception as e:
-        print(f"Error initializing cipher: {e}")
+        st = os.stat(KEYS_FILE)
+    except OSError:
         return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
 
 def _load_encrypted_keys() -> Dict[str, str]:
     """Load encrypted keys from file"""
     try:
         if not os.path.exists(KEYS_FILE):
             return {}
-            
+
         with open(KEYS_FILE, "r") as f:
             return json.load(f)
     except Exception as e:
-        print(f"Error loading keys: {e}")
+        logger.error("Error loading keys: %s", e)
         return {}
 
 def _save_encrypted_keys(keys: Dict[str, str]) -> bool:
-    """Save encrypted keys to file"""
+    """Atomically replace the keys file"""
+    tmp_path = f"{KEYS_FILE}.{os.getpid()}.tmp"
     try:
         # Ensure directory exists
-        os.makedirs(os.path.dirname(KEYS_FILE), exist_ok=True)
-        
-        with open(KEYS_FILE, "w") as f:
+        os.makedirs(os.path.dirname(KEYS_FILE) or ".", exist_ok=True)
+
+        with open(tmp_path, "w") as f:
             json.dump(keys, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, KEYS_FILE)
         return True
     except Exception as e:
-        print(f"Error saving keys: {e}")
+        logger.error("Error saving keys: %s", e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
         return False
 
+def _decrypt_keys(encrypted_keys: Dict[str, str]) -> Dict[str, str]:
+    cipher = _get_cipher()
+    if not cipher:
+        return {}
+
+    decrypted = {}
+    for key_name, token in encrypted_keys.items():
+        try:
+            decrypted[key_name] = cipher.decrypt(token.encode()).decode()
+        except Exception as e:
+            logger.error("Error decrypting key %s: %s", key_name, e)
+    return decrypted
+
+def _reload_if_changed() -> bool:
+    """Reload and decrypt KEYS_FILE if it changed since the last load"""
+    global _api_keys_cache, _file_signature, _loaded
+    with _store_lock:
+        signature = _signature()
+        if _loaded and signature == _file_signature:
+            return False
+
+        # Swap in a new dict so readers never see a half-built cache
+        _api_keys_cache = _decrypt_keys(_load_encrypted_keys())
+        _file_signature = signature
+        _loaded = True
+        return True
+
+class _FileLock:
+    """Exclusive lock shared by all processes writing KEYS_FILE"""
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(KEYS_FILE) or ".", exist_ok=True)
+        self._file = open(f"{KEYS_FILE}.lock", "a")
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+def _update_keys(key_name: str, encrypted_key: Optional[str]) -> bool:
+    """
+    Set (or with None, remove) one encrypted key.
+
+    The file is re-read under the lock so concurrent updates from other
+    workers are not lost.
+    """
+    global _file_signature
+    with _store_lock, _FileLock():
+        encrypted_keys = _load_encrypted_keys()
+        if encrypted_key is None:
+            if key_name not in encrypted_keys:
+                return True  # Key wasn't in storage anyway
+            del encrypted_keys[key_name]
+        else:
+            encrypted_keys[key_name] = encrypted_key
+
+        if not _save_encrypted_keys(encrypted_keys):
+            return False
+
+        # Other keys may have changed on disk too
+        decrypted = _decrypt_keys(encrypted_keys)
+        _set_cache(decrypted)
+        _file_signature = _signature()
+        return True
+
+def _set_cache(decrypted: Dict[str, str]) -> None:
+    global _api_keys_cache, _loaded
+    _api_keys_cache = decrypted
+    _loaded = True
+
+def _start_load() -> "asyncio.Future[bool]":
+    global _first_load
+    if _first_load is None or (_first_load.done() and not _loaded):
+        _first_load = asyncio.ensure_future(asyncio.to_thread(_reload_if_changed))
+    return _first_load
+
+def _load_soon() -> None:
+    """Start the first load: in a thread when on the event loop, else right away"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        _reload_if_changed()
+        return
+    _start_load()
+
+async def ensure_loaded() -> None:
+    """Wait for the first load of KEYS_FILE, made in a thread"""
+    if not _loaded:
+        await asyncio.shield(_start_load())
+
 def get_api_key(key_name: str) -> Optional[str]:
     """
     Get an API key by name, checking:
-    1. In-memory cache
+    1. Encrypted storage (decrypted in memory)
     2. Environment variables
-    3. Encrypted storage
+
+    Keys set through the admin API take precedence over the environment so
+    that rotations apply everywhere. Before the first load is done, only the
+    environment is checked.
     """
-    # Check cache first for performance
-    if key_name in _api_keys_cache:
-        return _api_keys_cache[key_name]
-    
+    if not _loaded:
+        _load_soon()
+
+    api_key = _api_keys_cache.get(key_name)
+    if api_key is not None:
+        return api_key
+
     # Check environment variables (useful for container deployments)
-    if key_name in os.environ:
-        _api_keys_cache[key_name] = os.environ[key_name]
-        return _api_keys_cache[key_name]
-    
-    # Check encrypted storage
-    cipher = _get_cipher()
-    if not cipher:
-        return None
-        
-    encrypted_keys = _load_encrypted_keys()
-    if key_name in encrypted_keys:
-        try:
-            decrypted_key = cipher.decrypt(encrypted_keys[key_name].encode()).decode()
-            _api_keys_cache[key_name] = decrypted_key
-            return decrypted_key
-        except Exception as e:
-            print(f"Error decrypting key {key_name}: {e}")
-            
-    return None
+    return os.environ.get(key_name)
 
 def set_api_key(key_name: str, api_key: str) -> bool:
     """
-    Store an API key securely:
-    1. Update in-memory cache
-    2. Encrypt and store in file
+    Store an API key securely (blocking file I/O - call from a thread):
+    1. Encrypt and atomically rewrite the file
+    2. Update in-memory cache
     """
     cipher = _get_cipher()
     if not cipher:
         return False
-    
+
     try:
-        # Update cache
-        _api_keys_cache[key_name] = api_key
-        
-        # Encrypt and save
-        encrypted_keys = _load_encrypted_keys()
-        encrypted_keys[key_name] = cipher.encrypt(api_key.encode()).decode()
-        
-        return _save_encrypted_keys(encrypted_keys)
+        return _update_keys(key_name, cipher.encrypt(api_key.encode()).decode())
     except Exception as e:
-        print(f"Error setting key {key_name}: {e}")
+        logger.error("Error setting key %s: %s", key_name, e)
         return False
 
 def delete_api_key(key_name: str) -> bool:
-    """Delete an API key"""
-    # Remove from cache
-    if key_name in _api_keys_cache:
-        del _api_keys_cache[key_name]
-    
-    # Remove from storage
-    encrypted_keys = _load_encrypted_keys()
-    if key_name in encrypted_keys:
-        del encrypted_keys[key_name]
-        return _save_encrypted_keys(encrypted_keys)
-    
-    return True  # Key wasn't in storage anyway
+    """Delete an API key (blocking file I/O - call from a thread)"""
+    try:
+        return _update_keys(key_name, None)
+    except Exception as e:
+        logger.error("Error deleting key %s: %s", key_name, e)
+        return False
 
 def list_available_keys() -> list[str]:
     """List all available key names (without exposing values)"""
-    keys = set()
-    
+    if not _loaded:
+        _load_soon()
+
+    keys = set(_api_keys_cache)
+
     # Get from environment
     for key in os.environ:
         if key.endswith('_API_KEY'):
             keys.add(key)
-    
-    # Get from encrypted storage
-    encrypted_keys = _load_encrypted_keys()
-    for key in encrypted_keys:
-        keys.add(key)
-    
+
     return sorted(list(keys))
+
+async def _watch() -> None:
+    while True:
+        await asyncio.sleep(RELOAD_INTERVAL)
+        try:
+            await asyncio.to_thread(_reload_if_changed)
+        except Exception as e:
+            logger.error("Error reloading keys: %s", e)
+
+async def startup() -> None:
+    """Load keys off the event loop and start watching for rotations"""
+    global _watcher
+    await ensure_loaded()
+    if _watcher is None:
+        _watcher = asyncio.create_task(_watch())
+
+async def reload() -> bool:
+    """Re-read the key store now, e.g. after another worker changed it"""
+    return await asyncio.to_thread(_reload_if_changed)
+
+async def shutdown() -> None:
+    global _watcher
+    if _watcher is not None:
+        _watcher.cancel()
+        _watcher = None
@@ -0,0 +1,333 @@
+
+"""
+Admission control for the proxy endpoints.
+
+Two layers decide whether a request may proceed:
+
+* Token buckets, one per user (JWT `sub`) and one per upstream API key.
+  A request over the limit reserves its token and waits for the refill, up to
+  RATE_LIMIT_MAX_WAIT seconds. If the wait would be longer, it is shed with a
+  429 and a Retry-After header. A bucket is two numbers updated in O(1).
+  With RATE_LIMIT_BACKEND=redis the update runs as one Lua script, so all
+  workers share the same buckets; RATE_LIMIT_BACKEND=shared does the same
+  through the serve.py broker on a single host.
+* A concurrency limit per upstream (per worker). Requests beyond it wait in
+  a bounded priority queue and are shed with a 429 once the queue is full.
+  Priorities come from the route and can be overridden per user; lower
+  values are served first.
+"""
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from . import deadlines
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Only needed for RATE_LIMIT_BACKEND=redis
+    redis_asyncio = None
+
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+
+# Requests per second and burst size; a rate of 0 disables the bucket
+USER_RATE = float(os.environ.get("RATE_LIMIT_USER_RATE", "5"))
+USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", "20"))
+KEY_RATE = float(os.environ.get("RATE_LIMIT_KEY_RATE", "50"))
+KEY_BURST = float(os.environ.get("RATE_LIMIT_KEY_BURST", "100"))
+# Longest a request waits for its bucket to refill before it is shed
+MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", "2.0"))
+# Buckets kept by the in-memory backend (least recently used are dropped)
+MAX_BUCKETS = int(os.environ.get("RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+# In-flight upstream requests per worker; UPSTREAM_<NAME>_MAX_CONCURRENT overrides
+MAX_CONCURRENT = int(os.environ.get("UPSTREAM_MAX_CONCURRENT", "64"))
+QUEUE_SIZE = int(os.environ.get("UPSTREAM_QUEUE_SIZE", "256"))
+
+
+def _parse_priorities(value: str) -> Dict[str, int]:
+    """Parse "name=priority,name=priority" """
+    priorities = {}
+    for item in value.split(","):
+        name, _, priority = item.partition("=")
+        if name.strip() and priority.strip():
+            priorities[name.strip()] = int(priority)
+    return priorities
+
+
+DEFAULT_PRIORITY = 10
+ROUTE_PRIORITIES = _parse_priorities(os.environ.get("RATE_LIMIT_ROUTE_PRIORITY", "batch=20"))
+USER_PRIORITIES = _parse_priorities(os.environ.get("RATE_LIMIT_USER_PRIORITY", ""))
+
+# Priority of the request being handled, read when it queues for an upstream
+request_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "request_priority", default=DEFAULT_PRIORITY
+)
+
+
+class RateLimited(HTTPException):
+    """A 429 raised here, before any upstream call was made"""
+
+
+def rate_limited(retry_after: float, detail: str) -> RateLimited:
+    return RateLimited(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class LocalBuckets:
+    """In-process token buckets"""
+
+    def __init__(self, max_buckets: int = MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float, max_wait: float) -> Tuple[bool, float]:
+        """
+        Take one token. Returns (admitted, wait): when admitted, the caller
+        must wait `wait` seconds first; otherwise `wait` is when to retry.
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate) - 1
+        wait = -tokens / rate if tokens < 0 else 0.0
+        if wait > max_wait:
+            return False, wait
+        bucket[0], bucket[1] = tokens, now
+        return True, wait
+
+    async def close(self) -> None:
+        pass
+
+
+# Same algorithm as LocalBuckets.take, atomic in Redis and clocked by the server
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate) - 1
+local wait = 0
+if tokens < 0 then wait = -tokens / rate end
+if wait > max_wait then return {0, tostring(wait)} end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate + max_wait) + 1)
+return {1, tostring(wait)}
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker through Redis"""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self._take = client.register_script(_TAKE_SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: float, max_wait: float) -> Tuple[bool, float]:
+        admitted, wait = await self._take(keys=[self.prefix + key], args=[rate, burst, max_wait])
+        return bool(int(admitted)), float(wait)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class PriorityLimiter:
+    """Concurrency limit with a bounded queue served lowest priority first"""
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()  # FIFO within a priority
+        self.queued = 0
+        self.rejected = 0
+
+    def queue_length(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int) -> None:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise rate_limited(1, "Upstream queue is full, retry later")
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, next(self._sequence), future)
+        heapq.heappush(self._waiters, waiter)
+        self.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as this waiter was cancelled
+                self.release()
+            elif waiter in self._waiters:
+                # Give up the place in the queue so it no longer counts toward max_queue
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            # A cancelled waiter may be reached before it removes itself
+            if not future.done():
+                future.set_result(None)  # the slot passes straight to the waiter
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued_now": len(self._waiters),
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+
+class _SlotReleasingStream(httpx.AsyncByteStream):
+    """Response body wrapper that frees an upstream slot when the body is closed"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, limiter: PriorityLimiter):
+        self._stream = stream
+        self._limiter = limiter
+        self._released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._limiter.release()
+
+
+class AdmissionController:
+    """Per-user and per-key rate limits plus per-upstream concurrency limits"""
+
+    def __init__(self, buckets, max_concurrent: int = MAX_CONCURRENT, queue_size: int = QUEUE_SIZE):
+        self.buckets = buckets
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self._limiters: Dict[str, PriorityLimiter] = {}
+        self.admitted = 0
+        self.delayed = 0
+        self.shed = 0
+
+    def limiter(self, upstream: str) -> PriorityLimiter:
+        limiter = self._limiters.get(upstream)
+        if limiter is None:
+            limit = int(os.environ.get(f"UPSTREAM_{upstream.upper()}_MAX_CONCURRENT", self.max_concurrent))
+            limiter = self._limiters[upstream] = PriorityLimiter(limit, self.queue_size)
+        return limiter
+
+    async def _take(self, key: str, rate: float, burst: float, detail: str) -> None:
+        if rate <= 0:
+            return
+        # No waiting past the request's deadline
+        left = deadlines.check()
+        max_wait = MAX_WAIT if left is None else min(MAX_WAIT, left)
+        admitted, wait = await self.buckets.take(key, rate, burst, max_wait)
+        if not admitted:
+            self.shed += 1
+            raise rate_limited(wait, detail)
+        if wait > 0:
+            self.delayed += 1
+            await asyncio.sleep(wait)
+
+    async def admit_user(self, user: str, route: str) -> None:
+        """
+        Apply the user's rate limit for a request to `route`, and set the
+        request's priority for any upstream calls it makes.
+        """
+        priority = USER_PRIORITIES.get(user, ROUTE_PRIORITIES.get(route, DEFAULT_PRIORITY))
+        request_priority.set(priority)
+        await self._take(f"user:{user}", USER_RATE, USER_BURST, "Rate limit exceeded")
+        self.admitted += 1
+
+    async def acquire(self, upstream: str, credential: str) -> PriorityLimiter:
+        """Wait for the API key's rate limit and an upstream slot; release the slot when done"""
+        key = hashlib.blake2b(credential.encode(), digest_size=8).hexdigest()
+        await self._take(f"key:{upstream}:{key}", KEY_RATE, KEY_BURST,
+                         f"Rate limit for the {upstream} API key exceeded")
+        limiter = self.limiter(upstream)
+        left = deadlines.check()
+        if left is None:
+            await limiter.acquire(request_priority.get())
+            return limiter
+        try:
+            await asyncio.wait_for(limiter.acquire(request_priority.get()), left)
+        except asyncio.TimeoutError:
+            raise deadlines.DeadlineExceeded(f"Request deadline exceeded waiting for a {upstream} slot")
+        return limiter
+
+    @asynccontextmanager
+    async def upstream(self, upstream: str, credential: str):
+        """Hold an upstream slot for the duration of the block"""
+        limiter = await self.acquire(upstream, credential)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def release_on_close(self, response: httpx.Response, limiter: PriorityLimiter) -> None:
+        """Keep the slot until a streamed upstream response is closed"""
+        response.stream = _SlotReleasingStream(response.stream, limiter)
+
+    async def shutdown(self) -> None:
+        await self.buckets.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.buckets).__name__,
+            "admitted": self.admitted,
+            "delayed": self.delayed,
+            "shed": self.shed,
+            "upstreams": {name: limiter.stats() for name, limiter in self._limiters.items()},
+        }
+
+
+def _create_buckets():
+    if RATE_LIMIT_BACKEND == "redis":
+        if redis_asyncio is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package")
+        return RedisBuckets(redis_asyncio.from_url(RATE_LIMIT_REDIS_URL, decode_responses=True))
+    if RATE_LIMIT_BACKEND == "shared":
+        from .shared_state import SharedBuckets, shared_state
+        return SharedBuckets(shared_state)
+    return LocalBuckets()
+
+
+admission = AdmissionController(_create_buckets())
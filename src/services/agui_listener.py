@@ -6,27 +6,125 @@ This module provides endpoints for streaming tokens and handling tool results.
 
 from fastapi import APIRouter, Request, Depends, HTTPException
 from fastapi.responses import StreamingResponse
-from sse_starlette.sse import EventSourceResponse
 import json
 import asyncio
 from typing import Dict, Any, AsyncGenerator, Optional
 from pydantic import BaseModel
+import os
 
-# Session storage - in production, use Redis or another persistent store
-active_sessions: Dict[str, Dict[str, Any]] = {}
+from .session_store import create_session_store
+from .shared_state import shared_state
+from .sse_replay import StreamRegistry
+
+# Session storage - bounded and expiring; set AGUI_SESSION_BACKEND=redis to
+# share sessions between workers
+session_store = create_session_store()
+
+# How long an ended session stays readable
+COMPLETED_SESSION_TTL = float(os.environ.get("AGUI_COMPLETED_SESSION_TTL", "60"))
+
+# How long a stream waits for the client to post a tool result
+TOOL_RESULT_TIMEOUT = float(os.environ.get("AGUI_TOOL_RESULT_TIMEOUT", "120"))
+
+# Token streams by session. Each keeps a replay buffer so a client that
+# reconnects with Last-Event-ID resumes instead of regenerating.
+streams = StreamRegistry()
+
+# Streams suspended on a tool call, by session. A future lives in the worker
+# that serves the stream; results posted to another worker are forwarded
+# through shared_state.
+_tool_waiters: Dict[str, asyncio.Future] = {}
+TOOL_EVENTS_CHANNEL = "agui:tool_events"
 
 # Router configuration
 router = APIRouter(prefix="/agui", tags=["agui"])
 
 
+async def startup() -> None:
+    await session_store.startup()
+    await shared_state.subscribe(TOOL_EVENTS_CHANNEL, _on_tool_event)
+
+
+async def shutdown() -> None:
+    await streams.shutdown()
+    await session_store.shutdown()
+
+
 class ToolResultRequest(BaseModel):
     session_id: str
     tool_name: str
     result: Any
 
 
-async def token_generator(session_id: str, prompt: str) -> AsyncGenerator[str, None]:
-    """Generate tokens for an agent session."""
+class SessionEnded(Exception):
+    """The session was ended while its stream was waiting for a tool result"""
+
+
+def _resume_waiter(session_id: str, result: Any = None, ended: bool = False) -> bool:
+    """Resume this worker's stream for the session, if it is waiting here"""
+    waiter = _tool_waiters.get(session_id)
+    if waiter is None or waiter.done():
+        return False
+    if ended:
+        waiter.set_exception(SessionEnded(session_id))
+    else:
+        waiter.set_result(result)
+    return True
+
+
+async def _on_tool_event(message: Dict[str, Any]) -> None:
+    """A tool result or session end posted to another worker"""
+    session_id = message["session_id"]
+    if message.get("ended"):
+        _resume_waiter(session_id, ended=True)
+        await streams.release(session_id, final_event=json.dumps({"type": "done"}))
+    else:
+        _resume_waiter(session_id, message.get("result"))
+
+
+async def expect_tool_result(session_id: str, tool_name: str) -> asyncio.Future:
+    """
+    Register the future that /agui/tool-result resolves for this session.
+
+    Call before the tool event is sent so a fast client cannot post the
+    result before anyone is waiting for it.
+    """
+    future = asyncio.get_running_loop().create_future()
+    _tool_waiters[session_id] = future
+    await session_store.update(session_id, {"waiting_for_tool": tool_name})
+    return future
+
+
+async def wait_for_tool_result(future: asyncio.Future, timeout: float) -> Any:
+    """
+    Suspend the session's stream until its tool result arrives.
+
+    The stream just awaits the future, so a waiting session costs no task
+    and no polling. Raises TimeoutError after `timeout` seconds.
+    """
+    async with asyncio.timeout(timeout):
+        return await future
+
+
+async def release_tool_waiter(session_id: str, future: asyncio.Future) -> None:
+    if _tool_waiters.get(session_id) is future:
+        del _tool_waiters[session_id]
+    if not future.done():
+        future.cancel()
+    await session_store.update(session_id, {"waiting_for_tool": None})
+
+
+async def token_generator(
+    session_id: str,
+    prompt: str,
+    request: Optional[Request] = None
+) -> AsyncGenerator[str, None]:
+    """
+    Generate tokens for an agent session.
+
+    With `request`, stops as soon as the client disconnects. stream_token
+    instead runs it in a resumable stream, which outlives connections.
+    """
     # This is a mock implementation - in production, connect to your LLM orchestration layer
     
     # Start with thinking message
@@ -47,9 +145,24 @@ async def token_generator(session_id: str, prompt: str) -> AsyncGenerator[str, N
     ]
     
     for token in tokens:
+        if request is not None and await request.is_disconnected():
+            return
         # In a real implementation, you would integrate with LangGraph/CrewAI here
-        yield json.dumps(token)
-        await asyncio.sleep(0.5)  # Simulate token generation delay
+        if token["type"] == "tool":
+            future = await expect_tool_result(session_id, token["toolName"])
+            try:
+                yield json.dumps(token)
+                await wait_for_tool_result(future, TOOL_RESULT_TIMEOUT)
+            except TimeoutError:
+                yield json.dumps({"type": "token", "content": f"No result from {token['toolName']}; continuing without it. "})
+            except SessionEnded:
+                yield json.dumps({"type": "done"})
+                return
+            finally:
+                await release_tool_waiter(session_id, future)
+        else:
+            yield json.dumps(token)
+            await asyncio.sleep(0.5)  # Simulate token generation delay
 
 
 @router.get("/stream-token")
@@ -58,20 +171,34 @@ async def stream_token(request: Request, session_id: str, prompt: str):
     Stream tokens from the agent to the client.
     
     This endpoint sets up a Server-Sent Events (SSE) connection
-    that streams tokens as they're generated by the agent.
+    that streams tokens as they're generated by the agent. Every event has
+    an id; reconnecting with a Last-Event-ID header resumes the session's
+    stream after that event.
     """
     if not session_id or not prompt:
         raise HTTPException(status_code=400, detail="Missing required parameters")
     
+    # Imported on first use: sse_starlette pulls in uvicorn when run without it
+    from sse_starlette.sse import EventSourceResponse
+    last_event_id = request.headers.get("last-event-id")
+    stream = streams.get(session_id)
+    if last_event_id is not None and stream is not None:
+        try:
+            cursor = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+        return EventSourceResponse(streams.connect(session_id, stream, cursor, request))
+    
     # Initialize or update session data
-    active_sessions[session_id] = {
+    await session_store.create(session_id, {
         "prompt": prompt,
         "status": "active",
         "waiting_for_tool": None
-    }
+    })
     
     # Set up event stream for this client
-    return EventSourceResponse(token_generator(session_id, prompt))
+    stream = await streams.open(session_id, token_generator(session_id, prompt))
+    return EventSourceResponse(streams.connect(session_id, stream, 0, request))
 
 
 @router.post("/tool-result")
@@ -83,21 +210,33 @@ async def submit_tool_result(request: ToolResultRequest):
     """
     session_id = request.session_id
     
-    if session_id not in active_sessions:
+    session = await session_store.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    session = active_sessions[session_id]
     if session["status"] != "active":
         raise HTTPException(status_code=400, detail="Session is not active")
     
+    waiting_for = session.get("waiting_for_tool")
+    if waiting_for is not None and waiting_for != request.tool_name:
+        raise HTTPException(status_code=400, detail=f"Session is waiting for {waiting_for}")
+    
     # In a real implementation, you would pass this result to your
     # agent orchestration system (LangGraph/CrewAI) to continue processing
     
     # Update session data
-    active_sessions[session_id]["last_tool_result"] = {
-        "tool_name": request.tool_name,
-        "result": request.result
-    }
+    updated = await session_store.update(session_id, {
+        "last_tool_result": {
+            "tool_name": request.tool_name,
+            "result": request.result
+        }
+    })
+    if not updated:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    # Resume the suspended stream, wherever it is served
+    if not _resume_waiter(session_id, request.result):
+        await shared_state.publish(TOOL_EVENTS_CHANNEL, {"session_id": session_id, "result": request.result})
     
     return {"success": True}
 
@@ -105,17 +244,13 @@ async def submit_tool_result(request: ToolResultRequest):
 @router.delete("/session/{session_id}")
 async def end_session(session_id: str):
     """End an agent session and clean up resources."""
-    if session_id in active_sessions:
-        active_sessions[session_id]["status"] = "completed"
+    # Keep session data for a minute; the store expires it
+    if await session_store.update(session_id, {"status": "completed"}, ttl=COMPLETED_SESSION_TTL):
         # In a real implementation, you would notify your agent system to stop processing
-        
-        # Clean up after a delay
-        async def cleanup():
-            await asyncio.sleep(60)  # Keep session data for 1 minute
-            if session_id in active_sessions:
-                del active_sessions[session_id]
-        
-        asyncio.create_task(cleanup())
+        _resume_waiter(session_id, ended=True)
+        # Stop generating and free the replay buffer; attached clients get "done"
+        if not await streams.release(session_id, final_event=json.dumps({"type": "done"})):
+            await shared_state.publish(TOOL_EVENTS_CHANNEL, {"session_id": session_id, "ended": True})
         
         return {"success": True, "message": "Session ended"}
     else:
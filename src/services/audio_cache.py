@@ -0,0 +1,216 @@
+
+"""
+Content-addressed on-disk cache for generated speech.
+
+Audio is stored under AUDIO_CACHE_DIR as <digest>.mp3, where the digest is a
+SHA-256 of the synthesis inputs (text, voice, model and voice settings), so
+the same phrase maps to the same file in every worker and across restarts.
+Files are written to a temporary name while they stream in and renamed into
+place once complete. The total size is capped at AUDIO_CACHE_MAX_BYTES, and
+the least recently used files are evicted first.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+AUDIO_CACHE_DIR = os.environ.get("AUDIO_CACHE_DIR", "data/audio")
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_BYTES", str(1024 ** 3)))
+
+# Bytes read per chunk when serving cached files
+_READ_CHUNK = 64 * 1024
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def audio_digest(text: str, voice_id: str, model_id: str, voice_settings: Dict[str, Any]) -> str:
+    """Stable digest of the inputs that determine the generated audio"""
+    raw = json.dumps(
+        {"text": text, "voice_id": voice_id, "model_id": model_id, "voice_settings": voice_settings},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def is_digest(value: str) -> bool:
+    return bool(_DIGEST.match(value))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` range into inclusive (start, end) offsets.
+
+    Returns None when there is no usable Range header, and raises ValueError
+    when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[6:].strip().partition("-")
+    try:
+        if not start_text:
+            # Suffix range: the last N bytes
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        raise ValueError(f"Invalid range: {header}")
+    if start >= size or start > end:
+        raise ValueError(f"Range not satisfiable: {header}")
+    return start, min(end, size - 1)
+
+
+class AudioCacheWriter:
+    """Writes one audio file as chunks arrive; nothing is visible until commit()"""
+
+    def __init__(self, cache: "AudioCache", digest: str):
+        self.cache = cache
+        self.digest = digest
+        self.path = cache.path(digest)
+        self.tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        self.size = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.tmp_path, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> None:
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class AudioCache:
+    """Size-capped LRU of audio files addressed by digest"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()  # least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.mp3")
+
+    def url(self, digest: str) -> str:
+        return f"/audio/generated/{digest}.mp3"
+
+    def _scan(self) -> None:
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(".tmp"):
+                    # Left over from an interrupted download
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                elif name.endswith(".mp3") and is_digest(name[:-4]):
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, digest, size in sorted(files):
+            self._track(digest, size)
+
+    async def load(self) -> None:
+        """Index the files already on disk (oldest first) on startup"""
+        if os.path.isdir(self.directory):
+            await asyncio.to_thread(self._scan)
+
+    def _track(self, digest: str, size: int) -> None:
+        previous = self._sizes.pop(digest, 0)
+        self._sizes[digest] = size
+        self.total_bytes += size - previous
+
+    def _file_size(self, digest: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.path(digest))
+        except OSError:
+            return None
+
+    async def get(self, digest: str) -> Optional[int]:
+        """
+        Size of the cached audio for `digest`, marking it recently used.
+
+        Files written by other workers are picked up from disk.
+        """
+        size = self._sizes.get(digest)
+        if size is None:
+            size = await asyncio.to_thread(self._file_size, digest)
+            if size is None:
+                self.misses += 1
+                return None
+        self._track(digest, size)
+        self.hits += 1
+        return size
+
+    def writer(self, digest: str) -> AudioCacheWriter:
+        return AudioCacheWriter(self, digest)
+
+    def _remove(self, paths: List[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def committed(self, writer: AudioCacheWriter) -> None:
+        """Account for a committed file and evict down to the size cap"""
+        self._track(writer.digest, writer.size)
+        victims = []
+        while self.total_bytes > self.max_bytes and len(self._sizes) > 1:
+            digest, size = self._sizes.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            victims.append(self.path(digest))
+        if victims:
+            await asyncio.to_thread(self._remove, victims)
+
+    def iter_file(self, digest: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Read a cached file (inclusive byte range) in chunks.
+
+        This is a sync generator; StreamingResponse runs it in a thread pool.
+        """
+        with open(self.path(digest), "rb") as f:
+            f.seek(start)
+            remaining = (end - start + 1) if end is not None else None
+            while remaining is None or remaining > 0:
+                chunk = f.read(_READ_CHUNK if remaining is None else min(_READ_CHUNK, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "files": len(self._sizes),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES)
@@ -0,0 +1,303 @@
+
+"""
+Circuit breakers, hedged requests and failover chains for the upstreams.
+
+Each upstream has a breaker that tracks the outcome of its recent calls.
+Errors (5xx, 429, timeouts, connection failures) and calls slower than
+BREAKER_SLOW_CALL_SECONDS count as failures. When the failure rate over the
+last BREAKER_WINDOW_SECONDS crosses BREAKER_FAILURE_RATE, the breaker opens
+and calls fail fast with a 503 for BREAKER_OPEN_SECONDS. After that, one
+probe call at a time is let through, and the first success closes the
+breaker again.
+
+Upstreams listed in HEDGE_UPSTREAMS get hedged calls: if the first attempt
+has not finished after the upstream's recent p95 latency, a second attempt
+is started and the first to succeed wins.
+
+FAILOVER_CHAINS maps a provider:model to the targets tried next when it
+fails or its breaker is open, e.g.
+    openai:gpt-4o-mini=huggingface:mistralai/Mistral-7B-Instruct-v0.2
+Several chains are separated by ";" and targets within a chain by ",".
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+import httpx
+from fastapi import HTTPException
+
+from .admission import RateLimited
+from .deadlines import DeadlineExceeded
+
+T = TypeVar("T")
+
+WINDOW_SECONDS = float(os.environ.get("BREAKER_WINDOW_SECONDS", "30"))
+FAILURE_RATE = float(os.environ.get("BREAKER_FAILURE_RATE", "0.5"))
+MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "10"))
+SLOW_CALL_SECONDS = float(os.environ.get("BREAKER_SLOW_CALL_SECONDS", "10"))
+OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "30"))
+
+HEDGE_UPSTREAMS = {
+    name.strip() for name in os.environ.get("HEDGE_UPSTREAMS", "").split(",") if name.strip()
+}
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.05"))
+# Latency samples needed before hedging starts
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+
+# Status codes that mean the upstream (not the request) is at fault
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpen(HTTPException):
+    """A 503 raised here, without calling the upstream, while its circuit is open"""
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    if isinstance(error, HTTPException):
+        return error.status_code in RETRYABLE_STATUS
+    return isinstance(error, (httpx.RequestError, asyncio.TimeoutError))
+
+
+def parse_failover_chains(value: str) -> Dict[str, List[Tuple[str, str]]]:
+    chains: Dict[str, List[Tuple[str, str]]] = {}
+    for entry in value.split(";"):
+        source, _, targets = entry.partition("=")
+        if not source.strip() or not targets.strip():
+            continue
+        chain = []
+        for target in targets.split(","):
+            provider, _, model = target.strip().partition(":")
+            if provider and model:
+                chain.append((provider, model))
+        chains[source.strip()] = chain
+    return chains
+
+
+FAILOVER_CHAINS = parse_failover_chains(os.environ.get(
+    "FAILOVER_CHAINS", "openai:gpt-4o-mini=huggingface:mistralai/Mistral-7B-Instruct-v0.2"
+))
+
+
+def failover_chain(provider: str, model: str) -> List[Tuple[str, str]]:
+    """Targets to try after provider:model, in order"""
+    return FAILOVER_CHAINS.get(f"{provider}:{model}") or FAILOVER_CHAINS.get(f"{provider}:*", [])
+
+
+class LatencyTracker:
+    """Recent successful call latencies with a cached percentile"""
+
+    def __init__(self, size: int = 256, refresh_every: int = 16):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._refresh_every = refresh_every
+        self._since_refresh = 0
+        self._percentiles: Dict[float, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._since_refresh += 1
+        if self._since_refresh >= self._refresh_every:
+            self._percentiles.clear()
+            self._since_refresh = 0
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        value = self._percentiles.get(p)
+        if value is None:
+            ordered = sorted(self._samples)
+            value = ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)]
+            self._percentiles[p] = value
+        return value
+
+
+class CircuitBreaker:
+    """Closed -> open on a high failure rate -> half-open probe -> closed"""
+
+    def __init__(
+        self,
+        name: str,
+        window: float = WINDOW_SECONDS,
+        failure_rate: float = FAILURE_RATE,
+        min_calls: int = MIN_CALLS,
+        slow_call: float = SLOW_CALL_SECONDS,
+        open_seconds: float = OPEN_SECONDS
+    ):
+        self.name = name
+        self.window = window
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probing = False
+        self._outcomes: Deque[Tuple[float, bool]] = deque()  # (time, failed)
+        self._failures = 0
+        self.latency = LatencyTracker()
+        self.rejected = 0
+        self.opened = 0
+
+    def _prune(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            _, failed = self._outcomes.popleft()
+            self._failures -= failed
+
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether a call may go out now (claims the probe when half-open)"""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and self.retry_after() <= 0:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def _open(self, now: float) -> None:
+        self.state = "open"
+        self._opened_at = now
+        self.opened += 1
+
+    def record(self, failed: bool, seconds: Optional[float] = None) -> None:
+        now = time.monotonic()
+        if seconds is not None:
+            if not failed:
+                self.latency.record(seconds)
+            failed = failed or seconds > self.slow_call
+        if self.state == "half_open":
+            self._probing = False
+            if failed:
+                self._open(now)
+            else:
+                self.state = "closed"
+                self._outcomes.clear()
+                self._failures = 0
+            return
+
+        self._outcomes.append((now, failed))
+        self._failures += failed
+        self._prune(now)
+        if (
+            self.state == "closed"
+            and len(self._outcomes) >= self.min_calls
+            and self._failures / len(self._outcomes) >= self.failure_rate
+        ):
+            self._open(now)
+
+    def release_probe(self) -> None:
+        """A half-open probe ended without an outcome (e.g. it was cancelled)"""
+        self._probing = False
+
+    def hedge_delay(self) -> Optional[float]:
+        if len(self.latency) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, self.latency.percentile(HEDGE_PERCENTILE))
+
+    def stats(self) -> Dict[str, Any]:
+        self._prune(time.monotonic())
+        p50 = self.latency.percentile(50)
+        p95 = self.latency.percentile(95)
+        return {
+            "state": self.state,
+            "calls": len(self._outcomes),
+            "failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class CircuitBreakers:
+    """Breakers by upstream name, plus guarded and hedged calls through them"""
+
+    def __init__(self, hedge_upstreams=HEDGE_UPSTREAMS):
+        self.hedge_upstreams = set(hedge_upstreams)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(name)
+        return breaker
+
+    def check(self, name: str) -> CircuitBreaker:
+        """The upstream's breaker; raises a 503 when it is open"""
+        breaker = self.get(name)
+        if not breaker.allow():
+            raise CircuitOpen(
+                status_code=503,
+                detail=f"{name} is temporarily unavailable (circuit open)",
+                headers={"Retry-After": str(max(1, math.ceil(breaker.retry_after())))},
+            )
+        return breaker
+
+    async def _attempt(self, breaker: CircuitBreaker, attempt: Callable[[], Awaitable[T]]) -> T:
+        start = time.monotonic()
+        try:
+            result = await attempt()
+        except (asyncio.CancelledError, RateLimited, DeadlineExceeded):
+            # No upstream outcome: cancelled (e.g. a losing hedge), shed locally
+            # or out of time before the call
+            breaker.release_probe()
+            raise
+        except BaseException as e:
+            breaker.record(is_upstream_failure(e))
+            raise
+        breaker.record(False, time.monotonic() - start)
+        return result
+
+    async def call(self, name: str, attempt: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `attempt` through the upstream's breaker, hedging it when the
+        upstream is in HEDGE_UPSTREAMS and has enough latency history.
+        """
+        breaker = self.check(name)
+        delay = breaker.hedge_delay() if name in self.hedge_upstreams and breaker.state == "closed" else None
+        if delay is None:
+            return await self._attempt(breaker, attempt)
+
+        first = asyncio.ensure_future(self._attempt(breaker, attempt))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedged += 1
+                tasks.append(asyncio.ensure_future(self._attempt(breaker, attempt)))
+            error: Optional[BaseException] = None
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    result = await next_done
+                except Exception as e:
+                    error = e
+                    continue
+                if len(tasks) > 1 and not first.done():
+                    self.hedge_wins += 1
+                return result
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "upstreams": {name: breaker.stats() for name, breaker in self._breakers.items()},
+        }
+
+
+circuit_breakers = CircuitBreakers()
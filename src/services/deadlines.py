@@ -0,0 +1,188 @@
+
+"""
+Request deadlines.
+
+Clients say how long they are willing to wait with either header:
+* X-Request-Timeout: seconds from when the request arrives;
+* X-Request-Deadline: an absolute time in epoch seconds.
+
+A chat request can also give a `timeout` field. DeadlineMiddleware turns the
+header into a deadline on the monotonic clock, kept in a context variable
+for the request. Upstream calls made for the request read it to cap their
+HTTP timeouts, queue and rate-limit waits, and retries with what is left.
+HTTP timeouts only bound each read, so each attempt (see bounded()) and each
+read of a relayed stream (see bounded_iter()) is also cut short when the
+deadline passes.
+
+Without a client deadline, each upstream call (retries included) gets a
+default budget instead, see budget().
+"""
+import asyncio
+import contextvars
+import email.utils
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional, TypeVar
+
+from fastapi import HTTPException
+
+T = TypeVar("T")
+
+TIMEOUT_HEADER = b"x-request-timeout"
+DEADLINE_HEADER = b"x-request-deadline"
+
+# Monotonic time by which the request being handled must be answered
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "request_deadline", default=None
+)
+# Default deadline of the upstream call in progress, for requests without one
+_call_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "call_deadline", default=None
+)
+
+
+class DeadlineExceeded(HTTPException):
+    """A 504 raised here, once the request's deadline has passed"""
+
+    def __init__(self, detail: str = "Request deadline exceeded"):
+        super().__init__(status_code=504, detail=detail)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the request's (or the call's default) deadline, None without one"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        deadline = _call_deadline.get()
+        if deadline is None:
+            return None
+    return deadline - time.monotonic()
+
+
+def detached() -> contextvars.Context:
+    """
+    A copy of the current context without its deadlines, for work shared by
+    several requests (each bounds its own wait instead)
+    """
+    context = contextvars.copy_context()
+    context.run(request_deadline.set, None)
+    context.run(_call_deadline.set, None)
+    return context
+
+
+def client_deadline_passed() -> bool:
+    """Whether the client's own deadline is what ran out (give or take timer slack)"""
+    deadline = request_deadline.get()
+    return deadline is not None and deadline <= time.monotonic() + 0.05
+
+
+def check() -> Optional[float]:
+    """remaining(), raising DeadlineExceeded when no time is left"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded()
+    return left
+
+
+def shorten(seconds: Optional[float]) -> None:
+    """Bring the request's deadline forward to `seconds` from now (never later)"""
+    if seconds is None:
+        return
+    deadline = time.monotonic() + max(0.0, seconds)
+    current = request_deadline.get()
+    if current is None or deadline < current:
+        request_deadline.set(deadline)
+
+
+@contextmanager
+def budget(seconds: float) -> Iterator[None]:
+    """A default deadline `seconds` from now for the block, unless one is set already"""
+    if request_deadline.get() is not None or _call_deadline.get() is not None:
+        yield
+        return
+    token = _call_deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _call_deadline.reset(token)
+
+
+@asynccontextmanager
+async def bounded(what: str) -> AsyncIterator[None]:
+    """Cancel the block when the deadline passes, raising DeadlineExceeded"""
+    left = check()
+    if left is None:
+        yield
+        return
+    timeout = asyncio.timeout(left)
+    try:
+        async with timeout:
+            yield
+    except TimeoutError:
+        if timeout.expired():
+            raise DeadlineExceeded(f"Request deadline exceeded waiting for {what}") from None
+        raise
+
+
+async def bounded_iter(chunks: AsyncIterator[T], what: str) -> AsyncIterator[T]:
+    """
+    `chunks` (a relayed upstream body), each read cut short by the client's
+    deadline. Streams without one are not bounded.
+    """
+    if request_deadline.get() is None:
+        async for chunk in chunks:
+            yield chunk
+        return
+    iterator = chunks.__aiter__()
+    while True:
+        async with bounded(what):
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return
+        yield chunk
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After value (seconds or an HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _header_budget(headers) -> Optional[float]:
+    """Seconds the client will wait, from the request headers"""
+    for name, value in headers:
+        try:
+            if name == TIMEOUT_HEADER:
+                return float(value)
+            if name == DEADLINE_HEADER:
+                return float(value) - time.time()
+        except ValueError:
+            return None
+    return None
+
+
+class DeadlineMiddleware:
+    """ASGI middleware setting the request's deadline from its headers"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # Set for every request, so no deadline carries over to the next one
+        seconds = _header_budget(scope["headers"])
+        token = request_deadline.set(None if seconds is None else time.monotonic() + max(0.0, seconds))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
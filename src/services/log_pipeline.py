@@ -0,0 +1,364 @@
+
+"""
+Structured logging: application, access and audit records as JSON lines.
+
+Three streams are written:
+* app: records of the standard `logging` module (modules log through
+  logging.getLogger(__name__)), collected by LogQueueHandler on the root
+  logger and also echoed to stderr from LOG_CONSOLE_LEVEL up;
+* access: one record per HTTP request from AccessLogMiddleware, sampled.
+  ACCESS_LOG_SAMPLE_RATE of requests are kept, plus every 5xx and every
+  request slower than ACCESS_LOG_SLOW_MS. Each record carries the rate it
+  was sampled at, so counts can be scaled back up;
+* audit: admin actions, never sampled or dropped.
+
+Logging never blocks a request. Records are appended to an in-memory queue
+and a background task writes them in batches from a worker thread, when
+LOG_BATCH_SIZE records are waiting or every LOG_FLUSH_INTERVAL seconds.
+App and access records share a queue of LOG_QUEUE_SIZE. When it is full,
+new records are dropped and counted per stream. Audit records have their
+own unbounded queue, since admin actions are rare. They are written as soon
+as possible and fsynced, and kept for the next flush if a write fails.
+
+Each stream goes to LOG_DIR/<stream>.jsonl. A file is rotated to
+<stream>.jsonl.1 ... .<LOG_BACKUPS> once it reaches LOG_MAX_BYTES. Writes
+and rotations hold a lock file, so the workers of serve.py can share the
+files. When LOG_DIR cannot be created, access and audit records are written
+to stderr instead, and app records are only echoed.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process only
+    fcntl = None
+
+LOG_DIR = os.environ.get("LOG_DIR", "data/logs")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_CONSOLE_LEVEL = os.environ.get("LOG_CONSOLE_LEVEL", "INFO").upper()
+QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.environ.get("LOG_BATCH_SIZE", "500"))
+FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", "1"))
+MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+BACKUPS = int(os.environ.get("LOG_BACKUPS", "5"))
+ACCESS_SAMPLE_RATE = float(os.environ.get("ACCESS_LOG_SAMPLE_RATE", "0.1"))
+ACCESS_SLOW_MS = float(os.environ.get("ACCESS_LOG_SLOW_MS", "1000"))
+
+STREAMS = ("app", "access", "audit")
+
+# Client libraries that log every request at INFO
+QUIET_LOGGERS = ("httpx", "httpcore")
+
+# Attributes every LogRecord has; any others were passed with `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+def utc_iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class _FileLock:
+    """Exclusive flock on the log directory's lock file"""
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, ".lock")
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+
+class LogPipeline:
+    """Queues log records and writes them to rotating JSONL files"""
+
+    def __init__(self, directory: str = LOG_DIR, queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL, max_bytes: int = MAX_BYTES, backups: int = BACKUPS,
+                 sample_rate: float = ACCESS_SAMPLE_RATE, slow_ms: float = ACCESS_SLOW_MS,
+                 console_level: int = logging.getLevelName(LOG_CONSOLE_LEVEL)):
+        self.directory = directory
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.console_level = console_level
+        self._queue: Deque[Tuple[str, Dict[str, Any]]] = deque()
+        self._audit: Deque[Dict[str, Any]] = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._handler: Optional[logging.Handler] = None
+        self.queued = {stream: 0 for stream in STREAMS}
+        self.dropped = {stream: 0 for stream in STREAMS}
+        self.sampled_out = 0
+        self.written = 0
+        self.write_errors = 0
+        self.to_files = True
+
+    # ----- Recording -----
+
+    def _signal(self) -> None:
+        """Wake the writer (from any thread)"""
+        if self._wake is None:
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def emit(self, stream: str, record: Dict[str, Any]) -> bool:
+        """Queue an app or access record; False when the queue is full and it was dropped"""
+        if len(self._queue) >= self.queue_size:
+            self.dropped[stream] += 1
+            return False
+        self._queue.append((stream, record))
+        self.queued[stream] += 1
+        if len(self._queue) >= self.batch_size:
+            self._signal()
+        return True
+
+    def access(self, record: Dict[str, Any]) -> bool:
+        """Queue an access record if it is sampled; errors and slow requests always are"""
+        if record.get("status", 0) >= 500 or record.get("duration_ms", 0) >= self.slow_ms:
+            record["sample_rate"] = 1.0
+        elif random.random() < self.sample_rate:
+            record["sample_rate"] = self.sample_rate
+        else:
+            self.sampled_out += 1
+            return False
+        return self.emit("access", record)
+
+    def audit(self, action: str, actor: str, outcome: str, **fields: Any) -> None:
+        """Record an admin action; audit records are never sampled or dropped"""
+        self._audit.append({"ts": utc_iso(time.time()), "action": action, "actor": actor,
+                            "outcome": outcome, **fields})
+        self.queued["audit"] += 1
+        self._signal()
+
+    # ----- Writing -----
+
+    def _path(self, stream: str) -> str:
+        return os.path.join(self.directory, f"{stream}.jsonl")
+
+    def _rotate(self, path: str) -> None:
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.unlink(path)
+
+    def _append(self, stream: str, lines: List[str], sync: bool = False) -> None:
+        path = self._path(stream)
+        data = ("\n".join(lines) + "\n").encode()
+        with _FileLock(self.directory):
+            try:
+                if os.path.getsize(path) + len(data) > self.max_bytes:
+                    self._rotate(path)
+            except FileNotFoundError:
+                pass
+            with open(path, "ab") as f:
+                f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def _echo(self, records: List[Dict[str, Any]]) -> None:
+        lines = []
+        for record in records:
+            if logging.getLevelName(record["level"]) >= self.console_level:
+                fields = " ".join(f"{k}={v}" for k, v in record.items() if k not in ("ts", "level", "logger", "msg"))
+                lines.append(f"{record['ts']} {record['level']} {record['logger']}: {record['msg']}"
+                             + (f" {fields}" if fields else "") + "\n")
+        if lines:
+            sys.stderr.write("".join(lines))
+            sys.stderr.flush()
+
+    def _write(self, stream: str, records: List[Dict[str, Any]]) -> None:
+        # Echoed first, so the console keeps app records the files cannot take
+        if stream == "app":
+            self._echo(records)
+        lines = [json.dumps(r, separators=(",", ":"), default=str) for r in records]
+        if self.to_files:
+            self._append(stream, lines, sync=stream == "audit")
+        elif stream != "app":
+            sys.stderr.write("".join(f"{line}\n" for line in lines))
+            sys.stderr.flush()
+
+    async def flush(self) -> int:
+        """Write the queued records; returns how many were written"""
+        written = 0
+        if self._audit:
+            audit = list(self._audit)
+            self._audit.clear()
+            try:
+                await asyncio.to_thread(self._write, "audit", audit)
+                written += len(audit)
+            except OSError as e:
+                # Kept for the next flush
+                self._audit.extendleft(reversed(audit))
+                self._write_failed(e)
+        if self._queue:
+            by_stream: Dict[str, List[Dict[str, Any]]] = {}
+            while self._queue:
+                stream, record = self._queue.popleft()
+                by_stream.setdefault(stream, []).append(record)
+            for stream, records in by_stream.items():
+                try:
+                    await asyncio.to_thread(self._write, stream, records)
+                    written += len(records)
+                except OSError as e:
+                    self.dropped[stream] += len(records)
+                    self._write_failed(e)
+        self.written += written
+        return written
+
+    def _write_failed(self, error: OSError) -> None:
+        self.write_errors += 1
+        # Not through logging, which would queue it behind the records that failed
+        sys.stderr.write(f"Error writing logs to {self.directory}: {error}\n")
+
+    # ----- Lifecycle -----
+
+    async def _run(self, wake: asyncio.Event) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+            await self.flush()
+
+    async def startup(self, level: str = LOG_LEVEL) -> None:
+        """Start the writer and collect the root logger's records"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            # Logs on stderr rather than no gateway at all
+            self.to_files = False
+            sys.stderr.write(f"Cannot create log directory {self.directory} ({e}), logging to stderr\n")
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run(self._wake))
+        root = logging.getLogger()
+        root.setLevel(level)
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+        self._handler = LogQueueHandler(self)
+        root.addHandler(self._handler)
+
+    async def shutdown(self) -> None:
+        if self._handler is not None:
+            logging.getLogger().removeHandler(self._handler)
+            self._handler = None
+        self._wake = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued_now": len(self._queue) + len(self._audit),
+            "written": self.written,
+            "write_errors": self.write_errors,
+            "sampled_out": self.sampled_out,
+            "to_files": int(self.to_files),
+            **{f"queued_{stream}": count for stream, count in self.queued.items()},
+            **{f"dropped_{stream}": count for stream, count in self.dropped.items()},
+        }
+
+
+class LogQueueHandler(logging.Handler):
+    """Turns `logging` records into app records of a pipeline, without blocking"""
+
+    def __init__(self, pipeline: LogPipeline, level: int = logging.NOTSET):
+        super().__init__(level)
+        self.pipeline = pipeline
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            entry: Dict[str, Any] = {
+                "ts": utc_iso(record.created),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+            }
+            for key, value in vars(record).items():
+                if key not in _RECORD_ATTRIBUTES:
+                    entry[key] = value
+            if record.exc_info:
+                entry["error"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            self.pipeline.emit("app", entry)
+        except Exception:
+            self.handleError(record)
+
+
+class AccessLogMiddleware:
+    """ASGI middleware queueing an access record per HTTP request"""
+
+    def __init__(self, app, pipeline: Optional[LogPipeline] = None):
+        self.app = app
+        self.pipeline = pipeline or log_pipeline
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        state = [500, 0]  # status, bytes out
+
+        async def recording_send(message):
+            if message["type"] == "http.response.start":
+                state[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                state[1] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, recording_send)
+        finally:
+            headers = dict(scope.get("headers") or [])
+            client = scope.get("client")
+            # The path only: query strings may carry tokens
+            self.pipeline.access({
+                "ts": utc_iso(time.time()),
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": state[0],
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                "bytes_out": state[1],
+                "client": client[0] if client else None,
+                "request_id": headers.get(b"x-request-id", b"").decode(errors="replace") or None,
+            })
+
+
+log_pipeline = LogPipeline()
@@ -0,0 +1,451 @@
+
+"""
+Prometheus metrics for the gateway.
+
+Metrics are kept in plain Python objects: each label combination gets a
+child with pre-allocated bucket counters on first use. Recording is then a
+dict lookup plus a bisect, with no per-request label dicts. The registry is
+rendered in the Prometheus text format by /metrics.
+
+Three sources feed it:
+* MetricsMiddleware records latency, status and bytes per route template.
+* upstream_hooks() instruments the shared upstream clients: connect time,
+  time to first byte, total time, bytes and status codes per upstream.
+* register_stats() exports the stats() dicts of caches, pools, limiters,
+  breakers and AG-UI streams as gauges when /metrics is scraped.
+
+With METRICS_TRACING=otel (and opentelemetry-api installed), requests and
+upstream calls are also recorded as OpenTelemetry spans.
+
+Under serve.py with several workers, each worker pushes its rendered
+metrics to the shared-state broker every METRICS_PUSH_INTERVAL seconds, and
+/metrics returns every worker's samples with a `worker` label.
+"""
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+TRACING = os.environ.get("METRICS_TRACING", "off").lower()
+PUSH_INTERVAL = float(os.environ.get("METRICS_PUSH_INTERVAL", "5"))
+
+# Seconds; spans fast cache hits to long streams
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_tracer = None
+if TRACING == "otel":
+    try:
+        from opentelemetry import trace as otel_trace
+        _tracer = otel_trace.get_tracer("mcp-gateway")
+    except ImportError:
+        logger.warning("METRICS_TRACING=otel needs opentelemetry-api; tracing is off")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_string(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+
+def _format(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._label_strings: Dict[Tuple[str, ...], str] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The child for these label values (created once, then cached)"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+            self._label_strings[values] = _label_string(self.labelnames, values)
+        return child
+
+    def render(self, lines: List[str]) -> None:
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for values, child in list(self._children.items()):
+            self._render_child(lines, self._label_strings[values], child)
+
+    def _render_child(self, lines: List[str], labels: str, child) -> None:
+        lines.append(f"{self.name}{{{labels}}} {_format(child.value)}" if labels
+                     else f"{self.name} {_format(child.value)}")
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._bucket_labels = [_format(b) for b in self.bounds] + ["+Inf"]
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def _render_child(self, lines: List[str], labels: str, child: _HistogramChild) -> None:
+        prefix = f"{labels}," if labels else ""
+        cumulative = 0
+        for le, count in zip(self._bucket_labels, child.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{self.name}_sum{suffix} {_format(child.sum)}")
+        lines.append(f"{self.name}_count{suffix} {child.count}")
+
+
+class Registry:
+    """Metrics plus stats callbacks, rendered together"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._stats: List[Tuple[str, Callable[[], Dict[str, Any]], Optional[str]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def register_stats(self, prefix: str, stats: Callable[[], Dict[str, Any]], label: Optional[str] = None) -> None:
+        """
+        Export the numeric fields of `stats()` as gauges named <prefix>_<field>.
+        With `label`, stats() returns {label value: fields}.
+        """
+        self._stats.append((prefix, stats, label))
+
+    def _render_stats(self, lines: List[str]) -> None:
+        for prefix, stats, label in self._stats:
+            try:
+                snapshot = stats()
+            except Exception as e:
+                logger.error("Error collecting %s metrics: %s", prefix, e)
+                continue
+            groups: Iterable[Tuple[str, Dict[str, Any]]] = snapshot.items() if label else [("", snapshot)]
+            samples: Dict[str, List[str]] = {}
+            for label_value, fields in groups:
+                if not isinstance(fields, dict):
+                    continue
+                labels = f'{{{label}="{_escape(str(label_value))}"}}' if label else ""
+                for field, value in fields.items():
+                    if isinstance(value, bool):
+                        value = int(value)
+                    if isinstance(value, (int, float)):
+                        samples.setdefault(field, []).append(f"{prefix}_{field}{labels} {_format(value)}")
+            for field, field_lines in samples.items():
+                lines.append(f"# TYPE {prefix}_{field} gauge")
+                lines.extend(field_lines)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            metric.render(lines)
+        self._render_stats(lines)
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = Registry()
+
+# ===== Gateway requests =====
+request_duration = registry.histogram(
+    "gateway_request_duration_seconds", "Time to handle a request, by route template", ("method", "route"))
+requests_total = registry.counter(
+    "gateway_requests_total", "Requests handled, by route template and status", ("method", "route", "status"))
+request_bytes = registry.counter(
+    "gateway_request_bytes_total", "Request body bytes received", ("method", "route"))
+response_bytes = registry.counter(
+    "gateway_response_bytes_total", "Response body bytes sent", ("method", "route"))
+requests_in_flight = registry.gauge(
+    "gateway_requests_in_flight", "Requests being handled (including open streams)").labels()
+
+# ===== Upstream calls =====
+upstream_connect = registry.histogram(
+    "gateway_upstream_connect_seconds", "Time to open a new upstream connection (TCP + TLS)", ("upstream",))
+upstream_ttfb = registry.histogram(
+    "gateway_upstream_ttfb_seconds", "Time from sending a request to receiving response headers", ("upstream",))
+upstream_duration = registry.histogram(
+    "gateway_upstream_duration_seconds", "Time from sending a request to the end of the response body", ("upstream",))
+upstream_responses = registry.counter(
+    "gateway_upstream_responses_total", "Upstream responses by status code", ("upstream", "status"))
+upstream_errors = registry.counter(
+    "gateway_upstream_errors_total", "Upstream requests that failed without a response", ("upstream",))
+upstream_request_bytes = registry.counter(
+    "gateway_upstream_request_bytes_total", "Request body bytes sent upstream", ("upstream",))
+upstream_response_bytes = registry.counter(
+    "gateway_upstream_response_bytes_total", "Response body bytes received from upstream", ("upstream",))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route latency, status and bytes.
+
+    Routes are labelled by their template (e.g. /proxy/vector/collections/{collection}/upsert)
+    so label cardinality stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        state = [500, 0, 0]  # status, bytes in, bytes out
+
+        async def counting_receive():
+            message = await receive()
+            state[1] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                state[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                state[2] += len(message.get("body", b""))
+            await send(message)
+
+        span = None
+        if _tracer is not None:
+            span = _tracer.start_span(f"{scope['method']} {scope['path']}", kind=otel_trace.SpanKind.SERVER)
+        requests_in_flight.inc()
+        try:
+            if span is not None:
+                with otel_trace.use_span(span, end_on_exit=False):
+                    await self.app(scope, counting_receive, counting_send)
+            else:
+                await self.app(scope, counting_receive, counting_send)
+        finally:
+            requests_in_flight.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            request_duration.labels(method, path).observe(time.perf_counter() - start)
+            requests_total.labels(method, path, str(state[0])).inc()
+            request_bytes.labels(method, path).inc(state[1])
+            response_bytes.labels(method, path).inc(state[2])
+            if span is not None:
+                span.update_name(f"{method} {path}")
+                span.set_attribute("http.status_code", state[0])
+                span.end()
+
+
+class _UpstreamCall:
+    """Timing of one upstream request, fed by httpx hooks and httpcore trace events"""
+
+    __slots__ = ("upstream", "start", "connect_start", "connect_end", "span")
+
+    def __init__(self, upstream: str):
+        self.upstream = upstream
+        self.start = time.perf_counter()
+        self.connect_start = 0.0
+        self.connect_end = 0.0
+        self.span = _tracer.start_span(f"upstream {upstream}") if _tracer is not None else None
+
+    async def trace(self, event: str, info: Dict[str, Any]) -> None:
+        if event == "connection.connect_tcp.started":
+            self.connect_start = time.perf_counter()
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            self.connect_end = time.perf_counter()
+        elif event.endswith(".failed") and event.startswith("connection."):
+            upstream_errors.labels(self.upstream).inc()
+
+    def finish(self, status: int, received: int) -> None:
+        upstream_duration.labels(self.upstream).observe(time.perf_counter() - self.start)
+        upstream_response_bytes.labels(self.upstream).inc(received)
+        if self.span is not None:
+            self.span.set_attribute("http.status_code", status)
+            self.span.set_attribute("http.response_content_length", received)
+            self.span.end()
+
+
+class _MeasuredStream(httpx.AsyncByteStream):
+    """Response body wrapper that records total time and bytes when closed"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, call: _UpstreamCall, status: int):
+        self._stream = stream
+        self._call = call
+        self._status = status
+        self._received = 0
+        self._finished = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._received += len(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._finished:
+                self._finished = True
+                self._call.finish(self._status, self._received)
+
+
+def upstream_hooks(upstream: str) -> Dict[str, List[Callable]]:
+    """httpx event hooks that record metrics for every call made by a client"""
+    if not METRICS_ENABLED:
+        return {}
+
+    async def on_request(request: httpx.Request) -> None:
+        # Connections opened by upstream_pool.prewarm() are not calls
+        if request.extensions.get("prewarm"):
+            return
+        call = _UpstreamCall(upstream)
+        request.extensions["metrics_call"] = call
+        request.extensions["trace"] = call.trace
+        content_length = request.headers.get("content-length")
+        if content_length:
+            upstream_request_bytes.labels(upstream).inc(int(content_length))
+
+    async def on_response(response: httpx.Response) -> None:
+        call = response.request.extensions.get("metrics_call")
+        if call is None:
+            return
+        now = time.perf_counter()
+        if call.connect_end:
+            upstream_connect.labels(upstream).observe(call.connect_end - call.connect_start)
+        upstream_ttfb.labels(upstream).observe(now - call.start)
+        upstream_responses.labels(upstream, str(response.status_code)).inc()
+        response.stream = _MeasuredStream(response.stream, call, response.status_code)
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def merge_workers(texts: Dict[str, str]) -> str:
+    """
+    Combine rendered metrics of several workers into one exposition, each
+    family listed once and every sample labelled with its worker
+    """
+    families: Dict[str, Tuple[List[str], List[str]]] = {}  # name -> (HELP/TYPE lines, samples)
+    for worker, text in sorted(texts.items()):
+        worker_label = f'worker="{_escape(worker)}"'
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("# "):
+                name = line.split(" ", 3)[2]
+                family = families.setdefault(name, ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+                continue
+            if family is None:
+                continue
+            space = line.index(" ")
+            brace = line.find("{", 0, space)
+            if brace == -1:
+                line = f"{line[:space]}{{{worker_label}}}{line[space:]}"
+            else:
+                line = f"{line[:brace + 1]}{worker_label},{line[brace + 1:]}"
+            family[1].append(line)
+    lines: List[str] = []
+    for headers, samples in families.values():
+        lines.extend(headers)
+        lines.extend(samples)
+    lines.append("")
+    return "\n".join(lines)
+
+
+async def push_snapshots(state, worker: str, interval: float = PUSH_INTERVAL) -> None:
+    """Publish this worker's metrics to the shared-state broker until cancelled"""
+    while True:
+        try:
+            await state.put_snapshot(f"metrics:{worker}", registry.render(), interval * 3)
+        except Exception as e:
+            logger.error("Error pushing metrics: %s", e)
+        await asyncio.sleep(interval)
+
+
+async def render_workers(state, worker: str) -> str:
+    """Metrics of every live worker; this worker's are rendered fresh"""
+    texts = {
+        name.partition(":")[2]: text
+        for name, text in (await state.snapshots()).items()
+        if name.startswith("metrics:")
+    }
+    texts[worker] = registry.render()
+    return merge_workers(texts)
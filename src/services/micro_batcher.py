@@ -0,0 +1,139 @@
+
+"""
+Adaptive micro-batching of concurrent calls.
+
+Callers submit one item under a key, such as a model and its generation
+parameters. Items with the same key that arrive close together are sent
+upstream as one batch, and each caller receives its own result (or the
+batch's exception).
+
+Each key tracks how often items arrive, as a moving average of the gaps
+between arrivals. When the next item is expected within `max_wait`, the
+first item of a batch waits for more: up to `max_wait`, and no longer than
+the time `max_size` items should take to arrive. A full batch is sent at
+once. At low load the expected gap is longer than `max_wait`, so items are
+sent alone right away and batching adds no latency.
+
+Cancelling a waiting caller does not cancel its batch; its result is
+dropped. A batch is sent without the deadline of any one caller; each
+caller's own deadline only bounds that caller's wait for its result.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from . import deadlines
+
+SendBatch = Callable[[List[Any]], Awaitable[List[Any]]]
+
+# Weight of the latest gap in the moving average
+GAP_SMOOTHING = 0.2
+
+
+class _Batch:
+    def __init__(self, send: SendBatch):
+        self.send = send
+        self.entries: List[Tuple[Any, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """Collect concurrent items with the same key into batches"""
+
+    def __init__(self, max_size: int = 8, max_wait: float = 0.005):
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self._open: Dict[Hashable, _Batch] = {}
+        # key -> (last arrival, average gap between arrivals)
+        self._arrivals: Dict[Hashable, Tuple[float, float]] = {}
+        self._sending: set = set()
+        self.items = 0
+        self.batches = 0
+        self.unbatched = 0
+
+    def _expected_gap(self, key: Hashable) -> float:
+        """Update the key's arrival rate with an arrival now; returns the average gap"""
+        now = time.monotonic()
+        last, gap = self._arrivals.get(key, (None, float("inf")))
+        if last is not None:
+            latest = now - last
+            gap = latest if gap == float("inf") else GAP_SMOOTHING * latest + (1 - GAP_SMOOTHING) * gap
+        self._arrivals[key] = (now, gap)
+        if len(self._arrivals) > 10000:
+            # Forget keys not seen for a while
+            cutoff = now - 60
+            self._arrivals = {k: v for k, v in self._arrivals.items() if v[0] >= cutoff}
+        return gap
+
+    def _flush(self, key: Hashable) -> None:
+        batch = self._open.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.get_running_loop().create_task(self._send(batch), context=deadlines.detached())
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: _Batch) -> None:
+        futures = [future for _, future in batch.entries]
+        self.batches += 1
+        try:
+            results = await batch.send([item for item, _ in batch.entries])
+            if len(results) != len(futures):
+                raise ValueError(f"Batch of {len(futures)} items returned {len(results)} results")
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def submit(self, key: Hashable, item: Any, send: SendBatch) -> Any:
+        """
+        Add `item` to the open batch of `key` (opening one if needed) and
+        wait for its result. `send(items)` returns one result per item, in
+        order, where an exception fails that item only. The first caller's
+        `send` sends the whole batch.
+        """
+        self.items += 1
+        gap = self._expected_gap(key)
+        batch = self._open.get(key)
+        if batch is None:
+            if gap >= self.max_wait or self.max_size == 1:
+                self.unbatched += 1
+                self.batches += 1
+                result = (await send([item]))[0]
+                if isinstance(result, Exception):
+                    raise result
+                return result
+            batch = self._open[key] = _Batch(send)
+            window = min(self.max_wait, gap * (self.max_size - 1))
+            batch.timer = asyncio.get_running_loop().call_later(window, self._flush, key)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.entries.append((item, future))
+        if len(batch.entries) >= self.max_size:
+            self._flush(key)
+        async with deadlines.bounded("a batched call"):
+            return await future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "open": len(self._open),
+            "sending": len(self._sending),
+            "items": self.items,
+            "batches": self.batches,
+            "unbatched": self.unbatched,
+            "average_size": round(self.items / self.batches, 2) if self.batches else 0,
+        }
@@ -0,0 +1,239 @@
+
+"""
+Latency-aware routing for model="auto" and capability classes.
+
+The catalog (ROUTER_MODELS, a JSON list) describes the routable targets:
+
+    [{"provider": "openai", "model": "gpt-4o-mini", "classes": ["chat", "fast"],
+      "context": 128000, "cost": 0.6}, ...]
+
+`cost` is a blended price in USD per million tokens and `context` the
+context window in tokens. A request for "auto" may use any target, and
+"auto:<class>" only targets of that class. Both can be constrained with a
+maximum cost and a minimum context length.
+
+For every (provider, model) the router tracks the following live signals:
+* an EWMA of the latency of completed calls;
+* an EWMA of the error rate, decaying towards zero with a half-life of
+  ROUTER_ERROR_HALF_LIFE seconds when there are no new outcomes;
+* calls in flight.
+
+This is tracked for all traffic, not only routed requests. A target is
+healthy when its provider's circuit is not open and its error rate is below
+ROUTER_MAX_ERROR_RATE. Among healthy targets the lowest score wins:
+
+    latency * (1 + queue / ROUTER_QUEUE_SCALE) / (1 - error rate)
+
+`queue` counts the target's calls in flight plus requests waiting for the
+provider's upstream slots. A target without latency samples scores 0 so it
+is tried first. ROUTER_EXPLORE is the share of decisions that go to a random
+healthy target, so targets that stopped being picked get fresh samples.
+"""
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from .admission import RateLimited, admission
+from .circuit_breaker import circuit_breakers, is_upstream_failure
+from .deadlines import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODELS = [
+    {"provider": "openai", "model": "gpt-4o-mini", "classes": ["chat", "fast"], "context": 128000, "cost": 0.6},
+    {"provider": "openai", "model": "gpt-4o", "classes": ["chat", "quality"], "context": 128000, "cost": 10.0},
+    {"provider": "huggingface", "model": "mistralai/Mistral-7B-Instruct-v0.2", "classes": ["chat", "fast", "open"],
+     "context": 32768, "cost": 0.2},
+]
+
+LATENCY_SMOOTHING = float(os.environ.get("ROUTER_LATENCY_SMOOTHING", "0.2"))
+ERROR_SMOOTHING = float(os.environ.get("ROUTER_ERROR_SMOOTHING", "0.1"))
+ERROR_HALF_LIFE = float(os.environ.get("ROUTER_ERROR_HALF_LIFE", "30"))
+MAX_ERROR_RATE = float(os.environ.get("ROUTER_MAX_ERROR_RATE", "0.5"))
+QUEUE_SCALE = float(os.environ.get("ROUTER_QUEUE_SCALE", "16"))
+EXPLORE = float(os.environ.get("ROUTER_EXPLORE", "0.05"))
+# Decisions kept for the admin endpoint
+DECISION_LOG_SIZE = int(os.environ.get("ROUTER_DECISION_LOG_SIZE", "100"))
+
+
+class NoRoute(Exception):
+    """No target satisfies the request"""
+
+
+def is_routed(model: str) -> bool:
+    return model == "auto" or model.startswith("auto:")
+
+
+class TargetStats:
+    """Live signals of one (provider, model)"""
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self._errors = 0.0
+        self._errors_at = time.monotonic()
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.routed = 0
+
+    def error_rate(self, now: Optional[float] = None) -> float:
+        age = (now or time.monotonic()) - self._errors_at
+        return self._errors * 0.5 ** (age / ERROR_HALF_LIFE)
+
+    def record(self, failed: bool, seconds: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self._errors = ERROR_SMOOTHING * failed + (1 - ERROR_SMOOTHING) * self.error_rate(now)
+        self._errors_at = now
+        self.calls += 1
+        self.failures += failed
+        if seconds is not None:
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency = LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * self.latency
+
+
+def load_catalog(value: Optional[str]) -> List[Dict[str, Any]]:
+    if not value:
+        return DEFAULT_MODELS
+    try:
+        catalog = json.loads(value)
+        for entry in catalog:
+            entry.setdefault("classes", [])
+            if not entry.get("provider") or not entry.get("model"):
+                raise ValueError(f"entry without provider or model: {entry}")
+        return catalog
+    except ValueError as e:
+        logger.warning("Invalid ROUTER_MODELS, using the default catalog: %s", e)
+        return DEFAULT_MODELS
+
+
+class ModelRouter:
+    """Picks the best target for routed requests from live per-target signals"""
+
+    def __init__(self, catalog: List[Dict[str, Any]], explore: float = EXPLORE,
+                 queue_depth: Optional[Callable[[str], int]] = None):
+        self.catalog = catalog
+        self.explore = explore
+        self._queue_depth = queue_depth or (lambda provider: admission.limiter(provider).stats()["queued_now"])
+        self._targets: Dict[Tuple[str, str], TargetStats] = {}
+        self.decisions: Deque[Dict[str, Any]] = deque(maxlen=DECISION_LOG_SIZE)
+        self.unroutable = 0
+
+    def target(self, provider: str, model: str) -> TargetStats:
+        stats = self._targets.get((provider, model))
+        if stats is None:
+            stats = self._targets[(provider, model)] = TargetStats()
+        return stats
+
+    @asynccontextmanager
+    async def track(self, provider: str, model: str) -> AsyncIterator[None]:
+        """Record the latency or failure of one upstream call to (provider, model)"""
+        stats = self.target(provider, model)
+        stats.in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        except (RateLimited, DeadlineExceeded):
+            # Shed locally or out of time: no upstream outcome
+            raise
+        except Exception as e:
+            if is_upstream_failure(e):
+                stats.record(True)
+            raise
+        else:
+            stats.record(False, time.monotonic() - start)
+        finally:
+            stats.in_flight -= 1
+
+    def score(self, provider: str, model: str, now: Optional[float] = None) -> Dict[str, Any]:
+        stats = self.target(provider, model)
+        errors = stats.error_rate(now)
+        queue = stats.in_flight + self._queue_depth(provider)
+        latency = stats.latency or 0.0
+        return {
+            "target": f"{provider}:{model}",
+            "score": latency * (1 + queue / QUEUE_SCALE) / max(0.05, 1 - errors),
+            "latency_ms": None if stats.latency is None else round(stats.latency * 1000, 1),
+            "error_rate": round(errors, 4),
+            "queue": queue,
+            "circuit": circuit_breakers.get(provider).state,
+        }
+
+    def choose(
+        self,
+        request: str,
+        max_cost: Optional[float] = None,
+        min_context: Optional[int] = None,
+        available: Callable[[str], bool] = lambda provider: True,
+    ) -> Tuple[str, str]:
+        """
+        The (provider, model) for a request for "auto" or "auto:<class>".
+        Raises NoRoute when no healthy target satisfies the constraints.
+        """
+        capability = request.partition(":")[2]
+        now = time.monotonic()
+        excluded: Dict[str, str] = {}
+        candidates: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        for entry in self.catalog:
+            name = f"{entry['provider']}:{entry['model']}"
+            if capability and capability not in entry["classes"]:
+                continue
+            if max_cost is not None and entry.get("cost", 0) > max_cost:
+                excluded[name] = "cost"
+            elif min_context is not None and entry.get("context", 0) < min_context:
+                excluded[name] = "context"
+            elif not available(entry["provider"]):
+                excluded[name] = "no API key"
+            else:
+                score = self.score(entry["provider"], entry["model"], now)
+                if score["circuit"] == "open":
+                    excluded[name] = "circuit open"
+                elif score["error_rate"] >= MAX_ERROR_RATE:
+                    excluded[name] = "error rate"
+                else:
+                    candidates.append((entry, score))
+
+        decision: Dict[str, Any] = {
+            "time": time.time(),
+            "request": request,
+            "max_cost": max_cost,
+            "min_context": min_context,
+            "excluded": excluded,
+        }
+        if not candidates:
+            self.unroutable += 1
+            decision["chosen"] = None
+            self.decisions.append(decision)
+            raise NoRoute(f"No healthy model for {request!r} within the constraints")
+
+        candidates.sort(key=lambda c: c[1]["score"])
+        explored = len(candidates) > 1 and random.random() < self.explore
+        entry, _ = random.choice(candidates[1:]) if explored else candidates[0]
+        self.target(entry["provider"], entry["model"]).routed += 1
+        decision.update({
+            "chosen": f"{entry['provider']}:{entry['model']}",
+            "explored": explored,
+            "candidates": [{"target": s["target"], "score": round(s["score"], 4)} for _, s in candidates],
+        })
+        self.decisions.append(decision)
+        return entry["provider"], entry["model"]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Current signals and score per target"""
+        now = time.monotonic()
+        result = {}
+        for (provider, model), stats in self._targets.items():
+            entry = self.score(provider, model, now)
+            entry.update({"calls": stats.calls, "failures": stats.failures, "routed": stats.routed,
+                          "in_flight": stats.in_flight})
+            result[entry.pop("target")] = entry
+        return result
+
+
+model_router = ModelRouter(load_catalog(os.environ.get("ROUTER_MODELS")))
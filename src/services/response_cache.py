@@ -0,0 +1,174 @@
+
+"""
+Response cache for deterministic upstream completions.
+
+Entries are keyed on a canonical hash of the final upstream payload and kept
+in a bounded in-memory LRU with TTL. An optional disk tier (one JSON file per
+entry under RESPONSE_CACHE_DIR) lets entries survive restarts.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR")  # Disk tier is off when unset
+
+# Payload fields that do not change the completion and are left out of the key
+_IGNORED_FIELDS = ("user", "stream")
+
+
+def cache_key(upstream: str, target: str, payload: Dict[str, Any]) -> str:
+    """Canonical digest of an upstream call (upstream, target and payload)"""
+    canonical = {k: v for k, v in payload.items() if k not in _IGNORED_FIELDS}
+    raw = json.dumps(
+        [upstream, target, canonical],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + optional disk) cache with TTL"""
+
+    def __init__(self, max_entries: int, ttl: float, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # ----- memory tier -----
+    def _get_memory(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_memory(self, key: str, value: Any, expires_at: float) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # ----- disk tier -----
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] <= time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry["expires_at"], entry["value"]
+
+    def _write_disk(self, key: str, value: Any, expires_at: float) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error("Error writing cache entry %s: %s", key, e)
+
+    def _purge_disk(self) -> int:
+        """Remove expired entries from the disk tier"""
+        removed = 0
+        now = time.time()
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    with open(path, "r") as f:
+                        expired = json.load(f)["expires_at"] <= now
+                except (OSError, ValueError, KeyError):
+                    expired = True
+                if expired:
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        pass
+        return removed
+
+    # ----- public API -----
+    async def get(self, key: str) -> Optional[Any]:
+        """Look up a cached value, promoting disk hits into memory"""
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.disk_dir:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None:
+                expires_at, value = entry
+                self._set_memory(key, value, expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        """Store a JSON-serializable value in both tiers"""
+        expires_at = time.time() + self.ttl
+        self._set_memory(key, value, expires_at)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, value, expires_at)
+
+    async def purge_expired(self) -> int:
+        """Drop expired entries from the disk tier (run on startup)"""
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return 0
+        return await asyncio.to_thread(self._purge_disk)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "disk_tier": bool(self.disk_dir),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_TTL, CACHE_DIR)
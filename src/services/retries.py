@@ -0,0 +1,149 @@
+
+"""
+Retries of upstream calls, bounded by the request's deadline and a retry budget.
+
+A call is retried when it fails with a transient upstream error: a
+connection error or timeout, a 429 or a 5xx. Errors raised by the gateway
+itself are not retried: its own rate limits, an open circuit, or a passed
+deadline. Before retry n the call waits a random delay of up to
+RETRY_BASE_DELAY * 2^(n-1) seconds (at most RETRY_MAX_DELAY), or longer if
+the upstream's Retry-After asks for it. A retry is made only when the
+deadline leaves time for that wait plus RETRY_MIN_ATTEMPT_SECONDS for the
+attempt. Calls for a request without a deadline get RETRY_DEFAULT_BUDGET
+seconds (the upstream timeout) for all attempts.
+
+Each upstream has a retry budget so that retries cannot multiply the load
+on an upstream that is down. The budget is a token bucket:
+* every call adds RETRY_BUDGET_RATIO of a token;
+* the bucket also refills at RETRY_BUDGET_PER_SECOND, for low traffic;
+* each retry spends one token;
+* at most RETRY_BUDGET_MAX tokens are kept.
+When every call fails, retries then add about RETRY_BUDGET_RATIO to the
+load rather than multiplying it by RETRY_MAX_ATTEMPTS.
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from . import deadlines
+from .admission import RateLimited
+from .circuit_breaker import CircuitOpen, is_upstream_failure
+from .deadlines import DeadlineExceeded
+
+T = TypeVar("T")
+
+MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "3"))
+BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "0.1"))
+MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "2.0"))
+MIN_ATTEMPT_SECONDS = float(os.environ.get("RETRY_MIN_ATTEMPT_SECONDS", "0.5"))
+DEFAULT_BUDGET = float(os.environ.get("RETRY_DEFAULT_BUDGET", os.environ.get("UPSTREAM_TIMEOUT", "30.0")))
+BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.1"))
+BUDGET_PER_SECOND = float(os.environ.get("RETRY_BUDGET_PER_SECOND", "1"))
+BUDGET_MAX = float(os.environ.get("RETRY_BUDGET_MAX", "10"))
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (RateLimited, CircuitOpen, DeadlineExceeded)):
+        return False
+    return is_upstream_failure(error)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """The Retry-After an upstream sent with its error, in seconds"""
+    headers = getattr(error, "headers", None) or {}
+    return deadlines.parse_retry_after(headers.get("Retry-After"))
+
+
+def backoff(retry: int, base: float = BASE_DELAY, cap: float = MAX_DELAY) -> float:
+    """Full-jitter exponential backoff before retry number `retry` (1-based)"""
+    return random.uniform(0, min(cap, base * 2 ** (retry - 1)))
+
+
+class RetryBudget:
+    """Token bucket of retries, filled by calls and over time"""
+
+    def __init__(self, ratio: float = BUDGET_RATIO, per_second: float = BUDGET_PER_SECOND,
+                 max_tokens: float = BUDGET_MAX):
+        self.ratio = ratio
+        self.per_second = per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._updated = time.monotonic()
+
+    def _refill(self, added: float = 0.0) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._updated) * self.per_second + added)
+        self._updated = now
+
+    def deposit(self) -> None:
+        self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class UpstreamRetries:
+    """Retry budgets and counters per upstream"""
+
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS, min_attempt: float = MIN_ATTEMPT_SECONDS,
+                 default_budget: float = DEFAULT_BUDGET):
+        self.max_attempts = max_attempts
+        self.min_attempt = min_attempt
+        self.default_budget = default_budget
+        self._budgets: Dict[str, RetryBudget] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def budget(self, name: str) -> RetryBudget:
+        budget = self._budgets.get(name)
+        if budget is None:
+            budget = self._budgets[name] = RetryBudget()
+            self._counts[name] = {"calls": 0, "retries": 0, "recovered": 0, "no_time": 0, "no_budget": 0}
+        return budget
+
+    async def call(self, name: str, attempt: Callable[[], Awaitable[T]]) -> T:
+        """Run `attempt`, retrying transient upstream failures while time and budget allow"""
+        budget = self.budget(name)
+        counts = self._counts[name]
+        counts["calls"] += 1
+        budget.deposit()
+        with deadlines.budget(self.default_budget):
+            retry = 0
+            while True:
+                deadlines.check()
+                try:
+                    result = await attempt()
+                except Exception as e:
+                    if not is_retryable(e) or retry + 1 >= self.max_attempts:
+                        raise
+                    delay = max(backoff(retry + 1), retry_after(e) or 0.0)
+                    left = deadlines.remaining()
+                    if left is not None and left - delay < self.min_attempt:
+                        counts["no_time"] += 1
+                        raise
+                    if not budget.withdraw():
+                        counts["no_budget"] += 1
+                        raise
+                    retry += 1
+                    counts["retries"] += 1
+                    await asyncio.sleep(delay)
+                    continue
+                if retry:
+                    counts["recovered"] += 1
+                return result
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        for budget in self._budgets.values():
+            budget._refill()
+        return {
+            name: {**self._counts[name], "budget": round(budget.tokens, 2)}
+            for name, budget in self._budgets.items()
+        }
+
+
+upstream_retries = UpstreamRetries()
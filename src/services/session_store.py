@@ -0,0 +1,359 @@
+
+"""
+Session storage for AG-UI agent sessions.
+
+Two implementations share one async interface:
+
+* InMemorySessionStore keeps sessions in a bounded LRU. Every session has a
+  deadline (idle timeout, refreshed on access, or a fixed TTL once pinned) and
+  a single background sweeper pops expired deadlines off a heap, so expiry
+  costs O(log n) per session instead of one sleeping task each.
+* SharedSessionStore keeps each session as a hash in a Redis-compatible
+  key-value backend and lets the backend expire it, so every uvicorn worker
+  sees the same sessions. LocalKVBackend is an in-process stand-in for tests
+  and single-worker development; the serve.py broker hosts one for all
+  workers of a single-host deployment.
+
+Configured with AGUI_SESSION_BACKEND ("memory", "redis", "shared" for the
+serve.py broker, or "local" for the stand-in), AGUI_SESSION_MAX, AGUI_SESSION_IDLE_TTL and AGUI_SESSION_REDIS_URL.
+"""
+import asyncio
+import heapq
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Only needed for AGUI_SESSION_BACKEND=redis
+    redis_asyncio = None
+
+SESSION_BACKEND = os.environ.get("AGUI_SESSION_BACKEND", "memory")
+SESSION_MAX = int(os.environ.get("AGUI_SESSION_MAX", "100000"))
+SESSION_IDLE_TTL = float(os.environ.get("AGUI_SESSION_IDLE_TTL", "1800"))
+SESSION_SWEEP_INTERVAL = float(os.environ.get("AGUI_SESSION_SWEEP_INTERVAL", "1.0"))
+SESSION_REDIS_URL = os.environ.get("AGUI_SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_KEY_PREFIX = os.environ.get("AGUI_SESSION_KEY_PREFIX", "agui:session:")
+
+# Hash field marking a session whose TTL must not be extended on access
+_PINNED_FIELD = "__pinned"
+
+
+class SessionStore:
+    """
+    Interface shared by the session stores.
+
+    Sessions are flat dicts of JSON-serialisable fields. Values returned by
+    get() are snapshots; change a session through update().
+    """
+
+    async def startup(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return the session and refresh its idle timeout"""
+        raise NotImplementedError
+
+    async def create(self, session_id: str, data: Dict[str, Any]) -> None:
+        """Create or replace a session"""
+        raise NotImplementedError
+
+    async def update(self, session_id: str, fields: Dict[str, Any], ttl: Optional[float] = None) -> bool:
+        """
+        Merge `fields` into an existing session. With `ttl`, the session is
+        pinned to expire that many seconds from now regardless of access.
+
+        Returns False when the session does not exist.
+        """
+        raise NotImplementedError
+
+    async def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class _Entry:
+    __slots__ = ("data", "expires_at", "scheduled", "pinned")
+
+    def __init__(self, data: Dict[str, Any], expires_at: float):
+        self.data = data
+        self.expires_at = expires_at
+        self.scheduled = expires_at  # deadline of this entry's live heap item
+        self.pinned = False
+
+
+class InMemorySessionStore(SessionStore):
+    """Bounded in-process store with heap-driven expiry"""
+
+    def __init__(self, max_sessions: int, idle_ttl: float, sweep_interval: float = 1.0):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()  # least recently used first
+        self._deadlines: List[Tuple[float, str]] = []
+        self._sweeper: Optional[asyncio.Task] = None
+        self.expirations = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _schedule(self, session_id: str, entry: _Entry) -> None:
+        entry.scheduled = entry.expires_at
+        heapq.heappush(self._deadlines, (entry.expires_at, session_id))
+
+    def _live(self, session_id: str, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            # The sweeper has not reached it yet
+            del self._entries[session_id]
+            self.expirations += 1
+            return None
+        return entry
+
+    def _touch(self, session_id: str, entry: _Entry, now: float) -> None:
+        self._entries.move_to_end(session_id)
+        if not entry.pinned:
+            # Extending a deadline needs no heap push: the sweeper re-checks
+            # expires_at when the old deadline comes up
+            entry.expires_at = now + self.idle_ttl
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        entry = self._live(session_id, now)
+        if entry is None:
+            return None
+        self._touch(session_id, entry, now)
+        return dict(entry.data)
+
+    async def create(self, session_id: str, data: Dict[str, Any]) -> None:
+        self._entries.pop(session_id, None)
+        while len(self._entries) >= self.max_sessions:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        entry = _Entry(dict(data), time.monotonic() + self.idle_ttl)
+        self._entries[session_id] = entry
+        self._schedule(session_id, entry)
+        self._compact()
+
+    async def update(self, session_id: str, fields: Dict[str, Any], ttl: Optional[float] = None) -> bool:
+        now = time.monotonic()
+        entry = self._live(session_id, now)
+        if entry is None:
+            return False
+        entry.data.update(fields)
+        if ttl is None:
+            self._touch(session_id, entry, now)
+        else:
+            self._entries.move_to_end(session_id)
+            entry.pinned = True
+            entry.expires_at = now + ttl
+            if entry.expires_at < entry.scheduled:
+                # Earlier than the queued deadline; the old heap item goes stale
+                self._schedule(session_id, entry)
+        return True
+
+    async def delete(self, session_id: str) -> None:
+        self._entries.pop(session_id, None)
+
+    def _compact(self) -> None:
+        """Drop heap items left behind by deleted or evicted sessions"""
+        if len(self._deadlines) > 2 * len(self._entries) + 1024:
+            self._deadlines = [(e.scheduled, sid) for sid, e in self._entries.items()]
+            heapq.heapify(self._deadlines)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Remove expired sessions; returns how many were removed"""
+        now = time.monotonic() if now is None else now
+        removed = 0
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, session_id = heapq.heappop(self._deadlines)
+            entry = self._entries.get(session_id)
+            if entry is None or entry.scheduled != deadline:
+                continue  # stale heap item
+            if entry.expires_at <= now:
+                del self._entries[session_id]
+                self.expirations += 1
+                removed += 1
+            else:
+                self._schedule(session_id, entry)
+        return removed
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+
+    async def startup(self) -> None:
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def shutdown(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "sessions": len(self._entries),
+            "max_sessions": self.max_sessions,
+            "pending_deadlines": len(self._deadlines),
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+class LocalKVBackend:
+    """
+    In-process stand-in for the subset of the redis.asyncio client used by
+    SharedSessionStore (hashes with key expiry). Expired keys are dropped
+    when they are next accessed.
+    """
+
+    def __init__(self):
+        self._hashes: Dict[str, Dict[str, str]] = {}
+        self._expiry: Dict[str, float] = {}
+
+    def _alive(self, key: str) -> bool:
+        expires_at = self._expiry.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._hashes.pop(key, None)
+            del self._expiry[key]
+        return key in self._hashes
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return dict(self._hashes[key]) if self._alive(key) else {}
+
+    async def hexists(self, key: str, field: str) -> bool:
+        return self._alive(key) and field in self._hashes[key]
+
+    async def hset(self, key: str, mapping: Dict[str, str]) -> int:
+        self._alive(key)
+        self._hashes.setdefault(key, {}).update(mapping)
+        return len(mapping)
+
+    async def expire(self, key: str, seconds: int) -> bool:
+        if not self._alive(key):
+            return False
+        self._expiry[key] = time.monotonic() + seconds
+        return True
+
+    async def ttl(self, key: str) -> int:
+        """Whole seconds left, -1 for a key without expiry and -2 for a missing one"""
+        if not self._alive(key):
+            return -2
+        expires_at = self._expiry.get(key)
+        return -1 if expires_at is None else int(expires_at - time.monotonic())
+
+    async def delete(self, *keys: str) -> int:
+        removed = 0
+        for key in keys:
+            self._expiry.pop(key, None)
+            removed += self._hashes.pop(key, None) is not None
+        return removed
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        expired = [key for key, expires_at in self._expiry.items() if expires_at <= now]
+        for key in expired:
+            self._hashes.pop(key, None)
+            del self._expiry[key]
+        return len(expired)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class SharedSessionStore(SessionStore):
+    """
+    Sessions stored as hashes (one JSON-encoded value per field) in a
+    Redis-compatible backend, expired by the backend itself.
+    """
+
+    def __init__(self, backend, idle_ttl: float, prefix: str = SESSION_KEY_PREFIX):
+        self.backend = backend
+        self.idle_ttl = max(1, math.ceil(idle_ttl))
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        key = self._key(session_id)
+        raw = await self.backend.hgetall(key)
+        if not raw:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if _PINNED_FIELD not in raw:
+            await self.backend.expire(key, self.idle_ttl)
+        return {field: json.loads(value) for field, value in raw.items() if field != _PINNED_FIELD}
+
+    async def create(self, session_id: str, data: Dict[str, Any]) -> None:
+        key = self._key(session_id)
+        await self.backend.delete(key)
+        await self.backend.hset(key, mapping={field: json.dumps(value) for field, value in data.items()})
+        await self.backend.expire(key, self.idle_ttl)
+
+    async def update(self, session_id: str, fields: Dict[str, Any], ttl: Optional[float] = None) -> bool:
+        key = self._key(session_id)
+        if ttl is None and await self.backend.hexists(key, _PINNED_FIELD):
+            # A pinned session keeps what is left of its TTL
+            left = await self.backend.ttl(key)
+            if left == -2:
+                return False
+            seconds = max(1, left) if left >= 0 else self.idle_ttl
+        else:
+            # EXPIRE doubles as the existence check, so a missing session is not recreated
+            seconds = self.idle_ttl if ttl is None else max(1, math.ceil(ttl))
+            if not await self.backend.expire(key, seconds):
+                return False
+        mapping = {field: json.dumps(value) for field, value in fields.items()}
+        if ttl is not None:
+            mapping[_PINNED_FIELD] = "1"
+        await self.backend.hset(key, mapping=mapping)
+        # Had the session expired since, HSET recreated it without a TTL
+        await self.backend.expire(key, seconds)
+        return True
+
+    async def delete(self, session_id: str) -> None:
+        await self.backend.delete(self._key(session_id))
+
+    async def shutdown(self) -> None:
+        await self.backend.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "idle_ttl": self.idle_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def create_session_store() -> SessionStore:
+    """Build the store selected by AGUI_SESSION_BACKEND"""
+    if SESSION_BACKEND == "redis":
+        if redis_asyncio is None:
+            raise RuntimeError("AGUI_SESSION_BACKEND=redis requires the redis package")
+        backend = redis_asyncio.from_url(SESSION_REDIS_URL, decode_responses=True)
+        return SharedSessionStore(backend, SESSION_IDLE_TTL)
+    if SESSION_BACKEND == "shared":
+        from .shared_state import SharedKV, shared_state
+        return SharedSessionStore(SharedKV(shared_state), SESSION_IDLE_TTL)
+    if SESSION_BACKEND == "local":
+        return SharedSessionStore(LocalKVBackend(), SESSION_IDLE_TTL)
+    return InMemorySessionStore(SESSION_MAX, SESSION_IDLE_TTL, SESSION_SWEEP_INTERVAL)
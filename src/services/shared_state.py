@@ -0,0 +1,318 @@
+
+"""
+State shared by the worker processes of one gateway instance.
+
+serve.py runs a StateBroker in the supervisor process and passes its Unix
+socket to every worker in GATEWAY_STATE_SOCKET. Workers talk to it through
+the `shared_state` client:
+
+* hashes with key expiry (SharedKV, the LocalKVBackend interface) hold
+  AG-UI sessions when AGUI_SESSION_BACKEND=shared;
+* token buckets (SharedBuckets) hold rate limits when RATE_LIMIT_BACKEND=shared;
+* publish/subscribe tells other workers about key rotations, token
+  revocations and AG-UI tool results;
+* metrics snapshots let /metrics on any worker report every worker.
+
+The broker handles one request at a time on its event loop, so every
+operation is atomic. It is a stand-in for Redis on a single host; across
+hosts, use the redis backends. Without GATEWAY_STATE_SOCKET the client is
+disabled and publish() does nothing.
+
+The protocol is one JSON object per line: requests are
+{"id", "op", "args"}, replies {"id", "result"} or {"id", "error"}, and
+published messages {"channel", "message"}.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATE_SOCKET = os.environ.get("GATEWAY_STATE_SOCKET")
+# Seconds between sweeps of expired keys in the broker
+SWEEP_INTERVAL = float(os.environ.get("GATEWAY_STATE_SWEEP_INTERVAL", "10"))
+# Largest message accepted on the socket
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+Handler = Callable[[Any], Awaitable[None]]
+
+
+class StateBroker:
+    """Serves hashes, token buckets, pub/sub and snapshots over a Unix socket"""
+
+    def __init__(self, path: str):
+        # Imported here: both modules import this one for their shared backends
+        from .admission import LocalBuckets
+        from .session_store import LocalKVBackend
+
+        self.path = path
+        self.kv = LocalKVBackend()
+        self.buckets = LocalBuckets()
+        self._subscribers: Dict[str, Set[asyncio.StreamWriter]] = {}
+        self._snapshots: Dict[str, Tuple[str, float]] = {}  # name -> (text, expires at)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def _op(self, writer: asyncio.StreamWriter, op: str, args: List[Any]) -> Any:
+        if op == "hgetall":
+            return await self.kv.hgetall(*args)
+        if op == "hexists":
+            return await self.kv.hexists(*args)
+        if op == "hset":
+            return await self.kv.hset(args[0], mapping=args[1])
+        if op == "expire":
+            return await self.kv.expire(*args)
+        if op == "ttl":
+            return await self.kv.ttl(*args)
+        if op == "delete":
+            return await self.kv.delete(*args)
+        if op == "take":
+            return list(await self.buckets.take(*args))
+        if op == "subscribe":
+            self._subscribers.setdefault(args[0], set()).add(writer)
+            return True
+        if op == "publish":
+            channel, message = args
+            line = json.dumps({"channel": channel, "message": message}).encode() + b"\n"
+            receivers = [w for w in self._subscribers.get(channel, ()) if w is not writer]
+            for subscriber in receivers:
+                subscriber.write(line)
+            return len(receivers)
+        if op == "put_snapshot":
+            name, text, ttl = args
+            self._snapshots[name] = (text, time.monotonic() + ttl)
+            return True
+        if op == "snapshots":
+            now = time.monotonic()
+            return {name: text for name, (text, expires_at) in self._snapshots.items() if expires_at > now}
+        raise ValueError(f"Unknown operation {op!r}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line)
+                try:
+                    reply = {"id": request["id"], "result": await self._op(writer, request["op"], request["args"])}
+                except Exception as e:
+                    reply = {"id": request["id"], "error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Shared state connection dropped: %s", e)
+        finally:
+            for subscribers in self._subscribers.values():
+                subscribers.discard(writer)
+            writer.close()
+
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.kv.purge_expired()
+            now = time.monotonic()
+            for name in [n for n, (_, expires_at) in self._snapshots.items() if expires_at <= now]:
+                del self._snapshots[name]
+
+    async def serve_forever(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path, limit=MAX_MESSAGE_BYTES)
+        os.chmod(self.path, 0o600)
+        sweeper = asyncio.create_task(self._sweep())
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            sweeper.cancel()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def start_in_thread(self) -> threading.Thread:
+        """Run the broker on its own event loop in a daemon thread"""
+        ready = threading.Event()
+
+        def run():
+            async def main():
+                serving = asyncio.create_task(self.serve_forever())
+                while self._server is None and not serving.done():
+                    await asyncio.sleep(0.01)
+                ready.set()
+                await serving
+            asyncio.run(main())
+
+        thread = threading.Thread(target=run, name="state-broker", daemon=True)
+        thread.start()
+        ready.wait(10)
+        return thread
+
+
+class SharedStateClient:
+    """One connection per worker to the broker, multiplexing requests and subscriptions"""
+
+    def __init__(self, path: Optional[str] = STATE_SOCKET):
+        self.path = path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._connecting: Optional[asyncio.Lock] = None
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._handlers: Dict[str, List[Handler]] = {}
+        self.calls = 0
+        self.received = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    async def _connect(self) -> None:
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self._writer is not None:
+                return
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_MESSAGE_BYTES)
+            self._read_task = asyncio.create_task(self._read_loop(self._reader))
+            for channel in self._handlers:
+                await self._send("subscribe", [channel])
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if "channel" in message:
+                    self.received += 1
+                    for handler in self._handlers.get(message["channel"], ()):
+                        asyncio.ensure_future(self._dispatch(handler, message["message"]))
+                    continue
+                future = self._pending.pop(message["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message["result"])
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Shared state connection lost: %s", e)
+        finally:
+            self._writer = None
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Shared state broker connection closed"))
+            self._pending.clear()
+
+    async def _dispatch(self, handler: Handler, message: Any) -> None:
+        try:
+            await handler(message)
+        except Exception as e:
+            logger.error("Error handling shared state message: %s", e)
+
+    async def _send(self, op: str, args: List[Any]) -> Any:
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(json.dumps({"id": request_id, "op": op, "args": args}).encode() + b"\n")
+        await self._writer.drain()
+        return await future
+
+    async def call(self, op: str, *args: Any) -> Any:
+        if not self.enabled:
+            raise RuntimeError("GATEWAY_STATE_SOCKET is not set; start the gateway with serve.py")
+        if self._writer is None:
+            await self._connect()
+        self.calls += 1
+        return await self._send(op, list(args))
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        """Run `handler(message)` for every message other workers publish on `channel`"""
+        first = channel not in self._handlers
+        self._handlers.setdefault(channel, []).append(handler)
+        if self.enabled and first and self._writer is not None:
+            await self._send("subscribe", [channel])
+
+    async def publish(self, channel: str, message: Any) -> int:
+        """Send `message` to the other workers; returns how many received it"""
+        if not self.enabled:
+            return 0
+        return await self.call("publish", channel, message)
+
+    async def put_snapshot(self, name: str, text: str, ttl: float) -> None:
+        await self.call("put_snapshot", name, text, ttl)
+
+    async def snapshots(self) -> Dict[str, str]:
+        return await self.call("snapshots")
+
+    async def startup(self) -> None:
+        if self.enabled:
+            await self._connect()
+
+    async def shutdown(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        self._writer = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "connected": self._writer is not None,
+            "calls": self.calls,
+            "received": self.received,
+            "subscriptions": len(self._handlers),
+        }
+
+
+class SharedKV:
+    """The LocalKVBackend interface, served by the broker"""
+
+    def __init__(self, client: SharedStateClient):
+        self.client = client
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return await self.client.call("hgetall", key)
+
+    async def hexists(self, key: str, field: str) -> bool:
+        return await self.client.call("hexists", key, field)
+
+    async def hset(self, key: str, mapping: Dict[str, str]) -> int:
+        return await self.client.call("hset", key, mapping)
+
+    async def expire(self, key: str, seconds: int) -> bool:
+        return await self.client.call("expire", key, seconds)
+
+    async def ttl(self, key: str) -> int:
+        return await self.client.call("ttl", key)
+
+    async def delete(self, *keys: str) -> int:
+        return await self.client.call("delete", *keys)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class SharedBuckets:
+    """The LocalBuckets interface, served by the broker"""
+
+    def __init__(self, client: SharedStateClient):
+        self.client = client
+
+    async def take(self, key: str, rate: float, burst: float, max_wait: float) -> Tuple[bool, float]:
+        admitted, wait = await self.client.call("take", key, rate, burst, max_wait)
+        return bool(admitted), float(wait)
+
+    async def close(self) -> None:
+        pass
+
+
+shared_state = SharedStateClient()
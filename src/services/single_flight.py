@@ -0,0 +1,55 @@
+
+"""
+In-flight request coalescing (single-flight).
+
+Concurrent callers that ask for the same key share one running upstream call
+and all receive its result or its exception. Each caller awaits the shared
+task through asyncio.shield, so cancelling one caller never cancels the call
+for the others.
+
+The shared call runs without the deadline of the caller that started it;
+each caller's own deadline only bounds that caller's wait.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from . import deadlines
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `fn` unless a call for `key` is already in flight, then await it"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(fn(), context=deadlines.detached())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        async with deadlines.bounded("a shared upstream call"):
+            return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
+
+
+in_flight = SingleFlight()
@@ -0,0 +1,244 @@
+
+"""
+Resumable Server-Sent Event streams.
+
+A ReplayStream owns a generator and numbers every event it yields. The most
+recent events are kept in a ring buffer capped by count and bytes. Client
+connections read from that buffer, so a client that reconnects with
+Last-Event-ID gets the events it missed, and the generator carries on from
+where it stopped instead of starting over.
+
+The generator is advanced by one pump task per stream, one event each time
+a connection asks for more, so a dropped connection never cancels a step.
+With no connection attached the pump simply waits until a resume window
+passes. StreamRegistry caps how many streams
+are kept per process; resuming requires the reconnect to reach the same
+worker.
+"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+REPLAY_MAX_EVENTS = int(os.environ.get("SSE_REPLAY_MAX_EVENTS", "512"))
+REPLAY_MAX_BYTES = int(os.environ.get("SSE_REPLAY_MAX_BYTES", str(256 * 1024)))
+STREAM_MAX = int(os.environ.get("SSE_STREAM_MAX", "10000"))
+# How long a stream with no client attached is kept for a reconnect
+RESUME_WINDOW = float(os.environ.get("SSE_RESUME_WINDOW", "300"))
+
+
+class ReplayStream:
+    """One generator shared by successive connections, with a replay buffer"""
+
+    def __init__(self, generator: AsyncIterator[str], max_events: int, max_bytes: int):
+        self.generator = generator
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self._buffer: Deque[Tuple[int, str]] = deque()
+        self._buffer_bytes = 0
+        self.last_id = 0
+        self.finished = False
+        self.connections = 0
+        self._pump: Optional[asyncio.Task] = None
+        self._demand = asyncio.Event()
+        # Resolved when the next event is appended or the stream ends
+        self._progress: Optional[asyncio.Future] = None
+        self._release_timer: Optional[asyncio.TimerHandle] = None
+        # Called when the last connection detaches
+        self.on_idle: Optional[Callable[["ReplayStream"], None]] = None
+
+    def _append(self, data: str) -> None:
+        self.last_id += 1
+        self._buffer.append((self.last_id, data))
+        self._buffer_bytes += len(data)
+        while len(self._buffer) > self.max_events or (
+            self._buffer_bytes > self.max_bytes and len(self._buffer) > 1
+        ):
+            _, dropped = self._buffer.popleft()
+            self._buffer_bytes -= len(dropped)
+
+    def after(self, cursor: int) -> List[Tuple[int, str]]:
+        """
+        Buffered events newer than `cursor`. If events past the cursor were
+        already dropped from the buffer, replay starts at the oldest one left.
+        """
+        if not self._buffer:
+            return []
+        start = max(0, cursor + 1 - self._buffer[0][0])
+        return list(islice(self._buffer, start, None))
+
+    def _notify(self) -> None:
+        progress, self._progress = self._progress, None
+        if progress is not None and not progress.done():
+            progress.set_result(None)
+
+    async def _run(self) -> None:
+        """The pump: one generator step per demand, until the generator ends"""
+        while True:
+            await self._demand.wait()
+            self._demand.clear()
+            try:
+                data = await anext(self.generator)
+            except StopAsyncIteration:
+                self.finished = True
+            except Exception as e:
+                logger.error("Error in event stream: %s", e)
+                self.finished = True
+            else:
+                self._append(data)
+            self._notify()
+            if self.finished:
+                return
+
+    async def advance(self) -> None:
+        """Wait for the next event, starting the pump if needed"""
+        if self.finished:
+            return
+        if self._pump is None:
+            self._pump = asyncio.ensure_future(self._run())
+        if self._progress is None:
+            self._progress = asyncio.get_running_loop().create_future()
+        progress = self._progress
+        self._demand.set()
+        # Unlike awaiting the future, wait() leaves it pending for the other
+        # connections if this one is cancelled
+        await asyncio.wait([progress])
+
+    async def events(self, cursor: int = 0, request=None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Events after `cursor` as EventSourceResponse items. The connection
+        stops when the client disconnects; the stream does not.
+        """
+        if self._release_timer is not None:
+            self._release_timer.cancel()
+            self._release_timer = None
+        self.connections += 1
+        try:
+            while True:
+                for event_id, data in self.after(cursor):
+                    yield {"id": str(event_id), "data": data}
+                    cursor = event_id
+                if self.finished and cursor >= self.last_id:
+                    return
+                if request is not None and await request.is_disconnected():
+                    return
+                await self.advance()
+        finally:
+            self.connections -= 1
+            if self.connections == 0 and self.on_idle is not None:
+                self.on_idle(self)
+
+    async def close(self, final_event: Optional[str] = None) -> None:
+        """
+        Stop the generator. `final_event` is appended for any client still
+        attached, which then finishes normally.
+        """
+        if self._release_timer is not None:
+            self._release_timer.cancel()
+            self._release_timer = None
+        if self.finished:
+            return
+        self.finished = True
+        pump = self._pump
+        if pump is not None:
+            pump.cancel()
+            await asyncio.wait([pump])
+        # Runs the generator's cleanup when the pump was between steps
+        await self.generator.aclose()
+        if final_event is not None:
+            self._append(final_event)
+        self._notify()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "last_id": self.last_id,
+            "buffered": len(self._buffer),
+            "buffered_bytes": self._buffer_bytes,
+            "connections": self.connections,
+            "finished": self.finished,
+        }
+
+
+class StreamRegistry:
+    """Replay streams by key, capped in number and released when abandoned"""
+
+    def __init__(
+        self,
+        max_streams: int = STREAM_MAX,
+        resume_window: float = RESUME_WINDOW,
+        max_events: int = REPLAY_MAX_EVENTS,
+        max_bytes: int = REPLAY_MAX_BYTES
+    ):
+        self.max_streams = max_streams
+        self.resume_window = resume_window
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self._streams: "OrderedDict[str, ReplayStream]" = OrderedDict()  # least recently used first
+        self.resumed = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def get(self, key: str) -> Optional[ReplayStream]:
+        return self._streams.get(key)
+
+    async def open(self, key: str, generator: AsyncIterator[str]) -> ReplayStream:
+        """Register a new stream for `key`, replacing (and closing) any old one"""
+        await self.release(key)
+        while len(self._streams) >= self.max_streams:
+            _, oldest = self._streams.popitem(last=False)
+            self.evictions += 1
+            await oldest.close()
+        stream = ReplayStream(generator, self.max_events, self.max_bytes)
+        stream.on_idle = lambda s: self._schedule_release(key, s)
+        self._streams[key] = stream
+        return stream
+
+    def connect(self, key: str, stream: ReplayStream, cursor: int = 0, request=None) -> AsyncIterator[Dict[str, Any]]:
+        """Attach a connection to `stream`, replaying events after `cursor`"""
+        if cursor:
+            self.resumed += 1
+        if self._streams.get(key) is stream:
+            self._streams.move_to_end(key)
+        return stream.events(cursor, request)
+
+    def _schedule_release(self, key: str, stream: ReplayStream) -> None:
+        if self._streams.get(key) is not stream:
+            return
+
+        def expire():
+            stream._release_timer = None
+            if self._streams.get(key) is stream and stream.connections == 0:
+                del self._streams[key]
+                asyncio.ensure_future(stream.close())
+
+        loop = asyncio.get_running_loop()
+        stream._release_timer = loop.call_later(self.resume_window, expire)
+
+    async def release(self, key: str, final_event: Optional[str] = None) -> bool:
+        """Close and forget the stream for `key`"""
+        stream = self._streams.pop(key, None)
+        if stream is None:
+            return False
+        await stream.close(final_event)
+        return True
+
+    async def shutdown(self) -> None:
+        while self._streams:
+            _, stream = self._streams.popitem()
+            await stream.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len(self._streams),
+            "max_streams": self.max_streams,
+            "connections": sum(s.connections for s in self._streams.values()),
+            "buffered_bytes": sum(s._buffer_bytes for s in self._streams.values()),
+            "resumed": self.resumed,
+            "evictions": self.evictions,
+        }
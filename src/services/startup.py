@@ -0,0 +1,203 @@
+
+"""
+Cold start: timed startup steps, background prewarming and readiness.
+
+Startup work is split in two:
+* init steps the app cannot serve without (shared state, sessions, the
+  usage ledger), always run before the app accepts requests;
+* prewarm steps that only save the first requests some work: importing
+  heavy modules (jwt and cryptography, numpy, sse-starlette), decrypting
+  the API keys, loading tokenizers, creating upstream clients and opening
+  their connections.
+
+httpx is left out on purpose: main, upstream_pool, metrics, admission and
+circuit_breaker import it at the top, since their stream wrappers subclass
+httpx.AsyncByteStream and their error handling is written against httpx's
+types. Deferring it would save about 90 ms at the cost of building those
+classes on first use.
+
+With STARTUP_MODE=eager (the default) prewarm steps also run before the app
+accepts requests. With STARTUP_MODE=lazy they run in the background once the
+app is ready, and anything a request needs before then is done on first use.
+
+Every step and first-use import is timed; an import is also part of the
+step that triggered it. The report (GET /admin/startup, logged
+once ready, and `serve.py --startup-report` for CI) breaks startup down by
+phase. It also gives the process age when the app became ready, which
+includes interpreter startup and the import of main.
+"""
+import asyncio
+import importlib
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "eager").lower()
+if STARTUP_MODE not in ("eager", "lazy"):
+    logger.warning("Unknown STARTUP_MODE %r, using eager", STARTUP_MODE)
+    STARTUP_MODE = "eager"
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def process_age() -> Optional[float]:
+    """Seconds since this process started (Linux), None elsewhere"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class StartupProfile:
+    """Timings of startup steps, and the app's readiness"""
+
+    def __init__(self, mode: str = STARTUP_MODE):
+        self.mode = mode
+        self.phases: List[Dict[str, Any]] = []
+        self.ready = False
+        self.stopping = False
+        self.ready_after: Optional[float] = None
+        # "pending", "running" or "done"
+        self.prewarm = "pending"
+        self._prewarm_task: Optional[asyncio.Task] = None
+
+    def record(self, kind: str, name: str, seconds: float, error: Optional[str] = None) -> None:
+        phase = {"kind": kind, "name": name, "ms": round(seconds * 1000, 2)}
+        if error:
+            phase["error"] = error
+        self.phases.append(phase)
+
+    @contextmanager
+    def measure(self, kind: str, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(kind, name, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+            raise
+        self.record(kind, name, time.perf_counter() - started)
+
+    async def step(self, kind: str, name: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run and time one startup step; prewarm failures are reported, not raised"""
+        try:
+            with self.measure(kind, name):
+                return await fn()
+        except Exception as e:
+            if kind != "prewarm":
+                raise
+            logger.warning("Prewarm step %s failed: %s", name, e)
+            return None
+
+    def load(self, module: str) -> Any:
+        """Import `module`, timing the import if it is the first"""
+        if module in sys.modules:
+            return sys.modules[module]
+        with self.measure("import", module):
+            return importlib.import_module(module)
+
+    async def run_prewarm(self, steps: Dict[str, Callable[[], Awaitable[Any]]]) -> None:
+        self.prewarm = "running"
+        for name, fn in steps.items():
+            await self.step("prewarm", name, fn)
+        self.prewarm = "done"
+        if self.ready:
+            self.log()
+
+    def prewarm_in_background(self, steps: Dict[str, Callable[[], Awaitable[Any]]]) -> None:
+        self._prewarm_task = asyncio.create_task(self.run_prewarm(steps))
+
+    async def wait_for_prewarm(self) -> None:
+        if self._prewarm_task is not None:
+            await self._prewarm_task
+
+    def mark_ready(self) -> None:
+        self.ready = True
+        self.ready_after = process_age()
+        if self.prewarm == "done":
+            self.log()
+
+    def log(self) -> None:
+        """Log the report once startup, prewarming included, is complete"""
+        report = self.report()
+        slowest = sorted(report["phases"], key=lambda p: p["ms"], reverse=True)[:5]
+        logger.info("Startup (%s): ready after %s ms, totals %s, slowest %s",
+                    self.mode, report["ready_after_ms"], report["totals_ms"],
+                    ", ".join(f"{p['kind']}:{p['name']} {p['ms']} ms" for p in slowest))
+
+    async def mark_stopping(self) -> None:
+        self.ready = False
+        self.stopping = True
+        if self._prewarm_task is not None:
+            self._prewarm_task.cancel()
+            self._prewarm_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "prewarmed": self.prewarm == "done",
+            "ready_after_seconds": self.ready_after,
+        }
+
+    def report(self) -> Dict[str, Any]:
+        totals: Dict[str, float] = {}
+        for phase in self.phases:
+            totals[phase["kind"]] = round(totals.get(phase["kind"], 0) + phase["ms"], 2)
+        return {
+            "mode": self.mode,
+            "ready": self.ready,
+            "ready_after_ms": None if self.ready_after is None else round(self.ready_after * 1000, 1),
+            "prewarm": self.prewarm,
+            "totals_ms": totals,
+            "phases": self.phases,
+        }
+
+
+def import_costs(module: str = "main", top: int = 20, cwd: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Import time of `module` and of each module it imports directly (the
+    `top` heaviest), measured with `python -X importtime` in a fresh
+    interpreter so that nothing is imported already.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=cwd,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {result.stderr.strip().splitlines()[-1:]}")
+    # Lines come children first, each parent after its children, indented
+    # two spaces per level below the top-level imports
+    children: List[Dict[str, Any]] = []
+    total_us = None
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, depth, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if depth == 1 and name == module:
+            total_us = cumulative
+            break
+        if depth == 3:
+            children.append({"module": name, "ms": round(cumulative / 1000, 2)})
+        elif depth == 1:
+            children.clear()
+    children.sort(key=lambda c: c["ms"], reverse=True)
+    return {
+        "module": module,
+        "ms": None if total_us is None else round(total_us / 1000, 2),
+        "imports": children[:top],
+    }
+
+
+startup_profile = StartupProfile()
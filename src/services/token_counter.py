@@ -0,0 +1,154 @@
+
+"""
+Token counting for usage accounting.
+
+Counts use the model's own tokenizer when one is available:
+* OpenAI models: tiktoken encodings (o200k_base for gpt-4o, gpt-4.1 and the
+  o-series, cl100k_base for gpt-4 and gpt-3.5).
+* Hugging Face models: a `tokenizers` tokenizer.json from TOKENIZER_DIR
+  (named after the model id with "/" replaced by "--"), or fetched from the
+  Hub when TOKENIZER_DOWNLOAD is set.
+
+Tokenizers are loaded once per model family and cached. TOKENIZER_PRELOAD
+lists models whose tokenizers are loaded at startup, so no request pays for
+loading them. Without a tokenizer, counts are estimated from words and
+symbols and flagged as estimates. Texts longer than
+TOKEN_COUNT_INLINE_CHARS are counted in a worker thread, off the event loop.
+"""
+import asyncio
+import logging
+import os
+import re
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # Counts for OpenAI models are estimated without it
+    tiktoken = None
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # Counts for Hugging Face models are estimated without it
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_DIR = os.environ.get("TOKENIZER_DIR", "data/tokenizers")
+TOKENIZER_DOWNLOAD = os.environ.get("TOKENIZER_DOWNLOAD", "false").lower() in ("1", "true", "yes")
+TOKENIZER_PRELOAD = [
+    model.strip()
+    for model in os.environ.get("TOKENIZER_PRELOAD", "gpt-4o-mini,mistralai/Mistral-7B-Instruct-v0.2").split(",")
+    if model.strip()
+]
+INLINE_CHARS = int(os.environ.get("TOKEN_COUNT_INLINE_CHARS", "8192"))
+
+# tiktoken encoding by model name prefix, most specific first
+OPENAI_ENCODINGS = (
+    ("gpt-4o", "o200k_base"),
+    ("gpt-4.1", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("o3", "o200k_base"),
+    ("o4", "o200k_base"),
+    ("gpt-4", "cl100k_base"),
+    ("gpt-3.5", "cl100k_base"),
+)
+
+_WORD = re.compile(r"\w+")
+_SYMBOL = re.compile(r"[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """About 4/3 tokens per word plus one per symbol, close for English BPE vocabularies"""
+    return len(_WORD.findall(text)) * 4 // 3 + len(_SYMBOL.findall(text))
+
+
+def tokenizer_family(model: str) -> str:
+    """Models sharing a tokenizer share a family (and one cached encoder)"""
+    if "/" in model:
+        return model
+    for prefix, encoding in OPENAI_ENCODINGS:
+        if model.startswith(prefix):
+            return encoding
+    return "o200k_base"
+
+
+class TokenCounter:
+    """Counts tokens with cached per-family encoders"""
+
+    def __init__(self, tokenizer_dir: str = TOKENIZER_DIR, download: bool = TOKENIZER_DOWNLOAD):
+        self.tokenizer_dir = tokenizer_dir
+        self.download = download
+        # family -> token counting function, or None when only estimates are possible
+        self._encoders: Dict[str, Optional[Callable[[str], int]]] = {}
+        self.exact = 0
+        self.estimated = 0
+
+    def _load(self, family: str) -> Optional[Callable[[str], int]]:
+        try:
+            if "/" not in family:
+                if tiktoken is None:
+                    return None
+                encoding = tiktoken.get_encoding(family)
+                return lambda text: len(encoding.encode_ordinary(text))
+            if Tokenizer is None:
+                return None
+            path = os.path.join(self.tokenizer_dir, family.replace("/", "--") + ".json")
+            if os.path.exists(path):
+                tokenizer = Tokenizer.from_file(path)
+            elif self.download:
+                tokenizer = Tokenizer.from_pretrained(family)
+            else:
+                return None
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        except Exception as e:
+            logger.warning("Error loading tokenizer for %s, estimating its token counts: %s", family, e)
+            return None
+
+    def encoder(self, model: str) -> Optional[Callable[[str], int]]:
+        """The model's counting function, loading it on first use (blocking)"""
+        family = tokenizer_family(model)
+        if family not in self._encoders:
+            self._encoders[family] = self._load(family)
+        return self._encoders[family]
+
+    def count(self, model: str, text: str) -> Tuple[int, bool]:
+        """(tokens, exact) for `text`; exact is False for estimates"""
+        encoder = self.encoder(model)
+        if encoder is None:
+            self.estimated += 1
+            return estimate_tokens(text), False
+        self.exact += 1
+        return encoder(text), True
+
+    async def count_async(self, model: str, text: str) -> Tuple[int, bool]:
+        """count(), in a worker thread for long texts or a tokenizer not loaded yet"""
+        if len(text) <= INLINE_CHARS and tokenizer_family(model) in self._encoders:
+            return self.count(model, text)
+        return await asyncio.to_thread(self.count, model, text)
+
+    async def usage(self, model: str, prompt: str, completion: str) -> Dict[str, int]:
+        """A `usage` dict in the OpenAI shape, flagged when estimated"""
+        prompt_tokens, prompt_exact = await self.count_async(model, prompt)
+        completion_tokens, completion_exact = await self.count_async(model, completion)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if not (prompt_exact and completion_exact):
+            usage["estimated"] = True
+        return usage
+
+    async def preload(self, models: Iterable[str] = TOKENIZER_PRELOAD) -> None:
+        for model in models:
+            await asyncio.to_thread(self.encoder, model)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "families": {family: encoder is not None for family, encoder in self._encoders.items()},
+            "exact": self.exact,
+            "estimated": self.estimated,
+        }
+
+
+token_counter = TokenCounter()
@@ -0,0 +1,201 @@
+
+"""
+Shared upstream connection pools for the proxy endpoints.
+
+One long-lived httpx.AsyncClient is kept per upstream so that requests reuse
+keep-alive (and, when available, HTTP/2) connections instead of paying a new
+TCP+TLS handshake on every call. Clients are created on app startup (or on
+first use) and closed on shutdown. They share one SSL context, so the CA
+bundle is loaded once rather than once per upstream. prewarm() opens their
+first connections ahead of the first request.
+"""
+import asyncio
+import os
+import ssl
+from typing import Any, Dict, Iterable, Optional
+
+import httpx
+
+from . import deadlines
+from .metrics import upstream_hooks
+
+# Base URLs of the upstream providers (overridable for staging or local stubs)
+UPSTREAMS: Dict[str, str] = {
+    "openai": os.environ.get("OPENAI_BASE_URL", "https://api.openai.com"),
+    "huggingface": os.environ.get("HUGGINGFACE_BASE_URL", "https://api-inference.huggingface.co"),
+    "elevenlabs": os.environ.get("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io"),
+}
+
+# Pool limits - UPSTREAM_<NAME>_MAX_CONNECTIONS overrides the default per upstream
+MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "30.0"))
+HTTP2_ENABLED = os.environ.get("UPSTREAM_HTTP2", "true").lower() in ("1", "true", "yes")
+
+# Timeout for upstream calls - UPSTREAM_<NAME>_TIMEOUT overrides the default
+# per upstream (connect timeout is kept short)
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "30.0"))
+CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5.0"))
+
+# Connections opened per upstream by prewarm() (one is enough with HTTP/2)
+PREWARM_CONNECTIONS = int(os.environ.get("UPSTREAM_PREWARM_CONNECTIONS", "1"))
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_ssl_context: Optional[ssl.SSLContext] = None
+
+
+def _shared_ssl_context() -> ssl.SSLContext:
+    """The SSL context of every client, built on first use"""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = httpx.create_ssl_context()
+    return _ssl_context
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package"""
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _limits_for(name: str) -> httpx.Limits:
+    """Build the pool limits for an upstream"""
+    max_connections = int(os.environ.get(
+        f"UPSTREAM_{name.upper()}_MAX_CONNECTIONS", MAX_CONNECTIONS
+    ))
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=min(MAX_KEEPALIVE_CONNECTIONS, max_connections),
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout_for(name: str) -> httpx.Timeout:
+    """Build the timeout for an upstream"""
+    timeout = float(os.environ.get(f"UPSTREAM_{name.upper()}_TIMEOUT", UPSTREAM_TIMEOUT))
+    return httpx.Timeout(timeout, connect=min(CONNECT_TIMEOUT, timeout))
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=UPSTREAMS[name],
+        limits=_limits_for(name),
+        http2=_http2_available(),
+        timeout=_timeout_for(name),
+        verify=_shared_ssl_context(),
+        event_hooks=upstream_hooks(name),
+    )
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+    Get the shared client for an upstream.
+
+    Clients of upstreams with an API key are normally created by prewarm();
+    any other client is created here on first use.
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _create_client(name)
+        _clients[name] = client
+    return client
+
+
+def request_timeout(name: str) -> httpx.Timeout:
+    """
+    The upstream's timeout, cut to the time left before the request's
+    deadline. It applies to each read; deadlines.bounded() caps the call.
+    """
+    timeout = get_client(name).timeout
+    left = deadlines.check()
+    if left is None or left >= timeout.read:
+        return timeout
+    return httpx.Timeout(left, connect=min(timeout.connect, left))
+
+
+async def _open_connection(client: httpx.AsyncClient) -> None:
+    # Any response will do: the connection stays in the pool afterwards
+    await client.head("/", extensions={"prewarm": True})
+
+
+async def prewarm(names: Iterable[str]) -> Dict[str, int]:
+    """
+    Create the clients of `names` off the event loop (loading the CA bundle
+    and HTTP/2 support) and open PREWARM_CONNECTIONS connections to each.
+    Returns the pooled connections per upstream; connection errors are left
+    for the first request to report.
+    """
+    names = list(names)
+    for name in names:
+        if name not in _clients:
+            client = await asyncio.to_thread(_create_client, name)
+            # A request may have created one meanwhile
+            if _clients.setdefault(name, client) is not client:
+                await client.aclose()
+    await asyncio.gather(*[
+        _open_connection(get_client(name)) for name in names for _ in range(PREWARM_CONNECTIONS)
+    ], return_exceptions=True)
+    stats = pool_stats()
+    return {name: stats[name]["connections"] for name in names}
+
+
+async def shutdown() -> None:
+    """Close all upstream clients and their pooled connections"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def _pool_of(client: httpx.AsyncClient) -> Optional[Any]:
+    # httpx does not expose its httpcore pool publicly
+    transport = getattr(client, "_transport", None)
+    return getattr(transport, "_pool", None)
+
+
+def _pool_counts(client: httpx.AsyncClient) -> Optional[Dict[str, int]]:
+    """
+    Connection counts read from the httpcore pool, or None when the client
+    has no such pool (a custom transport) or its internals have changed.
+    """
+    pool = _pool_of(client)
+    if pool is None:
+        return None
+    try:
+        connections = list(pool.connections)
+        idle = sum(1 for conn in connections if conn.is_idle())
+        waiting = sum(1 for req in list(pool._requests) if req.is_queued())
+    except (AttributeError, TypeError):
+        return None
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "in_use": len(connections) - idle,
+        "waiting": waiting,
+    }
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Snapshot of every pool: idle and in-use connections, and requests
+    waiting for a connection. `observed` is false when the counts could
+    not be read from the client's transport and are left at zero.
+    """
+    stats: Dict[str, Dict[str, Any]] = {}
+    for name, client in _clients.items():
+        limits = _limits_for(name)
+        counts = _pool_counts(client)
+        stats[name] = {
+            "base_url": UPSTREAMS[name],
+            "http2": _http2_available(),
+            "max_connections": limits.max_connections,
+            "max_keepalive_connections": limits.max_keepalive_connections,
+            "observed": counts is not None,
+            **(counts or {"connections": 0, "idle": 0, "in_use": 0, "waiting": 0}),
+        }
+    return stats
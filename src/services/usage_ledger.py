@@ -0,0 +1,335 @@
+
+"""
+Append-only usage ledger: token counts per user and model, and characters
+for models billed by the character (text to speech).
+
+record() only appends to an in-memory buffer, so requests never wait on the
+disk. A background task flushes the buffer when it holds USAGE_FLUSH_SIZE
+records, or every USAGE_FLUSH_INTERVAL seconds. A worker thread appends the
+records to the hour's raw segment, USAGE_LEDGER_DIR/raw/<hour>.<pid>.jsonl,
+with one file per worker process and one JSON line per record.
+
+Once an hour is over, its raw segments are compacted into a rollup segment,
+rollup/<hour>.json, that holds one total per (user, model). Queries read
+rollups for past hours and raw segments for the hours not compacted yet, so a
+month-long window reads about 720 small files rather than every record.
+Windows have hour resolution. Records still buffered in other workers are
+not seen until their next flush.
+
+Records that fail to be written are kept for the next flush, up to
+USAGE_BUFFER_MAX; past that the oldest are dropped and counted as unrecorded.
+
+When USAGE_LEDGER_DIR cannot be created, the gateway still starts: usage is
+not recorded and queries raise LedgerUnavailable.
+
+<hour> is hours since the epoch (UTC).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LEDGER_DIR = os.environ.get("USAGE_LEDGER_DIR", "data/usage")
+FLUSH_SIZE = int(os.environ.get("USAGE_FLUSH_SIZE", "500"))
+FLUSH_INTERVAL = float(os.environ.get("USAGE_FLUSH_INTERVAL", "5"))
+# Records kept in memory while the ledger cannot be written
+BUFFER_MAX = int(os.environ.get("USAGE_BUFFER_MAX", "100000"))
+# Seconds between checks for finished hours to compact
+COMPACT_INTERVAL = float(os.environ.get("USAGE_COMPACT_INTERVAL", "60"))
+
+GRANULARITIES = ("hour", "day", "total")
+
+# (timestamp, user, model, prompt tokens, completion tokens, characters);
+# segments written before characters were counted have no last field
+Record = Tuple[float, str, str, int, int, int]
+# (period start, user, model) -> [requests, prompt tokens, completion tokens, characters]
+Totals = Dict[Tuple[int, str, str], List[int]]
+
+
+class LedgerUnavailable(Exception):
+    """The ledger's directory could not be created"""
+
+
+class _DirLock:
+    """flock on the ledger's lock file: shared for appends, exclusive for compaction"""
+
+    def __init__(self, directory: str, exclusive: bool):
+        self.path = os.path.join(directory, ".lock")
+        self.mode = None
+        if fcntl:
+            self.mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        if self.mode is not None:
+            fcntl.flock(self._file.fileno(), self.mode)
+        return self
+
+    def __exit__(self, *exc):
+        if self.mode is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+
+class UsageLedger:
+    """Buffers usage records and writes them to hourly segments"""
+
+    def __init__(self, directory: str = LEDGER_DIR, flush_size: int = FLUSH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL, compact_interval: float = COMPACT_INTERVAL,
+                 max_buffer: int = BUFFER_MAX):
+        self.directory = directory
+        self.raw_dir = os.path.join(directory, "raw")
+        self.rollup_dir = os.path.join(directory, "rollup")
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.max_buffer = max_buffer
+        self._buffer: List[Record] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_compaction = 0.0
+        self.recorded = 0
+        self.flushed = 0
+        self.flush_errors = 0
+        self.compacted_hours = 0
+        self.unrecorded = 0
+        self.available = True
+
+    def record(self, user: str, model: str, prompt_tokens: int, completion_tokens: int,
+               now: Optional[float] = None, characters: int = 0) -> None:
+        if not self.available:
+            self.unrecorded += 1
+            return
+        self._buffer.append((now or time.time(), user, model, int(prompt_tokens), int(completion_tokens),
+                             int(characters)))
+        self.recorded += 1
+        if len(self._buffer) >= self.flush_size and self._wake is not None:
+            self._wake.set()
+
+    # ----- Writing -----
+
+    def _append(self, records: List[Record]) -> None:
+        by_hour: Dict[int, List[str]] = {}
+        for record in records:
+            by_hour.setdefault(int(record[0] // 3600), []).append(json.dumps(record, separators=(",", ":")))
+        with _DirLock(self.directory, exclusive=False):
+            for hour, lines in by_hour.items():
+                with open(os.path.join(self.raw_dir, f"{hour}.{os.getpid()}.jsonl"), "a") as f:
+                    f.write("\n".join(lines) + "\n")
+
+    async def flush(self) -> int:
+        """Write buffered records; returns how many were written"""
+        if not self._buffer:
+            return 0
+        records, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._append, records)
+        except OSError as e:
+            # Keep them for the next flush, dropping the oldest past max_buffer
+            self._buffer[:0] = records
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.unrecorded += overflow
+            self.flush_errors += 1
+            logger.error("Error writing usage ledger: %s", e)
+            return 0
+        self.flushed += len(records)
+        return len(records)
+
+    # ----- Compaction -----
+
+    def _raw_segments(self) -> Dict[int, List[str]]:
+        segments: Dict[int, List[str]] = {}
+        for name in os.listdir(self.raw_dir):
+            if name.endswith(".jsonl"):
+                segments.setdefault(int(name.split(".", 1)[0]), []).append(os.path.join(self.raw_dir, name))
+        return segments
+
+    def _rollup_path(self, hour: int) -> str:
+        return os.path.join(self.rollup_dir, f"{hour}.json")
+
+    def _compact(self, before_hour: int) -> int:
+        """Fold the raw segments of every hour before `before_hour` into its rollup"""
+        compacted = 0
+        with _DirLock(self.directory, exclusive=True):
+            for hour, paths in sorted(self._raw_segments().items()):
+                if hour >= before_hour:
+                    continue
+                totals: Totals = {}
+                _add_rollup(totals, self._rollup_path(hour), hour, "hour")
+                for path in paths:
+                    _add_raw(totals, path, hour * 3600, (hour + 1) * 3600, None, "hour")
+                tmp_path = self._rollup_path(hour) + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"hour": hour, "rows": [[u, m, *counts] for (_, u, m), counts in totals.items()]}, f)
+                os.replace(tmp_path, self._rollup_path(hour))
+                for path in paths:
+                    os.unlink(path)
+                compacted += 1
+        return compacted
+
+    async def compact(self, now: Optional[float] = None) -> int:
+        compacted = await asyncio.to_thread(self._compact, int((now or time.time()) // 3600))
+        self.compacted_hours += compacted
+        return compacted
+
+    # ----- Queries -----
+
+    def _scan(self, start_hour: int, end_hour: int, user: Optional[str], granularity: str) -> Totals:
+        totals: Totals = {}
+        # Shared with appends but not with compaction, so no hour is counted twice or missed
+        with _DirLock(self.directory, exclusive=False):
+            for name in os.listdir(self.rollup_dir):
+                if name.endswith(".json"):
+                    hour = int(name[:-5])
+                    if start_hour <= hour < end_hour:
+                        _add_rollup(totals, os.path.join(self.rollup_dir, name), hour, granularity, user)
+            for hour, paths in self._raw_segments().items():
+                if start_hour <= hour < end_hour:
+                    for path in paths:
+                        _add_raw(totals, path, start_hour * 3600, end_hour * 3600, user, granularity)
+        return totals
+
+    async def query(self, start: float, end: float, user: Optional[str] = None,
+                    granularity: str = "day") -> List[Dict[str, Any]]:
+        """
+        Usage per period, user and model between `start` and `end` (epoch
+        seconds, widened to whole hours), for one user or all of them.
+        Periods start at hour or UTC day boundaries, or at the window start
+        for "total".
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        if not self.available:
+            raise LedgerUnavailable(f"Usage ledger directory {self.directory} is not writable")
+        start_hour, end_hour = int(start // 3600), -int(-end // 3600)
+        totals = await asyncio.to_thread(self._scan, start_hour, end_hour, user, granularity)
+        _add_records(totals, self._buffer, start_hour * 3600, end_hour * 3600, user, granularity)
+        if granularity == "total":
+            totals = {(start_hour * 3600, u, m): counts for (_, u, m), counts in totals.items()}
+        return [
+            {
+                "period_start": period,
+                "user": u,
+                "model": m,
+                "requests": requests,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "characters": characters,
+            }
+            for (period, u, m), (requests, prompt_tokens, completion_tokens, characters) in sorted(totals.items())
+        ]
+
+    # ----- Lifecycle -----
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+            if time.monotonic() - self._last_compaction >= self.compact_interval:
+                self._last_compaction = time.monotonic()
+                try:
+                    await self.compact()
+                except (OSError, ValueError) as e:
+                    logger.error("Error compacting usage ledger: %s", e)
+
+    async def startup(self) -> None:
+        try:
+            os.makedirs(self.raw_dir, exist_ok=True)
+            os.makedirs(self.rollup_dir, exist_ok=True)
+        except OSError as e:
+            # Serve requests without usage rather than not at all
+            self.available = False
+            logger.error("Usage ledger disabled, cannot create %s: %s", self.directory, e)
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "flush_errors": self.flush_errors,
+            "compacted_hours": self.compacted_hours,
+            "unrecorded": self.unrecorded,
+        }
+
+
+def _period(timestamp: float, granularity: str) -> int:
+    if granularity == "hour":
+        return int(timestamp // 3600) * 3600
+    if granularity == "day":
+        return int(timestamp // 86400) * 86400
+    return 0
+
+
+def _add(totals: Totals, key: Tuple[int, str, str], requests: int, prompt_tokens: int, completion_tokens: int,
+         characters: int = 0) -> None:
+    counts = totals.get(key)
+    if counts is None:
+        totals[key] = [requests, prompt_tokens, completion_tokens, characters]
+    else:
+        counts[0] += requests
+        counts[1] += prompt_tokens
+        counts[2] += completion_tokens
+        counts[3] += characters
+
+
+def _add_records(totals: Totals, records: Iterable[Record], start: float, end: float,
+                 user: Optional[str], granularity: str) -> None:
+    for timestamp, u, model, prompt_tokens, completion_tokens, *characters in records:
+        if start <= timestamp < end and (user is None or u == user):
+            _add(totals, (_period(timestamp, granularity), u, model), 1, prompt_tokens, completion_tokens,
+                 *characters)
+
+
+def _add_raw(totals: Totals, path: str, start: float, end: float, user: Optional[str], granularity: str) -> None:
+    try:
+        with open(path) as f:
+            # A line cut short by a crash mid-write is skipped
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        return
+    _add_records(totals, records, start, end, user, granularity)
+
+
+def _add_rollup(totals: Totals, path: str, hour: int, granularity: str, user: Optional[str] = None) -> None:
+    try:
+        with open(path) as f:
+            rows = json.load(f)["rows"]
+    except FileNotFoundError:
+        return
+    period = _period(hour * 3600, granularity)
+    for u, model, requests, prompt_tokens, completion_tokens, *characters in rows:
+        if user is None or u == user:
+            _add(totals, (period, u, model), requests, prompt_tokens, completion_tokens, *characters)
+
+
+usage_ledger = UsageLedger()
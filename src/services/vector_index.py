@@ -0,0 +1,653 @@
+
+"""
+Embedded vector index behind /proxy/vector/search.
+
+Each collection lives in its own directory under VECTOR_DATA_DIR:
+- meta.json     dimension, committed row count, records size, index info
+- vectors.f32   raw float32 rows (L2-normalized, cosine similarity)
+- records.jsonl one {"id", "metadata", "content"} object per row
+- records.idx   int64 byte offset of each row in records.jsonl
+- deleted.idx   int64 rows removed by deletes or superseded by upserts
+- ivf_<v>_*.npy optional IVF index version <v> (centroids, row order, list offsets)
+
+Vectors and offsets are memory-mapped, so opening a collection does not load
+it into RAM. Small collections are searched exactly (matrix product +
+argpartition); collections with at least VECTOR_IVF_THRESHOLD rows also get
+an IVF index that only scans the closest lists.
+
+Data files are append-only and meta.json is replaced atomically, so a write
+only becomes visible once meta.json counts it. Searches run against an
+immutable Snapshot that is swapped for a new one after each commit or index
+rebuild.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Vector store configuration
+DATA_DIR = os.environ.get("VECTOR_DATA_DIR", "data/vectors")
+IVF_THRESHOLD = int(os.environ.get("VECTOR_IVF_THRESHOLD", "50000"))
+IVF_NPROBE = int(os.environ.get("VECTOR_IVF_NPROBE", "16"))
+IVF_TRAIN_SAMPLE = int(os.environ.get("VECTOR_IVF_TRAIN_SAMPLE", "65536"))
+IVF_TRAIN_ITERATIONS = 10
+# Embedding model used for text queries unless a collection names its own
+EMBEDDING_MODEL = os.environ.get("VECTOR_EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Rows scored per matrix product when scanning or assigning in chunks
+_CHUNK_ROWS = 65536
+
+_COLLECTION_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+class CollectionNotFound(KeyError):
+    pass
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so the dot product is the cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+# ===== IVF index =====
+class IVFIndex:
+    """
+    Inverted-file index: rows are grouped by their nearest centroid and a
+    query only scores the rows of the `nprobe` closest lists.
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids  # (nlist, dim)
+        self.order = order          # row ids grouped by list
+        self.offsets = offsets      # (nlist + 1,) start of each list in `order`
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @staticmethod
+    def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """Nearest centroid of every row, computed in chunks"""
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), _CHUNK_ROWS):
+            chunk = np.asarray(vectors[start:start + _CHUNK_ROWS])
+            labels[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        return labels
+
+    @classmethod
+    def from_labels(cls, centroids: np.ndarray, labels: np.ndarray) -> "IVFIndex":
+        order = np.argsort(labels, kind="stable").astype(np.int64)
+        counts = np.bincount(labels, minlength=len(centroids))
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(centroids, order, offsets)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: Optional[int] = None, seed: int = 0) -> "IVFIndex":
+        """Train centroids with spherical k-means on a sample, then assign all rows"""
+        count = len(vectors)
+        nlist = nlist or max(1, int(np.sqrt(count)))
+        rng = np.random.default_rng(seed)
+        sample_size = min(count, max(IVF_TRAIN_SAMPLE, nlist * 32))
+        sample_rows = np.sort(rng.choice(count, size=sample_size, replace=False))
+        sample = np.asarray(vectors[sample_rows])
+
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            labels = cls.assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            # Re-seed empty lists with random sample rows
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            centroids = normalize(sums)
+
+        return cls.from_labels(centroids, cls.assign(vectors, centroids))
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Row ids in the `nprobe` lists closest to the query"""
+        lists = top_k(self.centroids @ query, min(nprobe, self.nlist))
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+
+    def labels(self) -> np.ndarray:
+        """List of every indexed row (inverse of from_labels)"""
+        labels = np.empty(len(self.order), dtype=np.int32)
+        for c in range(self.nlist):
+            labels[self.order[self.offsets[c]:self.offsets[c + 1]]] = c
+        return labels
+
+    def extend(self, vectors: np.ndarray) -> "IVFIndex":
+        """New index that also covers `vectors` (rows appended after the indexed ones)"""
+        new_labels = self.assign(vectors, self.centroids)
+        return self.from_labels(self.centroids, np.concatenate([self.labels(), new_labels]))
+
+    @staticmethod
+    def _files(path: str, version: int) -> Tuple[str, str, str]:
+        return tuple(
+            os.path.join(path, f"ivf_{version}_{part}.npy")
+            for part in ("centroids", "order", "offsets")
+        )
+
+    def save(self, path: str, version: int) -> None:
+        # Versioned files: snapshots still in use keep their memory-mapped version
+        for file, array in zip(self._files(path, version), (self.centroids, self.order, self.offsets)):
+            np.save(file, array)
+
+    @classmethod
+    def load(cls, path: str, version: int) -> "IVFIndex":
+        centroids, order, offsets = cls._files(path, version)
+        return cls(np.load(centroids), np.load(order, mmap_mode="r"), np.load(offsets))
+
+    @classmethod
+    def remove(cls, path: str, version: int) -> None:
+        for file in cls._files(path, version):
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+
+# ===== Collections =====
+class Snapshot:
+    """Read-only view of a collection's committed rows"""
+
+    def __init__(self, path: str, meta: Dict[str, Any], ivf: Optional[IVFIndex] = None):
+        self.path = path
+        self.meta = meta
+        self.dim: int = meta["dim"]
+        self.count: int = meta["count"]
+        self.records_size: int = meta["records_size"]
+        self.ivf = ivf
+        # Rows appended after the IVF index was built are scanned exactly
+        self.ivf_count: int = meta.get("ivf_count", 0) if ivf is not None else 0
+        self.deleted: Optional[np.ndarray] = None
+        deleted_count = meta.get("deleted_count", 0)
+        if deleted_count:
+            rows = np.fromfile(os.path.join(path, "deleted.idx"), dtype=np.int64, count=deleted_count)
+            self.deleted = np.zeros(self.count, dtype=bool)
+            self.deleted[rows] = True
+        if self.count:
+            self.vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32,
+                                     mode="r", shape=(self.count, self.dim))
+            self.offsets = np.memmap(os.path.join(path, "records.idx"), dtype=np.int64,
+                                     mode="r", shape=(self.count,))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self.offsets = np.zeros(0, dtype=np.int64)
+        self._records_fd: Optional[int] = None
+        self._postings: Dict[str, Dict[str, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    # ----- records -----
+    def _fd(self) -> int:
+        if self._records_fd is None:
+            self._records_fd = os.open(os.path.join(self.path, "records.jsonl"), os.O_RDONLY)
+        return self._records_fd
+
+    def record(self, row: int) -> Dict[str, Any]:
+        start = int(self.offsets[row])
+        end = int(self.offsets[row + 1]) if row + 1 < self.count else self.records_size
+        return json.loads(os.pread(self._fd(), end - start, start))
+
+    def iter_records(self):
+        with open(os.path.join(self.path, "records.jsonl"), "rb") as f:
+            for _ in range(self.count):
+                yield json.loads(f.readline())
+
+    def close(self) -> None:
+        if self._records_fd is not None:
+            os.close(self._records_fd)
+            self._records_fd = None
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def live_count(self) -> int:
+        if self.deleted is None:
+            return self.count
+        return self.count - int(self.deleted.sum())
+
+    # ----- metadata filtering -----
+    def _postings_for(self, field: str) -> Dict[str, np.ndarray]:
+        """Rows per metadata value of a field, built on first use"""
+        postings = self._postings.get(field)
+        if postings is not None:
+            return postings
+        with self._lock:
+            if field not in self._postings:
+                rows: Dict[str, List[int]] = {}
+                for row, record in enumerate(self.iter_records()):
+                    metadata = record.get("metadata") or {}
+                    if field in metadata and not (self.deleted is not None and self.deleted[row]):
+                        rows.setdefault(_value_key(metadata[field]), []).append(row)
+                self._postings[field] = {
+                    value: np.asarray(r, dtype=np.int64) for value, r in rows.items()
+                }
+            return self._postings[field]
+
+    def filter_rows(self, filter: Dict[str, Any]) -> np.ndarray:
+        """Rows whose metadata matches every field (a list value means "any of")"""
+        rows: Optional[np.ndarray] = None
+        for field, expected in filter.items():
+            postings = self._postings_for(field)
+            values = expected if isinstance(expected, list) else [expected]
+            matches = [postings.get(_value_key(v)) for v in values]
+            matches = [m for m in matches if m is not None]
+            field_rows = np.unique(np.concatenate(matches)) if matches else np.zeros(0, dtype=np.int64)
+            rows = field_rows if rows is None else np.intersect1d(rows, field_rows, assume_unique=True)
+            if not len(rows):
+                break
+        return rows if rows is not None else np.arange(self.count)
+
+    # ----- search -----
+    def _score_rows(self, rows: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.sort(rows)  # sequential reads from the memory map
+        if self.deleted is not None:
+            rows = rows[~self.deleted[rows]]
+        scores = np.asarray(self.vectors[rows]) @ query
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def _scan_all(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        best_rows, best_scores = [], []
+        for start in range(0, self.count, _CHUNK_ROWS):
+            scores = np.asarray(self.vectors[start:start + _CHUNK_ROWS]) @ query
+            if self.deleted is not None:
+                scores[self.deleted[start:start + len(scores)]] = -np.inf
+            chunk_best = top_k(scores, k)
+            best_rows.append(chunk_best + start)
+            best_scores.append(scores[chunk_best])
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        exact: bool = False,
+        nprobe: int = IVF_NPROBE
+    ) -> List[Dict[str, Any]]:
+        """Top-k rows by cosine similarity, optionally filtered on metadata"""
+        if not self.count or k <= 0:
+            return []
+        query = normalize(query)
+
+        candidates: Optional[np.ndarray] = None
+        if filter:
+            candidates = self.filter_rows(filter)
+            if not len(candidates):
+                return []
+
+        if self.ivf is not None and not exact:
+            probed = self.ivf.probe(query, nprobe)
+            if self.ivf_count < self.count:
+                probed = np.concatenate([probed, np.arange(self.ivf_count, self.count)])
+            if candidates is None:
+                rows, scores = self._score_rows(probed, query, k)
+            elif len(candidates) <= len(probed):
+                # A selective filter is cheaper to scan exactly
+                rows, scores = self._score_rows(candidates, query, k)
+            else:
+                rows, scores = self._score_rows(np.intersect1d(probed, candidates), query, k)
+        elif candidates is not None:
+            rows, scores = self._score_rows(candidates, query, k)
+        else:
+            rows, scores = self._scan_all(query, k)
+
+        results = []
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            if score == -np.inf:
+                break  # only deleted rows left
+            record = self.record(row)
+            results.append({
+                "id": record["id"],
+                "score": score,
+                "metadata": record.get("metadata") or {},
+                "content": record.get("content"),
+            })
+        return results
+
+
+def _value_key(value: Any) -> str:
+    return json.dumps(value, sort_keys=True)
+
+
+def _read_meta(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        return json.load(f)
+
+
+def _write_meta(path: str, meta: Dict[str, Any]) -> None:
+    """Atomically replace meta.json - this commits the rows it counts"""
+    tmp_path = os.path.join(path, f"meta.json.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(path, "meta.json"))
+
+
+def open_snapshot(path: str) -> Snapshot:
+    meta = _read_meta(path)
+    ivf = IVFIndex.load(path, meta["ivf"]) if meta.get("ivf") else None
+    return Snapshot(path, meta, ivf)
+
+
+class Collection:
+    """
+    A named collection; searches run against its current snapshot.
+
+    Writers append through a CollectionWriter (one at a time, guarded by
+    `write_lock`) and the IVF index is extended or rebuilt in the background
+    by rebuild_index(). Both swap in a fresh snapshot when done.
+    """
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.snapshot = open_snapshot(path)
+        self.write_lock = asyncio.Lock()
+        self._meta_lock = threading.Lock()
+        self._id_rows: Optional[Dict[str, int]] = None
+
+    def update_meta(self, changes: Dict[str, Any]) -> None:
+        """Commit metadata changes and swap in a snapshot that reflects them"""
+        with self._meta_lock:
+            meta = _read_meta(self.path)
+            meta.update(changes)
+            _write_meta(self.path, meta)
+            ivf = IVFIndex.load(self.path, meta["ivf"]) if meta.get("ivf") else None
+            self.snapshot = Snapshot(self.path, meta, ivf)
+
+    def id_rows(self) -> Dict[str, int]:
+        """Live row of every id, built from the records on first write"""
+        if self._id_rows is None:
+            snapshot = self.snapshot
+            id_rows = {}
+            for row, record in enumerate(snapshot.iter_records()):
+                if snapshot.deleted is None or not snapshot.deleted[row]:
+                    id_rows[record["id"]] = row
+            self._id_rows = id_rows
+        return self._id_rows
+
+    def writer(self) -> "CollectionWriter":
+        return CollectionWriter(self)
+
+    def needs_rebuild(self) -> bool:
+        snapshot = self.snapshot
+        if snapshot.ivf is None:
+            return snapshot.count >= IVF_THRESHOLD
+        return snapshot.ivf_count < snapshot.count
+
+    def rebuild_index(self) -> None:
+        """
+        Bring the IVF index up to date with the committed rows.
+
+        New rows are assigned to the existing centroids; the index is
+        retrained from scratch once the collection has doubled since the
+        last training, or built for the first time at IVF_THRESHOLD rows.
+        """
+        snapshot = self.snapshot
+        meta = snapshot.meta
+        count = snapshot.count
+        if not self.needs_rebuild():
+            return
+
+        version = meta.get("ivf") or 0
+        trained_count = meta.get("ivf_trained_count", 0)
+        if snapshot.ivf is None or count >= 2 * trained_count:
+            ivf = IVFIndex.build(snapshot.vectors)
+            trained_count = count
+        else:
+            ivf = snapshot.ivf.extend(snapshot.vectors[snapshot.ivf_count:count])
+        ivf.save(self.path, version + 1)
+        self.update_meta({"ivf": version + 1, "ivf_count": count,
+                          "ivf_trained_count": trained_count})
+        if version:
+            # Snapshots still searching the old version keep their mapping
+            IVFIndex.remove(self.path, version)
+
+    @property
+    def dim(self) -> int:
+        return self.snapshot.dim
+
+    @property
+    def embedding_model(self) -> str:
+        return self.snapshot.meta.get("embedding_model") or EMBEDDING_MODEL
+
+    def search(self, query: np.ndarray, k: int, filter: Optional[Dict[str, Any]] = None,
+               exact: bool = False) -> List[Dict[str, Any]]:
+        return self.snapshot.search(query, k, filter=filter, exact=exact)
+
+    def info(self) -> Dict[str, Any]:
+        snapshot = self.snapshot
+        return {
+            "name": self.name,
+            "dim": snapshot.dim,
+            "count": snapshot.live_count,
+            "index": "ivf" if snapshot.ivf is not None else "exact",
+            "nlist": snapshot.ivf.nlist if snapshot.ivf is not None else None,
+        }
+
+
+def write_collection(
+    path: str,
+    vectors: np.ndarray,
+    ids: Optional[List[str]] = None,
+    metadata: Optional[List[Dict[str, Any]]] = None,
+    contents: Optional[List[Optional[str]]] = None,
+    ivf_threshold: int = IVF_THRESHOLD,
+    **meta_extra: Any
+) -> None:
+    """Write a collection from scratch (used for imports and benchmarks)"""
+    vectors = normalize(vectors)
+    count, dim = vectors.shape
+    os.makedirs(path, exist_ok=True)
+
+    vectors.tofile(os.path.join(path, "vectors.f32"))
+    offsets = np.zeros(count, dtype=np.int64)
+    position = 0
+    with open(os.path.join(path, "records.jsonl"), "wb") as f:
+        for row in range(count):
+            line = json.dumps({
+                "id": ids[row] if ids else str(row),
+                "metadata": metadata[row] if metadata else {},
+                "content": contents[row] if contents else None,
+            }).encode() + b"\n"
+            offsets[row] = position
+            position += len(line)
+            f.write(line)
+    offsets.tofile(os.path.join(path, "records.idx"))
+
+    meta = {"dim": dim, "count": count, "records_size": position, "deleted_count": 0, "ivf": 0}
+    if count and count >= ivf_threshold:
+        IVFIndex.build(vectors).save(path, 1)
+        meta.update({"ivf": 1, "ivf_count": count, "ivf_trained_count": count})
+    _write_meta(path, {**meta, **meta_extra})
+
+
+class CollectionWriter:
+    """
+    Appends rows to a collection without touching committed data.
+
+    Nothing is visible to searches until commit(). Bytes left behind by an
+    aborted writer are past the committed sizes and are truncated by the
+    next writer.
+    """
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+        meta = _read_meta(collection.path)
+        self.dim: int = meta["dim"]
+        self.count: int = meta["count"]
+        self.records_size: int = meta["records_size"]
+        self.deleted_count: int = meta.get("deleted_count", 0)
+        self.id_rows = collection.id_rows()
+        self.upserted = 0
+        self.deleted = 0
+
+        path = collection.path
+        committed = {
+            "vectors.f32": self.count * self.dim * 4,
+            "records.jsonl": self.records_size,
+            "records.idx": self.count * 8,
+            "deleted.idx": self.deleted_count * 8,
+        }
+        self._files = {}
+        for name, size in committed.items():
+            f = open(os.path.join(path, name), "ab")
+            f.truncate(size)
+            self._files[name] = f
+
+    def _tombstone(self, row: int) -> None:
+        self._files["deleted.idx"].write(np.int64(row).tobytes())
+        self.deleted_count += 1
+
+    def append(self, vectors: np.ndarray, records: List[Dict[str, Any]]) -> None:
+        """Append rows; an id that already exists replaces its previous row"""
+        vectors = normalize(vectors)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors with {self.dim} dimensions")
+
+        offsets = np.empty(len(records), dtype=np.int64)
+        lines = []
+        for i, record in enumerate(records):
+            row = self.count + i
+            previous = self.id_rows.get(record["id"])
+            if previous is not None:
+                self._tombstone(previous)
+            self.id_rows[record["id"]] = row
+            line = json.dumps(record).encode() + b"\n"
+            offsets[i] = self.records_size
+            self.records_size += len(line)
+            lines.append(line)
+
+        self._files["vectors.f32"].write(vectors.tobytes())
+        self._files["records.jsonl"].write(b"".join(lines))
+        self._files["records.idx"].write(offsets.tobytes())
+        self.count += len(records)
+        self.upserted += len(records)
+
+    def delete(self, ids: List[str]) -> None:
+        for id in ids:
+            row = self.id_rows.pop(id, None)
+            if row is not None:
+                self._tombstone(row)
+                self.deleted += 1
+
+    def _close(self) -> None:
+        for f in self._files.values():
+            f.close()
+
+    def commit(self) -> None:
+        """Make the appended rows durable, then visible"""
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self._close()
+        self.collection.update_meta({
+            "count": self.count,
+            "records_size": self.records_size,
+            "deleted_count": self.deleted_count,
+        })
+
+    def abort(self) -> None:
+        self._close()
+        # The id map may reference rows that were never committed
+        self.collection._id_rows = None
+
+
+# ===== Store =====
+class VectorStore:
+    """Collections opened lazily from DATA_DIR and kept open"""
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self._collections: Dict[str, Collection] = {}
+        self._lock = threading.Lock()
+        self._rebuilds: Dict[str, asyncio.Task] = {}
+        self._rebuild_pending: set = set()
+
+    def collection_path(self, name: str) -> str:
+        if not _COLLECTION_NAME.match(name):
+            raise ValueError(f"Invalid collection name: {name}")
+        return os.path.join(self.data_dir, name)
+
+    def get(self, name: str) -> Collection:
+        collection = self._collections.get(name)
+        if collection is not None:
+            return collection
+        path = self.collection_path(name)
+        with self._lock:
+            if name not in self._collections:
+                if not os.path.exists(os.path.join(path, "meta.json")):
+                    raise CollectionNotFound(name)
+                self._collections[name] = Collection(name, path)
+            return self._collections[name]
+
+    def get_or_create(self, name: str, dim: int) -> Collection:
+        """Open a collection, creating an empty one with `dim` dimensions"""
+        try:
+            return self.get(name)
+        except CollectionNotFound:
+            pass
+        path = self.collection_path(name)
+        with self._lock:
+            if not os.path.exists(os.path.join(path, "meta.json")):
+                write_collection(path, np.zeros((0, dim), dtype=np.float32))
+        return self.get(name)
+
+    def schedule_rebuild(self, collection: Collection) -> None:
+        """
+        Rebuild a collection's index in a worker thread.
+
+        At most one rebuild runs per collection; commits that land while it
+        runs trigger one more pass.
+        """
+        self._rebuild_pending.add(collection.name)
+        if collection.name not in self._rebuilds:
+            task = asyncio.get_running_loop().create_task(self._rebuild(collection))
+            self._rebuilds[collection.name] = task
+
+    async def _rebuild(self, collection: Collection) -> None:
+        try:
+            while collection.name in self._rebuild_pending:
+                self._rebuild_pending.discard(collection.name)
+                try:
+                    await asyncio.to_thread(collection.rebuild_index)
+                except Exception as e:
+                    logger.error("Error rebuilding index for %s: %s", collection.name, e)
+        finally:
+            del self._rebuilds[collection.name]
+
+    def list(self) -> List[str]:
+        if not os.path.isdir(self.data_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.data_dir)
+            if os.path.exists(os.path.join(self.data_dir, name, "meta.json"))
+        )
+
+
+vector_store = VectorStore(DATA_DIR)
@@ -0,0 +1,156 @@
+
+"""
+Streaming bulk ingest for vector collections.
+
+Upload bodies are consumed chunk by chunk and appended to the collection in
+batches of VECTOR_INGEST_CHUNK_ROWS rows, so an upload is never buffered in
+full. An upload is all-or-nothing: rows become visible to searches only when
+the whole body has been written and committed. The IVF index then catches up
+in the background.
+"""
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Dict, List
+
+import numpy as np
+
+from .vector_index import Collection, CollectionWriter, VectorStore
+
+INGEST_CHUNK_ROWS = int(os.environ.get("VECTOR_INGEST_CHUNK_ROWS", "4096"))
+
+
+async def _ndjson_rows(body: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """Parse an NDJSON byte stream line by line"""
+    buffer = b""
+    async for chunk in body:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
+
+
+def _append_rows(writer: CollectionWriter, rows: List[Dict[str, Any]]) -> None:
+    """Validate NDJSON rows and append them"""
+    records = []
+    vectors = np.empty((len(rows), writer.dim), dtype=np.float32)
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict) or "id" not in row or "vector" not in row:
+            raise ValueError("Each line needs an `id` and a `vector`")
+        vector = row["vector"]
+        if not isinstance(vector, list) or not all(isinstance(x, (int, float)) for x in vector):
+            raise ValueError(f"Vector for {row['id']} must be a list of numbers")
+        if len(vector) != writer.dim:
+            raise ValueError(f"Vector for {row['id']} has {len(vector)} dimensions, "
+                             f"expected {writer.dim}")
+        vectors[i] = vector
+        records.append({
+            "id": str(row["id"]),
+            "metadata": row.get("metadata") or {},
+            "content": row.get("content"),
+        })
+    writer.append(vectors, records)
+
+
+def _append_raw(writer: CollectionWriter, data: bytes, id_prefix: str) -> None:
+    """Append raw float32 rows, numbering ids from the current row count"""
+    vectors = np.frombuffer(data, dtype=np.float32).reshape(-1, writer.dim)
+    records = [
+        {"id": f"{id_prefix}{writer.count + i}", "metadata": {}, "content": None}
+        for i in range(len(vectors))
+    ]
+    writer.append(vectors, records)
+
+
+async def _write(store: VectorStore, collection: Collection, fill) -> Dict[str, Any]:
+    """Run `fill(writer)` under the collection's write lock and commit"""
+    async with collection.write_lock:
+        writer = await asyncio.to_thread(collection.writer)
+        try:
+            await fill(writer)
+            await asyncio.to_thread(writer.commit)
+        except BaseException:
+            writer.abort()
+            raise
+
+    if collection.needs_rebuild():
+        store.schedule_rebuild(collection)
+    return {
+        "collection": collection.name,
+        "upserted": writer.upserted,
+        "deleted": writer.deleted,
+        "count": collection.snapshot.live_count,
+    }
+
+
+async def ingest_ndjson(store: VectorStore, name: str, body: AsyncIterator[bytes]) -> Dict[str, Any]:
+    """
+    Upsert rows from an NDJSON stream of
+    {"id": ..., "vector": [...], "metadata": {...}, "content": ...} objects.
+
+    The collection is created on first use with the dimension of the first vector.
+    """
+    rows = _ndjson_rows(body)
+    first = await anext(rows, None)
+    if first is None:
+        raise ValueError("Upload is empty")
+    if not isinstance(first, dict) or not isinstance(first.get("vector"), list):
+        raise ValueError("Each line needs an `id` and a `vector`")
+    collection = await asyncio.to_thread(store.get_or_create, name, len(first["vector"]))
+
+    async def fill(writer: CollectionWriter) -> None:
+        batch = [first]
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= INGEST_CHUNK_ROWS:
+                await asyncio.to_thread(_append_rows, writer, batch)
+                batch = []
+        if batch:
+            await asyncio.to_thread(_append_rows, writer, batch)
+
+    return await _write(store, collection, fill)
+
+
+async def ingest_raw(
+    store: VectorStore,
+    name: str,
+    body: AsyncIterator[bytes],
+    dim: int,
+    id_prefix: str = ""
+) -> Dict[str, Any]:
+    """Append a stream of raw little-endian float32 rows of `dim` dimensions"""
+    if dim <= 0:
+        raise ValueError("`dim` must be positive")
+    collection = await asyncio.to_thread(store.get_or_create, name, dim)
+    if collection.dim != dim:
+        raise ValueError(f"Collection {name} has {collection.dim} dimensions, got {dim}")
+    chunk_bytes = INGEST_CHUNK_ROWS * dim * 4
+
+    async def fill(writer: CollectionWriter) -> None:
+        buffer = bytearray()
+        async for chunk in body:
+            buffer += chunk
+            while len(buffer) >= chunk_bytes:
+                data = bytes(buffer[:chunk_bytes])
+                del buffer[:chunk_bytes]
+                await asyncio.to_thread(_append_raw, writer, data, id_prefix)
+        if len(buffer) % (dim * 4):
+            raise ValueError("Upload is not a whole number of float32 rows")
+        if buffer:
+            await asyncio.to_thread(_append_raw, writer, bytes(buffer), id_prefix)
+
+    return await _write(store, collection, fill)
+
+
+async def delete_ids(store: VectorStore, name: str, ids: List[str]) -> Dict[str, Any]:
+    """Remove rows by id"""
+    collection = store.get(name)
+
+    async def fill(writer: CollectionWriter) -> None:
+        await asyncio.to_thread(writer.delete, ids)
+
+    return await _write(store, collection, fill)
+
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# main imports its modules the way serve.py runs it, from src/, where
+# `secrets` is the key store package (it re-exports the standard library's)
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "src"))
+sys.path.insert(0, SRC)
+if "secrets" in sys.modules and not hasattr(sys.modules["secrets"], "__path__"):
+    del sys.modules["secrets"]
+
+# Keep the gateway's files out of the working tree
+DATA_DIR = tempfile.mkdtemp(prefix="gateway-tests-")
+os.environ.setdefault("KEYS_FILE", os.path.join(DATA_DIR, "keys.json"))
+for name, directory in (("LOG_DIR", "logs"), ("USAGE_LEDGER_DIR", "usage"), ("AUDIO_CACHE_DIR", "audio"),
+                        ("VECTOR_DATA_DIR", "vectors"), ("TOKENIZER_DIR", "tokenizers")):
+    os.environ.setdefault(name, os.path.join(DATA_DIR, directory))
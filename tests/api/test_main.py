@@ -1,38 +1,225 @@
-
+import asyncio
+import gzip
+import json
+import httpx
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from src.main import app
+from auth.token_utils import create_token
+from services import upstream_pool
 
 client = TestClient(app)
 
+def auth(user):
+    return {"Authorization": f"Bearer {create_token(user)}"}
+
+@pytest.fixture
+def openai_upstream(monkeypatch):
+    """The OpenAI client answers from `handler`; returns the requests it saw"""
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    seen = []
+
+    def use(handler):
+        def record(request):
+            seen.append(request)
+            return handler(request)
+        monkeypatch.setitem(upstream_pool._clients, "openai", httpx.AsyncClient(
+            base_url="http://openai.test", transport=httpx.MockTransport(record)))
+        return seen
+    return use
+
+class Body(httpx.AsyncByteStream):
+    """A streamed upstream body, as a real connection gives (raw mode reads it unread)"""
+
+    def __init__(self, data):
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.data
+
+COMPLETION = {
+    "model": "gpt-4o-mini",
+    "choices": [{"message": {"role": "assistant", "content": "Hello!"}}],
+    "usage": {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5},
+}
+
 def test_root():
     response = client.get("/")
     assert response.status_code == 200
-    assert "message" in response.json()
+    assert response.json()["health"] == "/health"
     assert "version" in response.json()
-    assert "environment" in response.json()
 
 def test_health_check():
     response = client.get("/health")
     assert response.status_code == 200
-    assert response.json()["status"] == "healthy"
-
-def test_process_agent_request():
-    test_request = {
-        "prompt": "test prompt",
-        "context": {}
-    }
-    response = client.post("/agent/process", json=test_request)
+    assert response.json()["status"] == "ok"
+
+def test_completion_is_normalized(openai_upstream):
+    seen = openai_upstream(lambda request: httpx.Response(200, json=COMPLETION))
+    response = client.post("/proxy/openai/chat", json={"prompt": "normalized shape"}, headers=auth("api-normalized"))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {"completion": "Hello!", "model": "gpt-4o-mini", "usage": COMPLETION["usage"]}
+    assert json.loads(seen[0].content)["messages"][-1]["content"] == "normalized shape"
+
+def test_raw_json_is_passed_through_encoded_as_the_client_accepts(openai_upstream):
+    body = json.dumps({**COMPLETION, "id": "chatcmpl-raw"}).encode()
+
+    def handler(request):
+        if "gzip" in request.headers["accept-encoding"]:
+            return httpx.Response(200, stream=Body(gzip.compress(body)), headers={
+                "content-type": "application/json", "content-encoding": "gzip", "openai-version": "2020-10-01"})
+        return httpx.Response(200, stream=Body(body), headers={"content-type": "application/json"})
+
+    seen = openai_upstream(handler)
+    response = client.post("/proxy/openai/chat", json={"prompt": "raw gzip", "raw": True},
+                           headers={**auth("api-raw-gzip"), "Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["openai-version"] == "2020-10-01"
+    assert response.headers["x-upstream"] == "openai"
+    assert response.content == body  # decoded by the test client
+
+    # A client that accepts no encoding gets the body unencoded
+    plain = TestClient(app)
+    del plain.headers["accept-encoding"]
+    response = plain.post("/proxy/openai/chat", json={"prompt": "raw plain", "raw": True},
+                          headers=auth("api-raw-plain"))
+    assert seen[-1].headers["accept-encoding"] == "identity"
+    assert "content-encoding" not in response.headers
+    assert response.content == body
+
+def test_raw_stream_is_passed_through(openai_upstream):
+    events = b'data: {"choices":[{"delta":{"content":"Hi"}}]}\n\ndata: [DONE]\n\n'
+    seen = openai_upstream(lambda request: httpx.Response(
+        200, stream=Body(events), headers={"content-type": "text/event-stream"}))
+    response = client.post("/proxy/openai/chat", json={"prompt": "raw stream", "raw": True, "stream": True},
+                           headers=auth("api-raw-stream"))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.content == events
+    assert json.loads(seen[0].content)["stream"] is True
+
+def test_raw_upstream_error_keeps_its_status(openai_upstream):
+    openai_upstream(lambda request: httpx.Response(429, json={"error": "slow down"}, headers={"Retry-After": "0"}))
+    response = client.post("/proxy/openai/chat", json={"prompt": "raw error", "raw": True},
+                           headers=auth("api-raw-error"))
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "0"
+
+def batch_lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_batch_streams_results_in_completion_order(openai_upstream):
+    async def handler(request):
+        prompt = json.loads(request.content)["messages"][-1]["content"]
+        await asyncio.sleep(0.2 if prompt == "slow" else 0)
+        return httpx.Response(200, json={**COMPLETION, "choices": [{"message": {"content": prompt}}]})
+
+    openai_upstream(handler)
+    response = client.post("/proxy/openai/chat/batch", headers=auth("api-batch-order"), json={
+        "items": [{"prompt": "slow"}, {"prompt": "fast"}], "concurrency": 2})
     assert response.status_code == 200
-    assert "response" in response.json()
-    assert "status" in response.json()
-
-@pytest.mark.parametrize("invalid_request", [
-    {"context": {}},  # missing prompt
-    {"prompt": "test"},  # missing context
-    {},  # empty request
-])
-def test_process_agent_request_validation(invalid_request):
-    response = client.post("/agent/process", json=invalid_request)
-    assert response.status_code == 422  # validation error
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = batch_lines(response)
+    assert [line["index"] for line in lines] == [1, 0]
+    assert [line["result"]["completion"] for line in lines] == ["fast", "slow"]
+
+def test_batch_reports_errors_per_item(openai_upstream):
+    def handler(request):
+        prompt = json.loads(request.content)["messages"][-1]["content"]
+        if prompt == "rejected":
+            return httpx.Response(400, json={"error": "bad request"})
+        if prompt == "malformed":
+            return httpx.Response(200, json={"secret_internal_field": 1})
+        return httpx.Response(200, json=COMPLETION)
+
+    openai_upstream(handler)
+    response = client.post("/proxy/openai/chat/batch", headers=auth("api-batch-errors"), json={"items": [
+        {"prompt": "ok"}, {"prompt": "rejected"}, {"prompt": "streamed", "stream": True}, {"prompt": "malformed"},
+    ]})
+    lines = {line["index"]: line for line in batch_lines(response)}
+    assert lines[0]["result"]["completion"] == "Hello!"
+    assert lines[1]["error"]["status_code"] == 400
+    assert lines[2]["error"]["status_code"] == 400
+    assert lines[3]["error"] == {"status_code": 500, "detail": "Internal error"}
+
+def test_batch_caps_concurrency(openai_upstream):
+    active = [0, 0]  # now, most
+
+    async def handler(request):
+        active[0] += 1
+        active[1] = max(active[1], active[0])
+        await asyncio.sleep(0.02)
+        active[0] -= 1
+        return httpx.Response(200, json=COMPLETION)
+
+    openai_upstream(handler)
+    response = client.post("/proxy/openai/chat/batch", headers=auth("api-batch-concurrency"), json={
+        "items": [{"prompt": f"item {i}"} for i in range(8)], "concurrency": 2})
+    assert sorted(line["index"] for line in batch_lines(response)) == list(range(8))
+    assert active[1] == 2
+
+def test_batch_routes_auto_items_among_openai_models(openai_upstream):
+    seen = openai_upstream(lambda request: httpx.Response(
+        200, json={**COMPLETION, "model": json.loads(request.content)["model"]}))
+    response = client.post("/proxy/openai/chat/batch", headers=auth("api-batch-auto"), json={
+        "items": [{"prompt": "routed", "model": "auto"}, {"prompt": "routed fast", "model": "auto:fast"}]})
+    lines = batch_lines(response)
+    assert all("result" in line for line in lines)
+    assert {json.loads(request.content)["model"] for request in seen} <= {"gpt-4o-mini", "gpt-4o"}
+
+def test_vector_writes_need_admin():
+    rows = b'{"id": "a", "vector": [1, 0]}\n'
+    ndjson = {"Content-Type": "application/x-ndjson"}
+    response = client.post("/proxy/vector/collections/api-docs/upsert", content=rows,
+                           headers={**auth("api-vector-user"), **ndjson})
+    assert response.status_code == 403
+    response = client.post("/proxy/vector/collections/api-docs/delete", json={"ids": ["a"]},
+                           headers=auth("api-vector-user"))
+    assert response.status_code == 403
+
+    response = client.post("/proxy/vector/collections/api-docs/upsert", content=rows,
+                           headers={**auth("admin"), **ndjson})
+    assert response.status_code == 200 and response.json()["count"] == 1
+    response = client.post("/proxy/vector/collections/api-docs/upsert",
+                           content=rows + b'{"id": "b", "vector": {"x": 1}}\n', headers={**auth("admin"), **ndjson})
+    assert response.status_code == 400
+    response = client.post("/proxy/vector/collections/api-docs/delete", json={"ids": ["a"]}, headers=auth("admin"))
+    assert response.status_code == 200 and response.json()["count"] == 0
+
+def test_probes_do_not_wait_for_the_key_store(monkeypatch):
+    from secrets import manager
+
+    async def loading():
+        raise HTTPException(status_code=503, detail="keys loading")
+
+    monkeypatch.setattr(manager, "ensure_loaded", loading)
+    assert client.get("/health/live").status_code == 200
+    assert client.get("/health/ready").json()["status"] == "starting"  # no lifespan here
+    assert client.get("/metrics").status_code == 200
+    response = client.get("/admin/keys", headers=auth("admin"))
+    assert response.status_code == 503 and response.json()["detail"] == "keys loading"
+
+def test_stream_usage_is_recorded_in_a_tracked_task(caplog):
+    from src.main import background_tasks, relay_sse
+
+    class FailingUsage:
+        def observe(self, data):
+            pass
+
+        async def record(self):
+            raise RuntimeError("ledger broke")
+
+    async def run():
+        upstream = httpx.Response(200, stream=Body(b"data: hi\n\n"))
+        events = [event async for event in relay_sse(upstream, FailingUsage())]
+        pending = set(background_tasks)
+        await asyncio.gather(*pending, return_exceptions=True)
+        return events, pending
 
+    events, pending = asyncio.run(run())
+    assert events == ["hi"] and len(pending) == 1
+    assert not background_tasks
+    assert "ledger broke" in caplog.text
@@ -0,0 +1,38 @@
+
+import time
+import jwt
+import pytest
+from fastapi import HTTPException
+from src.auth import token_utils
+
+@pytest.fixture(autouse=True)
+def clean_caches(monkeypatch):
+    monkeypatch.setattr(token_utils, "JWT_SECRET", "test-secret-at-least-32-bytes-long!")
+    token_utils._verified_tokens.clear()
+    token_utils._revoked_tokens.clear()
+    yield
+    token_utils._verified_tokens.clear()
+    token_utils._revoked_tokens.clear()
+
+def test_verified_tokens_are_cached():
+    token = token_utils.create_token("alice")
+    assert token_utils.decode_token(token)["sub"] == "alice"
+    assert len(token_utils._verified_tokens) == 1
+    assert token_utils.decode_token(token)["sub"] == "alice"
+
+def test_revoked_token_is_rejected_even_when_cached():
+    token = token_utils.create_token("alice")
+    token_utils.decode_token(token)
+    token_utils.revoke_token(token)
+    with pytest.raises(HTTPException) as exc:
+        token_utils.decode_token(token)
+    assert exc.value.detail == "Token revoked"
+
+def test_cached_entry_expires_at_token_exp():
+    token = jwt.encode({"sub": "alice", "exp": int(time.time()) + 60}, "test-secret-at-least-32-bytes-long!", algorithm="HS256")
+    payload = token_utils.decode_token(token)
+    digest = token_utils._token_digest(token)
+    token_utils._verified_tokens[digest] = (payload, time.time() - 1)
+    with pytest.raises(HTTPException) as exc:
+        token_utils.decode_token(token)
+    assert exc.value.detail == "Token expired"
@@ -0,0 +1,71 @@
+
+import asyncio
+import json
+import os
+import pytest
+from src.secrets import manager
+
+@pytest.fixture(autouse=True)
+def keys_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "keys.json")
+    monkeypatch.setattr(manager, "KEYS_FILE", path)
+    monkeypatch.setattr(manager, "_api_keys_cache", {})
+    monkeypatch.setattr(manager, "_loaded", False)
+    monkeypatch.setattr(manager, "_file_signature", None)
+    monkeypatch.setattr(manager, "_first_load", None)
+    monkeypatch.delenv("TEST_API_KEY", raising=False)
+    return path
+
+def test_set_and_delete_key(keys_file):
+    assert manager.set_api_key("TEST_API_KEY", "sk-1")
+    assert manager.get_api_key("TEST_API_KEY") == "sk-1"
+    with open(keys_file) as f:
+        assert json.load(f)["TEST_API_KEY"] != "sk-1"  # stored encrypted
+    assert manager.delete_api_key("TEST_API_KEY")
+    assert manager.get_api_key("TEST_API_KEY") is None
+
+def test_stored_key_overrides_environment(monkeypatch):
+    monkeypatch.setenv("TEST_API_KEY", "from-env")
+    assert manager.get_api_key("TEST_API_KEY") == "from-env"
+    manager.set_api_key("TEST_API_KEY", "rotated")
+    assert manager.get_api_key("TEST_API_KEY") == "rotated"
+
+def test_reload_picks_up_external_rotation(keys_file):
+    manager.set_api_key("TEST_API_KEY", "sk-1")
+    assert not manager._reload_if_changed()
+
+    token = manager._get_cipher().encrypt(b"sk-2").decode()
+    tmp = keys_file + ".other"
+    with open(tmp, "w") as f:
+        json.dump({"TEST_API_KEY": token}, f)
+    os.replace(tmp, keys_file)
+
+    assert manager.get_api_key("TEST_API_KEY") == "sk-1"  # served from memory
+    assert manager._reload_if_changed()
+    assert manager.get_api_key("TEST_API_KEY") == "sk-2"
+
+def test_update_merges_keys_written_by_other_workers(keys_file):
+    manager.set_api_key("TEST_API_KEY", "sk-1")
+    token = manager._get_cipher().encrypt(b"other").decode()
+    with open(keys_file) as f:
+        keys = json.load(f)
+    keys["OTHER_API_KEY"] = token
+    with open(keys_file, "w") as f:
+        json.dump(keys, f)
+
+    manager.set_api_key("THIRD_API_KEY", "sk-3")
+    assert manager.get_api_key("OTHER_API_KEY") == "other"
+    assert manager.get_api_key("TEST_API_KEY") == "sk-1"
+
+def test_first_load_on_the_event_loop_is_made_in_a_thread(keys_file, monkeypatch):
+    manager.set_api_key("TEST_API_KEY", "stored")
+    monkeypatch.setattr(manager, "_loaded", False)
+    monkeypatch.setattr(manager, "_api_keys_cache", {})
+    monkeypatch.setenv("TEST_API_KEY", "from-env")
+
+    async def run():
+        before = manager.get_api_key("TEST_API_KEY")
+        await manager.ensure_loaded()
+        return before, manager.get_api_key("TEST_API_KEY")
+
+    assert asyncio.run(run()) == ("from-env", "stored")
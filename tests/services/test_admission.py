@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from src.services import admission as admission_module
+from src.services.admission import AdmissionController, LocalBuckets, PriorityLimiter
+
+def test_bucket_allows_burst_then_delays_then_sheds():
+    buckets = LocalBuckets()
+
+    async def run():
+        results = [await buckets.take("u", rate=10, burst=3, max_wait=0.25) for _ in range(6)]
+        return results
+
+    results = asyncio.run(run())
+    assert [admitted for admitted, _ in results[:3]] == [True] * 3
+    assert all(wait == 0 for _, wait in results[:3])
+    # Tokens 4 and 5 are reserved against the refill (0.1 s and 0.2 s away)
+    assert results[3][0] and results[3][1] == pytest.approx(0.1, abs=0.01)
+    assert results[4][0] and results[4][1] == pytest.approx(0.2, abs=0.01)
+    # The sixth would wait 0.3 s > max_wait and is refused without taking a token
+    admitted, retry_after = results[5]
+    assert not admitted and retry_after == pytest.approx(0.3, abs=0.01)
+
+def test_bucket_store_is_bounded():
+    buckets = LocalBuckets(max_buckets=2)
+
+    async def run():
+        for key in ("a", "b", "c"):
+            await buckets.take(key, rate=1, burst=1, max_wait=0)
+
+    asyncio.run(run())
+    assert list(buckets._buckets) == ["b", "c"]
+
+def test_limiter_serves_waiters_by_priority():
+    limiter = PriorityLimiter(limit=1, max_queue=10)
+    order = []
+
+    async def worker(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+        await asyncio.sleep(0)
+        limiter.release()
+
+    async def run():
+        await limiter.acquire(0)  # hold the only slot
+        tasks = [asyncio.create_task(worker(n, p)) for n, p in (("batch", 20), ("chat", 10), ("admin", 0))]
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["admin", "chat", "batch"]
+    assert limiter.active == 0
+
+def test_limiter_sheds_when_queue_is_full():
+    limiter = PriorityLimiter(limit=1, max_queue=1)
+
+    async def run():
+        await limiter.acquire(0)
+        waiter = asyncio.create_task(limiter.acquire(0))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as exc:
+            await limiter.acquire(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        limiter.release()
+        return exc.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert error.headers["Retry-After"] == "1"
+    assert limiter.active == 0
+
+def test_cancelled_waiters_leave_the_queue():
+    limiter = PriorityLimiter(limit=1, max_queue=2)
+
+    async def run():
+        await limiter.acquire(0)
+        for _ in range(5):  # e.g. clients that gave up waiting
+            waiter = asyncio.create_task(limiter.acquire(0))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+        assert limiter.queue_length() == 0
+        waiters = [asyncio.create_task(limiter.acquire(0)) for _ in range(2)]
+        await asyncio.sleep(0)
+        limiter.release()
+        limiter.release()
+        await asyncio.gather(*waiters)
+        limiter.release()
+
+    asyncio.run(run())
+    assert limiter.rejected == 0
+    assert limiter.active == 0
+
+def test_user_limit_returns_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(admission_module, "USER_RATE", 1.0)
+    monkeypatch.setattr(admission_module, "USER_BURST", 1.0)
+    monkeypatch.setattr(admission_module, "MAX_WAIT", 0.0)
+    controller = AdmissionController(LocalBuckets())
+
+    async def run():
+        await controller.admit_user("alice", "chat")
+        await controller.admit_user("bob", "chat")
+        with pytest.raises(HTTPException) as exc:
+            await controller.admit_user("alice", "chat")
+        return exc.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert int(error.headers["Retry-After"]) >= 1
+    assert controller.stats()["shed"] == 1
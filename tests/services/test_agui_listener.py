@@ -0,0 +1,80 @@
+import asyncio
+import json
+import pytest
+from fastapi import HTTPException
+from src.services import agui_listener
+from src.services.session_store import InMemorySessionStore
+
+@pytest.fixture(autouse=True)
+def fast_stream(monkeypatch):
+    sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, "sleep", lambda delay: sleep(0))
+    monkeypatch.setattr(agui_listener, "session_store", InMemorySessionStore(100, 60))
+    agui_listener._tool_waiters.clear()
+
+async def start(session_id):
+    await agui_listener.session_store.create(session_id, {"prompt": "q", "status": "active", "waiting_for_tool": None})
+    return agui_listener.token_generator(session_id, "q")
+
+async def read_until_tool(stream):
+    events = []
+    async for raw in stream:
+        events.append(json.loads(raw))
+        if events[-1]["type"] == "tool":
+            return events
+
+def test_stream_suspends_until_tool_result():
+    async def run():
+        stream = await start("s")
+        await read_until_tool(stream)
+        next_event = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        assert not next_event.done()
+        assert (await agui_listener.session_store.get("s"))["waiting_for_tool"] == "search_docs"
+
+        request = agui_listener.ToolResultRequest(session_id="s", tool_name="search_docs", result={"docs": []})
+        assert await agui_listener.submit_tool_result(request) == {"success": True}
+        rest = [json.loads(await next_event)] + [json.loads(e) async for e in stream]
+        assert rest[-1]["type"] == "done"
+        assert "s" not in agui_listener._tool_waiters
+        assert (await agui_listener.session_store.get("s"))["waiting_for_tool"] is None
+
+    asyncio.run(run())
+
+def test_wrong_tool_is_rejected():
+    async def run():
+        stream = await start("s")
+        await read_until_tool(stream)
+        request = agui_listener.ToolResultRequest(session_id="s", tool_name="other", result=1)
+        with pytest.raises(HTTPException) as exc:
+            await agui_listener.submit_tool_result(request)
+        assert exc.value.status_code == 400
+        await stream.aclose()
+        assert "s" not in agui_listener._tool_waiters
+
+    asyncio.run(run())
+
+def test_tool_wait_times_out(monkeypatch):
+    monkeypatch.setattr(agui_listener, "TOOL_RESULT_TIMEOUT", 0.01)
+
+    async def run():
+        stream = await start("s")
+        await read_until_tool(stream)
+        return [json.loads(e) async for e in stream]
+
+    rest = asyncio.run(run())
+    assert rest[0]["content"].startswith("No result from search_docs")
+    assert rest[-1]["type"] == "done"
+
+def test_ending_session_stops_waiting_stream():
+    async def run():
+        stream = await start("s")
+        await read_until_tool(stream)
+        next_event = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        await agui_listener.end_session("s")
+        assert json.loads(await next_event) == {"type": "done"}
+        with pytest.raises(StopAsyncIteration):
+            await anext(stream)
+
+    asyncio.run(run())
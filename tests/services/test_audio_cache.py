@@ -0,0 +1,47 @@
+
+import asyncio
+import pytest
+from src.services.audio_cache import AudioCache, audio_digest, parse_range
+
+def test_digest_is_stable_and_input_sensitive():
+    settings = {"stability": 0.5, "similarity_boost": 0.75}
+    a = audio_digest("hello", "voice", "model", settings)
+    assert a == audio_digest("hello", "voice", "model", dict(reversed(list(settings.items()))))
+    assert a != audio_digest("hello", "voice", "model", {**settings, "stability": 0.6})
+    assert a != audio_digest("hello!", "voice", "model", settings)
+
+@pytest.mark.parametrize("header,expected", [
+    (None, None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-10", (990, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=0-1,5-6", None),  # multiple ranges are served in full
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5-2", "bytes=abc-"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
+
+def test_size_cap_evicts_least_recently_used(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=250)
+
+    async def store(digest):
+        writer = cache.writer(digest)
+        writer.write(b"x" * 100)
+        writer.commit()
+        await cache.committed(writer)
+
+    async def run():
+        await store("a" * 64)
+        await store("b" * 64)
+        assert await cache.get("a" * 64) == 100  # "b" is now least recently used
+        await store("c" * 64)
+        assert await cache.get("b" * 64) is None
+        assert b"".join(cache.iter_file("c" * 64, 10, 19)) == b"x" * 10
+
+    asyncio.run(run())
+    assert cache.stats()["evictions"] == 1
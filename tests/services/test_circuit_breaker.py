@@ -0,0 +1,79 @@
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+from src.services import circuit_breaker
+from src.services.admission import rate_limited
+from src.services.circuit_breaker import CircuitBreaker, CircuitBreakers, parse_failover_chains
+
+def test_breaker_opens_on_failure_rate_and_recovers_after_probe(monkeypatch):
+    breaker = CircuitBreaker("openai", window=30, failure_rate=0.5, min_calls=4, open_seconds=10)
+    for failed in (False, True, True, True):
+        assert breaker.allow()
+        breaker.record(failed)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert breaker.allow()        # the half-open probe
+    assert not breaker.allow()    # only one at a time
+    breaker.record(False, 0.1)
+    assert breaker.state == "closed"
+
+def test_slow_calls_count_as_failures():
+    breaker = CircuitBreaker("hf", min_calls=2, failure_rate=0.5, slow_call=1.0)
+    breaker.record(False, 5.0)
+    breaker.record(False, 5.0)
+    assert breaker.state == "open"
+
+def test_open_breaker_fails_fast_with_503():
+    breakers = CircuitBreakers()
+    breaker = breakers.get("openai")
+    breaker._open(time.monotonic())
+
+    async def attempt():
+        raise AssertionError("should not be called")
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(breakers.call("openai", attempt))
+    assert exc.value.status_code == 503
+    assert "Retry-After" in exc.value.headers
+
+def test_client_errors_and_local_shedding_do_not_trip_the_breaker():
+    breakers = CircuitBreakers()
+
+    async def run(error):
+        async def attempt():
+            raise error
+        with pytest.raises(HTTPException):
+            await breakers.call("openai", attempt)
+
+    for _ in range(20):
+        asyncio.run(run(HTTPException(status_code=400, detail="bad request")))
+        asyncio.run(run(rate_limited(1, "queue full")))
+    assert breakers.get("openai").state == "closed"
+
+def test_hedged_call_takes_the_faster_attempt(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "HEDGE_MIN_SAMPLES", 1)
+    monkeypatch.setattr(circuit_breaker, "HEDGE_MIN_DELAY", 0.01)
+    breakers = CircuitBreakers(hedge_upstreams={"openai"})
+    breakers.get("openai").latency.record(0.01)
+    delays = iter([1.0, 0.0])
+    started = []
+
+    async def attempt():
+        delay = next(delays)
+        started.append(delay)
+        await asyncio.sleep(delay)
+        return delay
+
+    start = time.monotonic()
+    assert asyncio.run(breakers.call("openai", attempt)) == 0.0
+    assert time.monotonic() - start < 0.5
+    assert started == [1.0, 0.0]
+    assert breakers.hedged == 1 and breakers.hedge_wins == 1
+
+def test_parse_failover_chains():
+    chains = parse_failover_chains("openai:gpt-4o=openai:gpt-4o-mini, huggingface:org/model;bad")
+    assert chains == {"openai:gpt-4o": [("openai", "gpt-4o-mini"), ("huggingface", "org/model")]}
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import logging
+import os
+from src.services.log_pipeline import AccessLogMiddleware, LogPipeline, LogQueueHandler
+
+def read(directory, stream):
+    with open(os.path.join(directory, f"{stream}.jsonl")) as f:
+        return [json.loads(line) for line in f]
+
+def test_full_queue_drops_and_counts(tmp_path):
+    pipeline = LogPipeline(str(tmp_path), queue_size=3)
+    results = [pipeline.emit("access", {"n": i}) for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert pipeline.stats()["dropped_access"] == 2
+    assert asyncio.run(pipeline.flush()) == 3
+    assert [r["n"] for r in read(tmp_path, "access")] == [0, 1, 2]
+
+def test_access_sampling_keeps_errors_and_slow_requests(tmp_path):
+    pipeline = LogPipeline(str(tmp_path), sample_rate=0, slow_ms=500)
+    assert not pipeline.access({"status": 200, "duration_ms": 10})
+    assert pipeline.access({"status": 502, "duration_ms": 10})
+    assert pipeline.access({"status": 200, "duration_ms": 800})
+    assert pipeline.sampled_out == 1
+    asyncio.run(pipeline.flush())
+    assert [(r["status"], r["sample_rate"]) for r in read(tmp_path, "access")] == [(502, 1.0), (200, 1.0)]
+
+def test_audit_is_never_dropped(tmp_path):
+    pipeline = LogPipeline(str(tmp_path), queue_size=0)
+    assert not pipeline.emit("app", {"msg": "dropped"})
+    pipeline.audit("key.update", actor="admin", outcome="success", service="openai")
+    asyncio.run(pipeline.flush())
+    [record] = read(tmp_path, "audit")
+    assert record["action"] == "key.update" and record["outcome"] == "success"
+    assert record["service"] == "openai"
+
+def test_failed_audit_write_is_retried(tmp_path):
+    directory = tmp_path / "logs"
+    pipeline = LogPipeline(str(directory))
+    pipeline.audit("token.revoke", actor="admin", outcome="success")
+    pipeline.emit("access", {"path": "/lost"})
+    assert asyncio.run(pipeline.flush()) == 0  # The directory does not exist yet
+    assert pipeline.write_errors == 2
+    assert pipeline.stats()["dropped_access"] == 1
+    directory.mkdir()
+    assert asyncio.run(pipeline.flush()) == 1
+    assert [r["action"] for r in read(directory, "audit")] == ["token.revoke"]
+
+def test_files_are_rotated(tmp_path):
+    pipeline = LogPipeline(str(tmp_path), max_bytes=100, backups=2)
+
+    async def run():
+        for i in range(4):
+            pipeline.emit("access", {"path": "x" * 60, "n": i})
+            await pipeline.flush()
+
+    asyncio.run(run())
+    assert [r["n"] for r in read(tmp_path, "access")] == [3]
+    assert json.loads((tmp_path / "access.jsonl.1").read_text())["n"] == 2
+    assert json.loads((tmp_path / "access.jsonl.2").read_text())["n"] == 1
+    assert not (tmp_path / "access.jsonl.3").exists()
+
+def test_handler_keeps_extra_fields_and_errors(tmp_path):
+    pipeline = LogPipeline(str(tmp_path))
+    logger = logging.getLogger("test_log_pipeline")
+    handler = LogQueueHandler(pipeline)
+    logger.addHandler(handler)
+    try:
+        logger.warning("upstream %s failed", "openai", extra={"status": 503})
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("boom")
+    finally:
+        logger.removeHandler(handler)
+    records = [record for _, record in pipeline._queue]
+    assert records[0]["msg"] == "upstream openai failed"
+    assert records[0]["level"] == "WARNING" and records[0]["status"] == 503
+    assert "ZeroDivisionError" in records[1]["error"]
+
+def test_access_middleware_records_requests(tmp_path):
+    pipeline = LogPipeline(str(tmp_path), sample_rate=1)
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b"hello"})
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "POST", "path": "/auth/token", "query_string": b"token=secret",
+             "headers": [], "client": ("10.0.0.1", 1234)}
+    asyncio.run(AccessLogMiddleware(app, pipeline)(scope, None, send))
+    [(stream, record)] = pipeline._queue
+    assert stream == "access"
+    assert (record["method"], record["path"], record["status"], record["bytes_out"]) == ("POST", "/auth/token", 201, 5)
+    assert record["client"] == "10.0.0.1"
+    assert "secret" not in json.dumps(record)
+
+def test_unwritable_directory_falls_back_to_stderr(tmp_path, capsys):
+    (tmp_path / "file").write_text("")
+    pipeline = LogPipeline(str(tmp_path / "file" / "logs"))
+
+    async def run():
+        await pipeline.startup()
+        try:
+            pipeline.audit("key.delete", actor="admin", outcome="success")
+            logging.getLogger("test_log_pipeline").error("still on the console")
+            await pipeline.flush()
+        finally:
+            await pipeline.shutdown()
+
+    asyncio.run(run())
+    err = capsys.readouterr().err
+    assert "logging to stderr" in err
+    assert '"action":"key.delete"' in err
+    assert "still on the console" in err
+    assert pipeline.stats()["to_files"] == 0
+
+def test_app_records_are_echoed_when_the_write_fails(tmp_path, capsys):
+    pipeline = LogPipeline(str(tmp_path / "missing"))
+    pipeline.emit("app", {"ts": "now", "level": "ERROR", "logger": "x", "msg": "disk full"})
+    asyncio.run(pipeline.flush())
+    assert "x: disk full" in capsys.readouterr().err
+    assert pipeline.write_errors == 1
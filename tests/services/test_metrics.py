@@ -0,0 +1,116 @@
+import asyncio
+import httpx
+from fastapi import FastAPI
+from src.services import metrics
+from src.services.metrics import MetricsMiddleware, Registry
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    child = latency.labels("/a")
+    for value in (0.05, 0.1, 0.5, 2.0):
+        child.observe(value)
+
+    text = registry.render()
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{route="/a",le="1"} 3' in text
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in text
+    assert 'latency_seconds_sum{route="/a"} 2.65' in text
+    assert 'latency_seconds_count{route="/a"} 4' in text
+    assert "# TYPE latency_seconds histogram" in text
+
+def test_children_are_cached_per_label_values():
+    registry = Registry()
+    counter = registry.counter("calls_total", "Calls", ("upstream", "status"))
+    assert counter.labels("openai", "200") is counter.labels("openai", "200")
+    counter.labels("openai", "200").inc()
+    counter.labels("openai", "200").inc(2)
+    counter.labels("openai", "500").inc()
+
+    text = registry.render()
+    assert 'calls_total{upstream="openai",status="200"} 3' in text
+    assert 'calls_total{upstream="openai",status="500"} 1' in text
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.gauge("g", "G", ("name",)).labels('a"b\\c').set(1)
+    assert 'g{name="a\\"b\\\\c"} 1' in registry.render()
+
+def test_stats_are_exported_as_gauges():
+    registry = Registry()
+    registry.register_stats("cache", lambda: {"hits": 3, "ratio": 0.5, "backend": "memory", "disk": True})
+    registry.register_stats("pool", lambda: {"openai": {"idle": 2}, "huggingface": {"idle": 0}}, label="upstream")
+
+    def broken():
+        raise RuntimeError("down")
+    registry.register_stats("broken", broken)
+
+    text = registry.render()
+    assert "cache_hits 3" in text
+    assert "cache_ratio 0.5" in text
+    assert "cache_disk 1" in text
+    assert "cache_backend" not in text
+    assert text.count("# TYPE pool_idle gauge") == 1
+    assert 'pool_idle{upstream="openai"} 2' in text
+    assert 'pool_idle{upstream="huggingface"} 0' in text
+
+def test_middleware_labels_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.post("/items/{item_id}")
+    async def echo(item_id: str, body: dict):
+        return {"id": item_id}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.post("/items/1", json={"a": 1})
+            await client.post("/items/2", json={"a": 2})
+            await client.get("/missing")
+
+    asyncio.run(run())
+    text = metrics.registry.render()
+    assert 'gateway_requests_total{method="POST",route="/items/{item_id}",status="200"} 2' in text
+    assert 'gateway_request_duration_seconds_count{method="POST",route="/items/{item_id}"} 2' in text
+    assert 'gateway_requests_total{method="GET",route="unmatched",status="404"}' in text
+    assert 'gateway_request_bytes_total{method="POST",route="/items/{item_id}"} 14' in text
+
+class ChunkedBody(httpx.AsyncByteStream):
+    async def __aiter__(self):
+        yield b"x" * 4
+        yield b"x" * 6
+
+def test_upstream_hooks_record_ttfb_status_and_bytes():
+    def handler(request):
+        return httpx.Response(503, stream=ChunkedBody())
+
+    async def run():
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(handler),
+            base_url="http://upstream",
+            event_hooks=metrics.upstream_hooks("test-upstream"),
+        ) as client:
+            response = await client.post("/v1", content=b"abcd")
+            assert response.content == b"x" * 10
+
+    asyncio.run(run())
+    assert metrics.upstream_ttfb.labels("test-upstream").count == 1
+    assert metrics.upstream_duration.labels("test-upstream").count == 1
+    assert metrics.upstream_responses.labels("test-upstream", "503").value == 1
+    assert metrics.upstream_request_bytes.labels("test-upstream").value == 4
+    assert metrics.upstream_response_bytes.labels("test-upstream").value == 10
+
+def test_worker_metrics_are_merged_by_family():
+    registry_a, registry_b = Registry(), Registry()
+    for registry, count in ((registry_a, 1), (registry_b, 2)):
+        registry.counter("calls_total", "Calls", ("route",)).labels("/a").inc(count)
+        registry.gauge("in_flight", "In flight").labels().set(count)
+
+    text = metrics.merge_workers({"1": registry_a.render(), "2": registry_b.render()})
+    assert text.count("# TYPE calls_total counter") == 1
+    assert 'calls_total{worker="1",route="/a"} 1' in text
+    assert 'calls_total{worker="2",route="/a"} 2' in text
+    assert 'in_flight{worker="2"} 2' in text
+    # Samples follow their own family's header
+    assert text.index("# TYPE in_flight") < text.index('in_flight{worker="1"}')
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from src.services import deadlines
+from src.services.micro_batcher import MicroBatcher
+
+def make_send(calls, delay=0.01):
+    async def send(items):
+        calls.append(list(items))
+        await asyncio.sleep(delay)
+        return [f"out:{item}" for item in items]
+    return send
+
+def test_single_requests_are_sent_without_waiting():
+    batcher = MicroBatcher(max_size=8, max_wait=0.05)
+    calls = []
+
+    async def run():
+        results = []
+        for i in range(3):
+            started = asyncio.get_running_loop().time()
+            results.append(await batcher.submit("k", i, make_send(calls, delay=0)))
+            assert asyncio.get_running_loop().time() - started < 0.04
+            await asyncio.sleep(0.1)  # arrivals slower than max_wait
+        return results
+
+    assert asyncio.run(run()) == ["out:0", "out:1", "out:2"]
+    assert calls == [[0], [1], [2]]
+    assert batcher.stats()["unbatched"] == 3
+
+def test_bursts_are_batched_and_fanned_out():
+    batcher = MicroBatcher(max_size=4, max_wait=0.05)
+    calls = []
+
+    async def run():
+        send = make_send(calls)
+        # Warm the arrival rate, then burst
+        await batcher.submit("k", "warm", send)
+        return await asyncio.gather(*(batcher.submit("k", i, send) for i in range(8)))
+
+    results = asyncio.run(run())
+    assert results == [f"out:{i}" for i in range(8)]
+    assert calls[0] == ["warm"]
+    assert [len(c) for c in calls[1:]] == [4, 4]
+    assert batcher.stats()["open"] == 0
+
+def test_keys_are_batched_separately():
+    batcher = MicroBatcher(max_size=8, max_wait=0.02)
+    calls = []
+
+    async def run():
+        send = make_send(calls)
+        await batcher.submit("a", "warm", send)
+        await batcher.submit("b", "warm", send)
+        return await asyncio.gather(*(batcher.submit(k, k + str(i), send) for i in range(3) for k in "ab"))
+
+    asyncio.run(run())
+    assert all(len({item[0] for item in call}) == 1 for call in calls)
+
+def test_batch_and_item_errors_reach_their_callers():
+    batcher = MicroBatcher(max_size=3, max_wait=0.05)
+
+    async def send(items):
+        if "boom" in items:
+            raise RuntimeError("upstream down")
+        return [ValueError("bad") if item == "bad" else item for item in items]
+
+    async def run():
+        await batcher.submit("k", "warm", send)
+        await asyncio.sleep(0)
+        per_item = await asyncio.gather(*(batcher.submit("k", i, send) for i in ("x", "bad", "y")),
+                                        return_exceptions=True)
+        whole = await asyncio.gather(*(batcher.submit("k", i, send) for i in ("p", "boom", "q")),
+                                     return_exceptions=True)
+        return per_item, whole
+
+    per_item, whole = asyncio.run(run())
+    assert per_item[0] == "x" and isinstance(per_item[1], ValueError) and per_item[2] == "y"
+    assert isinstance(whole[1], RuntimeError)
+
+def test_cancelled_caller_does_not_cancel_the_batch():
+    batcher = MicroBatcher(max_size=2, max_wait=0.05)
+    calls = []
+
+    async def run():
+        send = make_send(calls, delay=0.02)
+        await batcher.submit("k", "warm", send)
+        first = asyncio.ensure_future(batcher.submit("k", "a", send))
+        second = asyncio.ensure_future(batcher.submit("k", "b", send))
+        third = asyncio.ensure_future(batcher.submit("k", "c", send))
+        await asyncio.sleep(0.005)
+        second.cancel()
+        return await asyncio.gather(first, third)
+
+    assert asyncio.run(run()) == ["out:a", "out:c"]
+    assert ["a", "b"] in calls
+
+def test_each_item_waits_under_its_own_deadline():
+    batcher = MicroBatcher(max_size=2, max_wait=0.05)
+    calls = []
+
+    async def send(items):
+        calls.append(list(items))
+        async with deadlines.bounded("upstream"):  # as the upstream calls are
+            await asyncio.sleep(0.2)
+        return [f"out:{item}" for item in items]
+
+    async def item(name, timeout):
+        if timeout is not None:
+            deadlines.request_deadline.set(time.monotonic() + timeout)
+        return await batcher.submit("k", name, send)
+
+    async def run():
+        await batcher.submit("k", "warm", make_send([], delay=0))
+        # The item with the short deadline opens the batch
+        return await asyncio.gather(item("short", 0.05), item("open", None), return_exceptions=True)
+
+    short, unbounded = asyncio.run(run())
+    assert calls == [["short", "open"]]
+    assert isinstance(short, deadlines.DeadlineExceeded)
+    assert unbounded == "out:open"
@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from src.services.model_router import ModelRouter, NoRoute, is_routed, load_catalog
+
+CATALOG = [
+    {"provider": "openai", "model": "small", "classes": ["chat", "fast"], "context": 16000, "cost": 0.5},
+    {"provider": "openai", "model": "large", "classes": ["chat", "quality"], "context": 128000, "cost": 10.0},
+    {"provider": "huggingface", "model": "open", "classes": ["chat", "fast"], "context": 32000, "cost": 0.2},
+]
+
+def make_router(queues=None):
+    queues = queues or {}
+    return ModelRouter(CATALOG, explore=0, queue_depth=lambda provider: queues.get(provider, 0))
+
+def observe(router, provider, model, seconds, calls=5):
+    for _ in range(calls):
+        router.target(provider, model).record(False, seconds)
+
+def test_is_routed():
+    assert is_routed("auto") and is_routed("auto:fast")
+    assert not is_routed("gpt-4o-mini") and not is_routed("automatic")
+
+def test_fastest_target_wins():
+    router = make_router()
+    observe(router, "openai", "small", 0.5)
+    observe(router, "openai", "large", 2.0)
+    observe(router, "huggingface", "open", 0.2)
+    assert router.choose("auto") == ("huggingface", "open")
+    decision = router.decisions[-1]
+    assert decision["chosen"] == "huggingface:open"
+    assert [c["target"] for c in decision["candidates"]] == ["huggingface:open", "openai:small", "openai:large"]
+
+def test_untried_targets_are_tried_first():
+    router = make_router()
+    observe(router, "openai", "small", 0.1)
+    assert router.choose("auto:fast") == ("huggingface", "open")
+
+def test_capability_class_and_constraints():
+    router = make_router()
+    observe(router, "openai", "small", 0.1)
+    observe(router, "openai", "large", 2.0)
+    observe(router, "huggingface", "open", 0.5)
+    assert router.choose("auto:quality") == ("openai", "large")
+    assert router.choose("auto", max_cost=0.3) == ("huggingface", "open")
+    assert router.choose("auto", min_context=20000) == ("huggingface", "open")
+    assert router.choose("auto", min_context=64000) == ("openai", "large")
+    assert router.decisions[-1]["excluded"] == {"openai:small": "context", "huggingface:open": "context"}
+    with pytest.raises(NoRoute):
+        router.choose("auto:quality", max_cost=1)
+    assert router.unroutable == 1
+    assert router.decisions[-1]["chosen"] is None
+
+def test_queue_depth_slows_a_target():
+    queues = {"huggingface": 0}
+    router = make_router(queues)
+    observe(router, "openai", "small", 0.3)
+    observe(router, "huggingface", "open", 0.2)
+    assert router.choose("auto:fast")[0] == "huggingface"
+    queues["huggingface"] = 16  # Doubles its expected latency
+    assert router.choose("auto:fast")[0] == "openai"
+
+def test_unavailable_and_failing_targets_are_skipped():
+    router = make_router()
+    observe(router, "openai", "small", 0.1)
+    observe(router, "huggingface", "open", 0.5)
+    assert router.choose("auto:fast", available=lambda provider: provider != "openai") == ("huggingface", "open")
+    for _ in range(10):
+        router.target("openai", "small").record(True)
+    assert router.choose("auto:fast") == ("huggingface", "open")
+    assert router.decisions[-1]["excluded"] == {"openai:small": "error rate"}
+
+def test_track_records_latency_and_upstream_failures():
+    router = make_router()
+
+    async def call(error=None):
+        async with router.track("openai", "small"):
+            assert router.target("openai", "small").in_flight == 1
+            await asyncio.sleep(0.01)
+            if error:
+                raise error
+
+    async def run():
+        await call()
+        for error in (HTTPException(status_code=503), HTTPException(status_code=400)):
+            with pytest.raises(HTTPException):
+                await call(error)
+
+    asyncio.run(run())
+    stats = router.stats()["openai:small"]
+    assert stats["calls"] == 2  # The 400 is the client's fault: no outcome
+    assert stats["failures"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["latency_ms"] >= 10
+    assert 0 < stats["error_rate"] <= 0.1
+
+def test_invalid_catalog_falls_back_to_default():
+    assert load_catalog("not json")[0]["model"] == "gpt-4o-mini"
+    assert load_catalog('[{"provider": "openai", "model": "m"}]') == [
+        {"provider": "openai", "model": "m", "classes": []}
+    ]
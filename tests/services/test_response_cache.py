@@ -0,0 +1,43 @@
+
+import asyncio
+import time
+from src.services.response_cache import ResponseCache, cache_key
+
+def test_cache_key_is_canonical():
+    a = cache_key("openai", "/v1/chat/completions", {"model": "m", "temperature": 0, "user": "u1"})
+    b = cache_key("openai", "/v1/chat/completions", {"temperature": 0, "model": "m", "user": "u2"})
+    c = cache_key("openai", "/v1/chat/completions", {"model": "m", "temperature": 0.5})
+    assert a == b
+    assert a != c
+
+def test_lru_eviction_and_counters():
+    cache = ResponseCache(max_entries=2, ttl=60)
+
+    async def run():
+        await cache.set("a", {"v": 1})
+        await cache.set("b", {"v": 2})
+        assert await cache.get("a") == {"v": 1}  # "b" is now least recently used
+        await cache.set("c", {"v": 3})
+        assert await cache.get("b") is None
+        assert await cache.get("c") == {"v": 3}
+
+    asyncio.run(run())
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+
+def test_ttl_expiry():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    asyncio.run(cache.set("a", {"v": 1}))
+    cache._entries["a"] = (time.time() - 1, {"v": 1})
+    assert asyncio.run(cache.get("a")) is None
+    assert cache.stats()["expirations"] == 1
+
+def test_disk_tier_survives_restart(tmp_path):
+    first = ResponseCache(max_entries=10, ttl=60, disk_dir=str(tmp_path))
+    asyncio.run(first.set("abc", {"completion": "hi"}))
+
+    second = ResponseCache(max_entries=10, ttl=60, disk_dir=str(tmp_path))
+    assert asyncio.run(second.get("abc")) == {"completion": "hi"}
+    assert second.stats()["disk_hits"] == 1
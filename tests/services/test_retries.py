@@ -0,0 +1,196 @@
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+from src.services import deadlines
+from src.services.admission import AdmissionController, LocalBuckets, rate_limited
+from src.services.circuit_breaker import CircuitOpen
+from src.services.deadlines import DeadlineExceeded, DeadlineMiddleware, parse_retry_after
+from src.services.retries import RetryBudget, UpstreamRetries
+
+def flaky(failures, error=None):
+    """An attempt that fails `failures` times, then succeeds"""
+    calls = []
+
+    async def attempt():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise error or HTTPException(status_code=503, detail="blip")
+        return "ok"
+    return attempt, calls
+
+def test_transient_failures_are_retried():
+    retries = UpstreamRetries(max_attempts=3)
+    attempt, calls = flaky(2)
+    assert asyncio.run(retries.call("up", attempt)) == "ok"
+    assert len(calls) == 3
+    assert retries.stats()["up"]["retries"] == 2
+    assert retries.stats()["up"]["recovered"] == 1
+
+def test_attempts_are_bounded():
+    retries = UpstreamRetries(max_attempts=3)
+    attempt, calls = flaky(5)
+    with pytest.raises(HTTPException):
+        asyncio.run(retries.call("up", attempt))
+    assert len(calls) == 3
+
+@pytest.mark.parametrize("error", [
+    HTTPException(status_code=400, detail="bad request"),
+    rate_limited(1, "local rate limit"),
+    CircuitOpen(status_code=503, detail="circuit open"),
+    DeadlineExceeded(),
+])
+def test_client_and_local_errors_are_not_retried(error):
+    retries = UpstreamRetries()
+    attempt, calls = flaky(1, error)
+    with pytest.raises(HTTPException):
+        asyncio.run(retries.call("up", attempt))
+    assert len(calls) == 1
+
+def test_retry_after_is_honoured_within_the_deadline():
+    retries = UpstreamRetries(min_attempt=0.05)
+    attempt, calls = flaky(1, HTTPException(status_code=429, detail="slow down", headers={"Retry-After": "0.2"}))
+
+    async def run(timeout):
+        deadlines.shorten(timeout)
+        return await retries.call("up", attempt)
+
+    assert asyncio.run(run(1.0)) == "ok"
+    assert calls[1] - calls[0] >= 0.2
+    # A Retry-After past the deadline fails right away
+    calls.clear()
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(run(0.1))
+    assert exc.value.status_code == 429
+    assert len(calls) == 1
+    assert retries.stats()["up"]["no_time"] == 1
+
+def test_expired_deadline_fails_without_calling():
+    retries = UpstreamRetries()
+    attempt, calls = flaky(0)
+
+    async def run():
+        deadlines.shorten(0)
+        return await retries.call("up", attempt)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert calls == []
+
+def test_retry_budget_limits_retries():
+    retries = UpstreamRetries(max_attempts=3)
+    retries._budgets["up"] = RetryBudget(ratio=0.5, per_second=0, max_tokens=2)
+    retries._counts["up"] = {"calls": 0, "retries": 0, "recovered": 0, "no_time": 0, "no_budget": 0}
+    attempts = []
+
+    async def run():
+        for _ in range(4):
+            attempt, calls = flaky(10)
+            with pytest.raises(HTTPException):
+                await retries.call("up", attempt)
+            attempts.append(len(calls))
+
+    asyncio.run(run())
+    # 2 tokens to start (spent by the first call), then 0.5 per call: one retry every other call
+    assert attempts == [3, 1, 2, 1]
+    assert retries.stats()["up"]["no_budget"] == 3
+
+def test_shorten_only_brings_the_deadline_forward():
+    async def run():
+        deadlines.shorten(10)
+        deadlines.shorten(20)
+        first = deadlines.remaining()
+        deadlines.shorten(1)
+        return first, deadlines.remaining()
+
+    first, second = asyncio.run(run())
+    assert 9 < first <= 10
+    assert 0 < second <= 1
+
+def test_default_budget_applies_without_a_client_deadline():
+    async def run():
+        assert deadlines.remaining() is None
+        with deadlines.budget(5):
+            left = deadlines.remaining()
+            assert not deadlines.client_deadline_passed()
+        return left, deadlines.remaining()
+
+    left, after = asyncio.run(run())
+    assert 4 < left <= 5
+    assert after is None
+
+def test_middleware_reads_timeout_and_deadline_headers():
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(deadlines.remaining())
+
+    middleware = DeadlineMiddleware(app)
+
+    async def run():
+        for headers in ([(b"x-request-timeout", b"2.5")],
+                        [(b"x-request-deadline", str(time.time() + 4).encode())],
+                        [(b"x-request-timeout", b"soon")],
+                        []):
+            await middleware({"type": "http", "headers": headers}, None, None)
+
+    asyncio.run(run())
+    assert 2 < seen[0] <= 2.5
+    assert 3 < seen[1] <= 4
+    assert seen[2:] == [None, None]
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    http_date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 60))
+    assert 55 < parse_retry_after(http_date) <= 60
+
+def test_upstream_queue_wait_is_bounded_by_the_deadline():
+    controller = AdmissionController(LocalBuckets(), max_concurrent=1)
+
+    async def run():
+        await controller.acquire("up", "key")
+        deadlines.shorten(0.05)
+        with pytest.raises(DeadlineExceeded):
+            await controller.acquire("up", "key")
+        return controller.limiter("up").stats()
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 1
+    assert stats["queued_now"] <= 1  # the timed-out waiter is skipped on release
+
+def test_bounded_cuts_a_slow_call_at_the_deadline():
+    async def run(timeout, seconds):
+        deadlines.shorten(timeout)
+        async with deadlines.bounded("upstream"):
+            await asyncio.sleep(seconds)
+        return "done"
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run(0.05, 10))
+    assert time.monotonic() - start < 1
+    assert asyncio.run(run(1, 0)) == "done"
+
+def test_bounded_iter_cuts_a_slow_drip_stream():
+    async def drip():
+        for i in range(100):
+            await asyncio.sleep(0.01)  # every read well within any per-read timeout
+            yield i
+
+    async def run(timeout):
+        deadlines.shorten(timeout)
+        received = []
+        with pytest.raises(DeadlineExceeded):
+            async for chunk in deadlines.bounded_iter(drip(), "upstream"):
+                received.append(chunk)
+        return received
+
+    received = asyncio.run(run(0.1))
+    assert 0 < len(received) < 100
+
+    async def unbounded():
+        return [chunk async for chunk in deadlines.bounded_iter(drip(), "upstream")]
+
+    assert len(asyncio.run(unbounded())) == 100
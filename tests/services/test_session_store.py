@@ -0,0 +1,100 @@
+import asyncio
+import time
+from src.services.session_store import InMemorySessionStore, LocalKVBackend, SharedSessionStore
+
+def test_max_size_evicts_least_recently_used():
+    store = InMemorySessionStore(max_sessions=2, idle_ttl=60)
+
+    async def run():
+        await store.create("a", {"n": 1})
+        await store.create("b", {"n": 2})
+        await store.get("a")
+        await store.create("c", {"n": 3})
+        return [await store.get(s) for s in ("a", "b", "c")]
+
+    assert asyncio.run(run()) == [{"n": 1}, None, {"n": 3}]
+    assert store.evictions == 1
+
+def test_sweep_expires_idle_sessions_and_keeps_touched_ones():
+    store = InMemorySessionStore(max_sessions=10, idle_ttl=10)
+
+    async def run():
+        await store.create("idle", {})
+        await store.create("busy", {})
+        store._entries["busy"].expires_at = time.monotonic() + 30  # as if touched later
+        assert store.sweep(time.monotonic() + 15) == 1
+        assert store.sweep(time.monotonic() + 35) == 1
+
+    asyncio.run(run())
+    assert len(store) == 0
+    assert len(store._deadlines) == 0
+
+def test_pinned_ttl_is_not_extended_by_access():
+    store = InMemorySessionStore(max_sessions=10, idle_ttl=60)
+
+    async def run():
+        await store.create("s", {"status": "active"})
+        assert await store.update("s", {"status": "completed"}, ttl=5)
+        assert (await store.get("s"))["status"] == "completed"
+        return store.sweep(time.monotonic() + 6)
+
+    assert asyncio.run(run()) == 1
+    assert len(store) == 0
+
+def test_update_missing_session():
+    store = InMemorySessionStore(max_sessions=10, idle_ttl=60)
+    assert asyncio.run(store.update("nope", {"x": 1})) is False
+
+def test_shared_store_update_keeps_the_pinned_ttl():
+    backend = LocalKVBackend()
+    store = SharedSessionStore(backend, idle_ttl=1800)
+
+    async def run():
+        await store.create("s", {"waiting_for_tool": "call-1"})
+        assert await store.update("s", {"status": "completed"}, ttl=60)
+        assert await store.update("s", {"waiting_for_tool": None})
+        await store.get("s")
+        return backend._expiry[store._key("s")] - time.monotonic()
+
+    assert 55 < asyncio.run(run()) <= 60
+
+def test_pinned_session_expiring_mid_update_is_not_kept_forever():
+    class ExpiresAfterTTLCheck(LocalKVBackend):
+        async def ttl(self, key):
+            left = await super().ttl(key)
+            await self.delete(key)  # the TTL runs out right after it is read
+            return left
+
+    backend = ExpiresAfterTTLCheck()
+    store = SharedSessionStore(backend, idle_ttl=1800)
+
+    async def run():
+        await store.create("s", {"status": "active"})
+        assert await store.update("s", {"status": "completed"}, ttl=60)
+        await store.update("s", {"waiting_for_tool": None})
+        return backend._expiry[store._key("s")] - time.monotonic()
+
+    assert 0 < asyncio.run(run()) <= 60
+
+def test_shared_store_round_trip_and_expiry(monkeypatch):
+    backend = LocalKVBackend()
+    store = SharedSessionStore(backend, idle_ttl=60)
+    other_worker = SharedSessionStore(backend, idle_ttl=60)
+
+    async def run():
+        await store.create("s", {"prompt": "hi", "waiting_for_tool": None})
+        assert await other_worker.update("s", {"last_tool_result": {"result": [1, 2]}})
+        assert await store.get("s") == {
+            "prompt": "hi",
+            "waiting_for_tool": None,
+            "last_tool_result": {"result": [1, 2]},
+        }
+        assert await store.update("s", {"status": "completed"}, ttl=5)
+        assert "__pinned" not in await store.get("s")
+
+        now = time.monotonic()
+        monkeypatch.setattr(time, "monotonic", lambda: now + 6)
+        assert await store.get("s") is None
+        assert await store.update("s", {"status": "active"}) is False
+
+    asyncio.run(run())
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import tempfile
+import pytest
+from src.services.session_store import SharedSessionStore
+from src.services.shared_state import SharedBuckets, SharedKV, SharedStateClient, StateBroker
+
+def run_with_broker(scenario):
+    """Run scenario(path) against a broker listening on a temporary socket"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "state.sock")
+            broker = StateBroker(path)
+            serving = asyncio.create_task(broker.serve_forever())
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+            try:
+                return await scenario(path)
+            finally:
+                serving.cancel()
+    return asyncio.run(run())
+
+def test_workers_share_sessions():
+    async def scenario(path):
+        first, second = SharedStateClient(path), SharedStateClient(path)
+        store_a = SharedSessionStore(SharedKV(first), idle_ttl=60)
+        store_b = SharedSessionStore(SharedKV(second), idle_ttl=60)
+        await store_a.create("s1", {"status": "active"})
+        assert await store_b.update("s1", {"status": "completed"})
+        session = await store_a.get("s1")
+        await store_b.delete("s1")
+        missing = await store_a.get("s1")
+        await first.shutdown()
+        await second.shutdown()
+        return session, missing
+
+    session, missing = run_with_broker(scenario)
+    assert session == {"status": "completed"}
+    assert missing is None
+
+def test_workers_share_token_buckets():
+    async def scenario(path):
+        buckets = [SharedBuckets(SharedStateClient(path)) for _ in range(2)]
+        results = [await buckets[i % 2].take("user:u", 1, 3, 0) for i in range(4)]
+        for b in buckets:
+            await b.client.shutdown()
+        return results
+
+    results = run_with_broker(scenario)
+    assert [admitted for admitted, _ in results] == [True, True, True, False]
+    assert results[3][1] == pytest.approx(1.0, abs=0.05)
+
+def test_publish_reaches_other_workers_only():
+    async def scenario(path):
+        publisher, subscriber = SharedStateClient(path), SharedStateClient(path)
+        received = {"publisher": [], "subscriber": []}
+
+        async def on_publisher(message):
+            received["publisher"].append(message)
+
+        async def on_subscriber(message):
+            received["subscriber"].append(message)
+
+        await publisher.subscribe("events", on_publisher)
+        await subscriber.subscribe("events", on_subscriber)
+        await publisher.startup()
+        await subscriber.startup()
+        delivered = await publisher.publish("events", {"n": 1})
+        await asyncio.sleep(0.05)
+        await publisher.shutdown()
+        await subscriber.shutdown()
+        return delivered, received
+
+    delivered, received = run_with_broker(scenario)
+    assert delivered == 1
+    assert received == {"publisher": [], "subscriber": [{"n": 1}]}
+
+def test_snapshots_expire():
+    async def scenario(path):
+        client = SharedStateClient(path)
+        await client.put_snapshot("metrics:1", "a 1", ttl=60)
+        await client.put_snapshot("metrics:2", "a 2", ttl=0.05)
+        await asyncio.sleep(0.1)
+        snapshots = await client.snapshots()
+        await client.shutdown()
+        return snapshots
+
+    assert run_with_broker(scenario) == {"metrics:1": "a 1"}
+
+def test_broker_errors_are_raised_to_the_caller():
+    async def scenario(path):
+        client = SharedStateClient(path)
+        try:
+            with pytest.raises(RuntimeError, match="Unknown operation"):
+                await client.call("flushall")
+            # The connection is still usable afterwards
+            return await client.call("expire", "missing", 1)
+        finally:
+            await client.shutdown()
+
+    assert run_with_broker(scenario) is False
+
+def test_disabled_client_publishes_nothing():
+    client = SharedStateClient(None)
+    assert not client.enabled
+    assert asyncio.run(client.publish("events", {})) == 0
+    with pytest.raises(RuntimeError):
+        asyncio.run(client.call("hgetall", "k"))
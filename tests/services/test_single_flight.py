@@ -0,0 +1,78 @@
+
+import asyncio
+import pytest
+import time
+from src.services import deadlines
+from src.services.single_flight import SingleFlight
+
+def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"completion": "hi"}
+
+    async def run():
+        return await asyncio.gather(*(flight.do("k", upstream) for _ in range(10)))
+
+    results = asyncio.run(run())
+    assert calls == 1
+    assert all(r == {"completion": "hi"} for r in results)
+    assert flight.stats() == {"in_flight": 0, "calls": 1, "coalesced": 9}
+
+def test_errors_propagate_to_every_waiter():
+    flight = SingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(
+            flight.do("k", upstream), flight.do("k", upstream), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+
+def test_cancelled_waiter_does_not_cancel_others():
+    flight = SingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("k", upstream))
+        second = asyncio.ensure_future(flight.do("k", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "done"
+
+def test_each_caller_waits_under_its_own_deadline():
+    flight = SingleFlight()
+
+    async def upstream():
+        async with deadlines.bounded("upstream"):  # as the upstream calls are
+            await asyncio.sleep(0.2)
+        return "done"
+
+    async def caller(timeout):
+        if timeout is not None:
+            deadlines.request_deadline.set(time.monotonic() + timeout)
+        return await flight.do("k", upstream)
+
+    async def run():
+        # The caller with the short deadline starts the shared call
+        return await asyncio.gather(caller(0.05), caller(None), return_exceptions=True)
+
+    impatient, patient = asyncio.run(run())
+    assert isinstance(impatient, deadlines.DeadlineExceeded)
+    assert patient == "done"
@@ -0,0 +1,119 @@
+import asyncio
+from src.services.sse_replay import ReplayStream, StreamRegistry
+
+async def counter(n, produced):
+    for i in range(n):
+        produced.append(i)
+        yield f"e{i}"
+
+async def take(events, count):
+    return [await anext(events) for _ in range(count)]
+
+def test_reconnect_resumes_without_regenerating():
+    produced = []
+
+    async def run():
+        registry = StreamRegistry(max_streams=10, resume_window=60)
+        stream = await registry.open("s", counter(5, produced))
+        first = registry.connect("s", stream)
+        got = await take(first, 2)
+        await first.aclose()  # client drops after event 2
+
+        second = registry.connect("s", stream, cursor=2)
+        rest = [e async for e in second]
+        return got + rest
+
+    events = asyncio.run(run())
+    assert [e["id"] for e in events] == ["1", "2", "3", "4", "5"]
+    assert [e["data"] for e in events] == ["e0", "e1", "e2", "e3", "e4"]
+    assert produced == [0, 1, 2, 3, 4]
+
+def test_disconnect_does_not_cancel_generator_step():
+    gate = asyncio.Event
+
+    async def run():
+        release = gate()
+
+        async def slow():
+            yield "a"
+            await release.wait()
+            yield "b"
+
+        stream = ReplayStream(slow(), 10, 1024)
+        conn = stream.events()
+        assert (await anext(conn))["data"] == "a"
+        waiting = asyncio.ensure_future(anext(conn))
+        await asyncio.sleep(0)
+        waiting.cancel()  # connection dropped mid-step
+        await asyncio.gather(waiting, return_exceptions=True)
+
+        release.set()
+        return [e async for e in stream.events(cursor=1)]
+
+    assert [e["data"] for e in asyncio.run(run())] == ["b"]
+
+def test_buffer_is_capped_and_replays_oldest_left():
+    stream = ReplayStream(None, max_events=3, max_bytes=1024)
+    for i in range(5):
+        stream._append(f"e{i}")
+    assert [event_id for event_id, _ in stream.after(0)] == [3, 4, 5]
+    assert [event_id for event_id, _ in stream.after(4)] == [5]
+
+    stream = ReplayStream(None, max_events=100, max_bytes=5)
+    for i in range(5):
+        stream._append("abc")
+    assert len(stream.after(0)) == 1
+
+def test_release_stops_generator_and_sends_final_event():
+    produced = []
+
+    async def run():
+        registry = StreamRegistry(max_streams=10, resume_window=60)
+        stream = await registry.open("s", counter(100, produced))
+        conn = registry.connect("s", stream)
+        await take(conn, 1)
+        await registry.release("s", final_event="done")
+        rest = [e["data"] async for e in conn]
+        return rest, len(registry)
+
+    rest, remaining = asyncio.run(run())
+    assert rest[-1] == "done"
+    assert remaining == 0
+    assert len(produced) < 100
+
+def test_abandoned_stream_is_released_after_resume_window():
+    async def run():
+        registry = StreamRegistry(max_streams=10, resume_window=0.01)
+        stream = await registry.open("s", counter(100, []))
+        conn = registry.connect("s", stream)
+        await take(conn, 1)
+        await conn.aclose()
+        assert len(registry) == 1
+        await asyncio.sleep(0.05)
+        return len(registry), stream.finished
+
+    assert asyncio.run(run()) == (0, True)
+
+def test_registry_evicts_oldest_stream():
+    async def run():
+        registry = StreamRegistry(max_streams=2, resume_window=60)
+        first = await registry.open("a", counter(3, []))
+        await registry.open("b", counter(3, []))
+        await registry.open("c", counter(3, []))
+        return registry.get("a"), first.finished, registry.evictions
+
+    assert asyncio.run(run()) == (None, True, 1)
+
+def test_one_pump_task_per_stream():
+    async def run():
+        stream = ReplayStream(counter(50, []), 100, 4096)
+        conn = stream.events()
+        await anext(conn)
+        pump, tasks = stream._pump, len(asyncio.all_tasks())
+        rest = [e async for e in conn]
+        return pump, tasks, stream._pump, len(rest)
+
+    first, tasks, last, count = asyncio.run(run())
+    assert first is last
+    assert tasks == 2  # run() and the pump
+    assert count == 49
@@ -0,0 +1,53 @@
+import asyncio
+import sys
+import pytest
+from src.services.startup import StartupProfile, import_costs
+
+def test_steps_are_timed_and_prewarm_failures_reported():
+    profile = StartupProfile("lazy")
+
+    async def ok():
+        return 1
+
+    async def broken():
+        raise OSError("no network")
+
+    async def run():
+        assert await profile.step("init", "ok", ok) == 1
+        profile.mark_ready()
+        profile.prewarm_in_background({"broken": broken, "ok": ok})
+        await profile.wait_for_prewarm()
+        with pytest.raises(OSError):
+            await profile.step("init", "broken", broken)
+
+    asyncio.run(run())
+    report = profile.report()
+    assert report["ready"] and report["prewarm"] == "done"
+    assert [(p["kind"], p["name"], "error" in p) for p in report["phases"]] == [
+        ("init", "ok", False),
+        ("prewarm", "broken", True),
+        ("prewarm", "ok", False),
+        ("init", "broken", True),
+    ]
+    assert set(report["totals_ms"]) == {"init", "prewarm"}
+
+def test_only_first_imports_are_timed():
+    profile = StartupProfile()
+    profile.load("json")
+    assert profile.phases == []
+    sys.modules.pop("colorsys", None)
+    assert profile.load("colorsys").rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    profile.load("colorsys")
+    assert [(p["kind"], p["name"]) for p in profile.phases] == [("import", "colorsys")]
+
+def test_stopping_is_not_ready():
+    profile = StartupProfile()
+    profile.mark_ready()
+    asyncio.run(profile.mark_stopping())
+    assert not profile.ready and profile.stopping
+
+def test_import_costs_lists_direct_imports():
+    costs = import_costs("json", top=5)
+    assert costs["module"] == "json" and costs["ms"] > 0
+    assert "json.decoder" in [c["module"] for c in costs["imports"]]
+    assert costs["imports"] == sorted(costs["imports"], key=lambda c: c["ms"], reverse=True)
@@ -0,0 +1,37 @@
+import asyncio
+from src.services import token_counter as tc
+from src.services.token_counter import TokenCounter, estimate_tokens, tokenizer_family
+
+def test_model_families():
+    assert tokenizer_family("gpt-4o-mini") == "o200k_base"
+    assert tokenizer_family("gpt-4-turbo") == "cl100k_base"
+    assert tokenizer_family("gpt-3.5-turbo") == "cl100k_base"
+    assert tokenizer_family("mistralai/Mistral-7B-Instruct-v0.2") == "mistralai/Mistral-7B-Instruct-v0.2"
+
+def test_estimate_counts_words_and_symbols():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("Hello, world!") == 2 * 4 // 3 + 2
+    # Characters are not tokens
+    assert estimate_tokens("a" * 400) == 1
+
+def test_encoders_are_loaded_once_per_family(tmp_path, monkeypatch):
+    counter = TokenCounter(str(tmp_path), download=False)
+    loads = []
+
+    def load(family):
+        loads.append(family)
+        return lambda text: len(text.split())
+
+    monkeypatch.setattr(counter, "_load", load)
+    assert counter.count("gpt-4o", "one two three") == (3, True)
+    assert counter.count("gpt-4o-mini", "one two") == (2, True)
+    assert loads == ["o200k_base"]
+
+def test_usage_is_flagged_when_estimated(tmp_path, monkeypatch):
+    counter = TokenCounter(str(tmp_path), download=False)
+    monkeypatch.setattr(counter, "_load", lambda family: None)
+    # Long texts are counted in a worker thread, with the same result
+    monkeypatch.setattr(tc, "INLINE_CHARS", 10)
+    usage = asyncio.run(counter.usage("org/model", "word " * 30, "done"))
+    assert usage == {"prompt_tokens": 40, "completion_tokens": 1, "total_tokens": 41, "estimated": True}
+    assert counter.stats() == {"families": {"org/model": False}, "exact": 0, "estimated": 2}
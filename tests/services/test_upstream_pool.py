@@ -0,0 +1,74 @@
+import asyncio
+import httpx
+import pytest
+from src.services import upstream_pool
+
+@pytest.fixture(autouse=True)
+def clients(monkeypatch):
+    monkeypatch.setattr(upstream_pool, "_clients", {})
+    monkeypatch.setattr(upstream_pool, "HTTP2_ENABLED", False)
+    yield
+    asyncio.run(upstream_pool.shutdown())
+
+async def serve(release):
+    """A keep-alive HTTP/1.1 server answering every request once `release` is set"""
+    async def handle(reader, writer):
+        try:
+            while await reader.readuntil(b"\r\n\r\n"):
+                await release.wait()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+def test_client_is_reused_until_closed(monkeypatch):
+    monkeypatch.setenv("UPSTREAM_OPENAI_MAX_CONNECTIONS", "4")
+    client = upstream_pool.get_client("openai")
+    assert upstream_pool.get_client("openai") is client
+    stats = upstream_pool.pool_stats()["openai"]
+    assert (stats["max_connections"], stats["max_keepalive_connections"]) == (4, 4)
+
+    asyncio.run(client.aclose())
+    assert upstream_pool.get_client("openai") is not client
+
+def test_pool_stats_count_idle_busy_and_waiting(monkeypatch):
+    monkeypatch.setenv("UPSTREAM_OPENAI_MAX_CONNECTIONS", "1")
+
+    async def run():
+        release = asyncio.Event()
+        server, url = await serve(release)
+        monkeypatch.setitem(upstream_pool.UPSTREAMS, "openai", url)
+        client = upstream_pool.get_client("openai")
+        try:
+            calls = [asyncio.create_task(client.get("/")) for _ in range(2)]
+            await asyncio.sleep(0.1)
+            busy = upstream_pool.pool_stats()["openai"]
+            release.set()
+            await asyncio.gather(*calls)
+            return busy, upstream_pool.pool_stats()["openai"]
+        finally:
+            await upstream_pool.shutdown()
+            server.close()
+            await server.wait_closed()
+
+    busy, done = asyncio.run(run())
+    assert busy["observed"]
+    assert (busy["connections"], busy["in_use"], busy["waiting"]) == (1, 1, 1)
+    assert (done["connections"], done["idle"], done["in_use"], done["waiting"]) == (1, 1, 0, 0)
+
+def test_pool_stats_fall_back_without_an_httpcore_pool(monkeypatch):
+    upstream_pool._clients["openai"] = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: httpx.Response(200)))
+    upstream_pool.get_client("huggingface")
+    stats = upstream_pool.pool_stats()
+    assert not stats["openai"]["observed"] and stats["openai"]["connections"] == 0
+    assert stats["huggingface"]["observed"]
+
+    monkeypatch.setattr(upstream_pool, "_pool_of", lambda client: object())  # changed internals
+    stats = upstream_pool.pool_stats()["huggingface"]
+    assert not stats["observed"]
+    assert stats["connections"] == stats["waiting"] == 0
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import pytest
+from src.services.usage_ledger import LedgerUnavailable, UsageLedger
+
+HOUR = 3600
+T0 = 1_700_000_000 // 86400 * 86400  # a UTC midnight
+
+def make_ledger(tmp_path, **options):
+    ledger = UsageLedger(str(tmp_path), **options)
+    os.makedirs(ledger.raw_dir)
+    os.makedirs(ledger.rollup_dir)
+    return ledger
+
+def test_records_are_buffered_until_flushed(tmp_path):
+    ledger = make_ledger(tmp_path)
+
+    async def run():
+        ledger.record("alice", "gpt-4o-mini", 10, 5, now=T0 + 10)
+        unflushed = await ledger.query(T0, T0 + HOUR, granularity="total")
+        files_before = os.listdir(ledger.raw_dir)
+        written = await ledger.flush()
+        return unflushed, files_before, written, await ledger.query(T0, T0 + HOUR, granularity="total")
+
+    unflushed, files_before, written, flushed = asyncio.run(run())
+    assert files_before == []
+    assert written == 1
+    # Buffered records already count, and are not counted twice once written
+    assert unflushed == flushed
+    assert flushed == [{
+        "period_start": T0, "user": "alice", "model": "gpt-4o-mini",
+        "requests": 1, "prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15,
+        "characters": 0,
+    }]
+
+def test_compaction_keeps_totals_and_removes_raw_segments(tmp_path):
+    ledger = make_ledger(tmp_path)
+
+    async def run():
+        for i in range(3):
+            ledger.record("alice", "m", 10, 1, now=T0 + i * HOUR)
+            ledger.record("bob", "m", 1, 1, now=T0 + i * HOUR)
+        await ledger.flush()
+        before = await ledger.query(T0, T0 + 3 * HOUR, granularity="hour")
+        compacted = await ledger.compact(now=T0 + 2 * HOUR + 1)
+        # A late record for a compacted hour is folded in by the next compaction
+        ledger.record("alice", "m", 10, 1, now=T0 + 5)
+        await ledger.flush()
+        await ledger.compact(now=T0 + 2 * HOUR + 1)
+        return before, compacted, await ledger.query(T0, T0 + 3 * HOUR, granularity="hour")
+
+    before, compacted, after = asyncio.run(run())
+    assert compacted == 2  # the current hour stays raw
+    assert sorted(os.listdir(ledger.rollup_dir)) == [f"{T0 // HOUR}.json", f"{T0 // HOUR + 1}.json"]
+    assert len(os.listdir(ledger.raw_dir)) == 1
+    first_hour_alice = [r for r in after if r["user"] == "alice" and r["period_start"] == T0][0]
+    assert first_hour_alice["requests"] == 2 and first_hour_alice["prompt_tokens"] == 20
+    assert [r for r in after if r["period_start"] != T0] == [r for r in before if r["period_start"] != T0]
+
+def test_query_filters_user_and_window_by_day(tmp_path):
+    ledger = make_ledger(tmp_path)
+
+    async def run():
+        ledger.record("alice", "a", 1, 2, now=T0 + HOUR)
+        ledger.record("alice", "b", 3, 4, now=T0 + 2 * HOUR)
+        ledger.record("alice", "a", 5, 6, now=T0 + 86400 + HOUR)
+        ledger.record("bob", "a", 100, 100, now=T0 + HOUR)
+        ledger.record("alice", "a", 100, 100, now=T0 - HOUR)  # before the window
+        await ledger.flush()
+        await ledger.compact(now=T0 + 86400 + 1)
+        return await ledger.query(T0, T0 + 2 * 86400, user="alice", granularity="day")
+
+    rows = asyncio.run(run())
+    assert [(r["period_start"], r["model"], r["requests"], r["total_tokens"]) for r in rows] == [
+        (T0, "a", 1, 3),
+        (T0, "b", 1, 7),
+        (T0 + 86400, "a", 1, 11),
+    ]
+
+def test_flush_size_wakes_the_writer(tmp_path):
+    ledger = UsageLedger(str(tmp_path), flush_size=2, flush_interval=60)
+
+    async def run():
+        await ledger.startup()
+        ledger.record("alice", "m", 1, 1)
+        ledger.record("alice", "m", 1, 1)
+        await asyncio.sleep(0.1)
+        flushed = ledger.stats()["flushed"]
+        await ledger.shutdown()
+        return flushed
+
+    assert asyncio.run(run()) == 2
+
+def test_unknown_granularity_is_rejected(tmp_path):
+    ledger = make_ledger(tmp_path)
+    with pytest.raises(ValueError):
+        asyncio.run(ledger.query(T0, T0 + HOUR, granularity="week"))
+
+def test_characters_are_kept_out_of_token_totals(tmp_path):
+    ledger = make_ledger(tmp_path)
+    # A segment written before characters were counted
+    with open(os.path.join(ledger.raw_dir, f"{T0 // HOUR}.1.jsonl"), "w") as f:
+        f.write(f'[{T0 + 1}, "alice", "gpt-4o-mini", 10, 5]\n')
+
+    async def run():
+        ledger.record("alice", "eleven_monolingual_v1", 0, 0, now=T0 + 20, characters=120)
+        await ledger.flush()
+        await ledger.compact(now=T0 + 2 * HOUR)
+        return await ledger.query(T0, T0 + HOUR, granularity="total")
+
+    rows = {row["model"]: row for row in asyncio.run(run())}
+    assert rows["eleven_monolingual_v1"]["characters"] == 120
+    assert rows["eleven_monolingual_v1"]["total_tokens"] == 0
+    assert rows["gpt-4o-mini"]["total_tokens"] == 15 and rows["gpt-4o-mini"]["characters"] == 0
+
+def test_unwritable_directory_disables_the_ledger(tmp_path):
+    (tmp_path / "file").write_text("")
+    ledger = UsageLedger(str(tmp_path / "file" / "usage"))
+
+    async def run():
+        await ledger.startup()
+        ledger.record("alice", "gpt-4o-mini", 10, 5)
+        with pytest.raises(LedgerUnavailable):
+            await ledger.query(T0, T0 + HOUR)
+        await ledger.shutdown()
+
+    asyncio.run(run())
+    assert not ledger.available
+    assert ledger.stats()["unrecorded"] == 1
+
+def test_failed_flushes_keep_a_bounded_buffer(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "missing"), max_buffer=3)  # segments cannot be written
+
+    async def run():
+        for i in range(2):
+            ledger.record("alice", "gpt-4o-mini", i, 0, now=T0)
+        assert await ledger.flush() == 0
+        for i in range(2, 5):
+            ledger.record("alice", "gpt-4o-mini", i, 0, now=T0)
+        assert await ledger.flush() == 0
+
+    asyncio.run(run())
+    assert [record[3] for record in ledger._buffer] == [2, 3, 4]
+    assert ledger.stats()["unrecorded"] == 2 and ledger.flush_errors == 2
@@ -0,0 +1,55 @@
+
+import numpy as np
+from src.services.vector_index import VectorStore, open_snapshot, write_collection
+
+def make_vectors(count, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+def test_exact_search_matches_brute_force(tmp_path):
+    vectors = make_vectors(500)
+    write_collection(str(tmp_path / "docs"), vectors, contents=[f"doc {i}" for i in range(500)])
+    snapshot = open_snapshot(str(tmp_path / "docs"))
+
+    query = vectors[42]
+    results = snapshot.search(query, 5)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:5]
+
+    assert [r["id"] for r in results] == [str(i) for i in expected]
+    assert results[0]["id"] == "42"
+    assert results[0]["content"] == "doc 42"
+
+def test_metadata_filter(tmp_path):
+    vectors = make_vectors(200)
+    metadata = [{"lang": "en" if i % 2 else "fr", "tag": i % 5} for i in range(200)]
+    write_collection(str(tmp_path / "docs"), vectors, metadata=metadata)
+    snapshot = open_snapshot(str(tmp_path / "docs"))
+
+    results = snapshot.search(vectors[0], 10, filter={"lang": "en", "tag": [1, 3]})
+    assert results
+    assert all(r["metadata"]["lang"] == "en" and r["metadata"]["tag"] in (1, 3) for r in results)
+    assert snapshot.search(vectors[0], 10, filter={"lang": "de"}) == []
+
+def test_ivf_recall_against_exact(tmp_path):
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(20, 16))
+    vectors = (centers[rng.integers(0, 20, 4000)] + rng.normal(scale=0.3, size=(4000, 16))).astype(np.float32)
+    write_collection(str(tmp_path / "big"), vectors, ivf_threshold=1000)
+    snapshot = open_snapshot(str(tmp_path / "big"))
+    assert snapshot.ivf is not None
+
+    hits = 0
+    for row in range(0, 4000, 100):
+        approx = {r["id"] for r in snapshot.search(vectors[row], 10)}
+        exact = {r["id"] for r in snapshot.search(vectors[row], 10, exact=True)}
+        hits += len(approx & exact)
+    assert hits / (40 * 10) >= 0.9
+
+def test_store_rejects_unsafe_collection_names(tmp_path):
+    store = VectorStore(str(tmp_path))
+    try:
+        store.get("../etc")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
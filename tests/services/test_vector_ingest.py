@@ -0,0 +1,85 @@
+
+import asyncio
+import json
+import numpy as np
+import pytest
+from src.services.vector_index import VectorStore
+from src.services.vector_ingest import delete_ids, ingest_ndjson, ingest_raw
+
+def ndjson_body(rows, chunk_size=100):
+    data = "\n".join(json.dumps(row) for row in rows).encode()
+
+    async def body():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+    return body()
+
+def test_ndjson_upsert_and_delete(tmp_path):
+    store = VectorStore(str(tmp_path))
+    rows = [{"id": f"d{i}", "vector": [float(i == j) for j in range(4)], "content": f"c{i}"} for i in range(4)]
+
+    async def run():
+        result = await ingest_ndjson(store, "docs", ndjson_body(rows))
+        assert result == {"collection": "docs", "upserted": 4, "deleted": 0, "count": 4}
+
+        # Re-upserting an id replaces its previous row
+        await ingest_ndjson(store, "docs", ndjson_body([{"id": "d0", "vector": [0, 0, 0, 1]}]))
+        hits = store.get("docs").search(np.array([0, 0, 0, 1], dtype=np.float32), 2)
+        assert sorted(h["id"] for h in hits) == ["d0", "d3"]
+
+        result = await delete_ids(store, "docs", ["d3"])
+        assert result["count"] == 3
+        hits = store.get("docs").search(np.array([0, 0, 0, 1], dtype=np.float32), 1)
+        assert hits[0]["id"] == "d0"
+
+    asyncio.run(run())
+
+def test_failed_upload_is_not_visible(tmp_path):
+    store = VectorStore(str(tmp_path))
+    good = [{"id": "a", "vector": [1, 0]}]
+    bad = [{"id": "b", "vector": [0, 1]}, {"id": "c", "vector": [1]}]
+
+    async def run():
+        await ingest_ndjson(store, "docs", ndjson_body(good))
+        snapshot = store.get("docs").snapshot
+        with pytest.raises(ValueError):
+            await ingest_ndjson(store, "docs", ndjson_body(bad))
+        assert store.get("docs").snapshot is snapshot
+        assert store.get("docs").snapshot.count == 1
+
+        # The next writer truncates the aborted tail
+        await ingest_ndjson(store, "docs", ndjson_body([{"id": "d", "vector": [0, 1]}]))
+        hits = store.get("docs").search(np.array([0, 1], dtype=np.float32), 5)
+        assert [h["id"] for h in hits] == ["d", "a"]
+
+    asyncio.run(run())
+
+def test_malformed_vectors_are_rejected(tmp_path):
+    store = VectorStore(str(tmp_path))
+
+    async def run():
+        await ingest_ndjson(store, "docs", ndjson_body([{"id": "a", "vector": [1, 0]}]))
+        for vector in (7, "ab", [1, "x"], [1, None]):
+            with pytest.raises(ValueError, match="list of numbers"):
+                await ingest_ndjson(store, "docs", ndjson_body([{"id": "a", "vector": [0, 1]},
+                                                                 {"id": "b", "vector": vector}]))
+        assert store.get("docs").snapshot.count == 1
+
+    asyncio.run(run())
+
+def test_raw_float32_ingest(tmp_path):
+    store = VectorStore(str(tmp_path))
+    vectors = np.random.default_rng(0).normal(size=(50, 3)).astype(np.float32)
+
+    async def body():
+        data = vectors.tobytes()
+        for start in range(0, len(data), 37):  # chunks that split rows
+            yield data[start:start + 37]
+
+    async def run():
+        result = await ingest_raw(store, "raw", body(), dim=3, id_prefix="r")
+        assert result["count"] == 50
+        hits = store.get("raw").search(vectors[17], 1)
+        assert hits[0]["id"] == "r17"
+
+    asyncio.run(run())